@@ -5,3 +5,4 @@
 from . import models
 from . import wizard
 from . import report
+from . import cli
@@ -18,9 +18,11 @@
     ],
     'data': [
         'wizard/mis_builder_dashboard.xml',
+        'wizard/mis_builder_index_advisor.xml',
         'views/mis_builder.xml',
         'security/ir.model.access.csv',
         'security/mis_builder_security.xml',
+        'data/mis_builder_cron.xml',
         'report/report_mis_report_instance.xml',
     ],
     'test': [
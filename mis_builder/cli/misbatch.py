@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Batch computation of MIS report instances.
+
+Compute a selection of report instances, optionally at several base
+dates, on a pool of processes, and write their results to an output
+directory::
+
+    openerp-server misbatch -c odoo.cfg -d db --output-dir results \\
+        --name 'Monthly%' --date 2016-01-31 --date 2016-02-29 \\
+        --format json --format csv --format xls --workers 4
+
+Each worker process computes instances on its own cursor, in a
+transaction that is rolled back. The time of each computation is logged,
+and written with the list of result files in misbatch.json in the output
+directory.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import xlwt
+
+import openerp
+from openerp import api, SUPERUSER_ID
+from openerp.cli import Command
+
+_logger = logging.getLogger(__name__)
+
+FORMATS = ('json', 'csv', 'xls')
+
+
+def _slug(name):
+    return re.sub(r'[^a-zA-Z0-9]+', '_', name).strip('_').lower()
+
+
+def _iter_rows(result):
+    """ Yield the header and content rows of the result of
+    mis.report.instance.compute(), as lists of the kpi or column name
+    followed by the values (the raw value when there is one, otherwise
+    the rendered value) """
+    for table in result:
+        for header in table['header']:
+            yield [header['kpi_name']] + \
+                [u' '.join(filter(None, [col.get('name'), col.get('date')]))
+                 for col in header['cols']]
+        for row in table['content']:
+            yield [row['kpi_name']] + \
+                [col.get('val') if col.get('val') is not None
+                 else col.get('val_r') or u''
+                 for col in row['cols']]
+
+
+def write_json(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True, default=unicode)
+
+
+def write_csv(result, path):
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        for row in _iter_rows(result):
+            writer.writerow([unicode(v).encode('utf-8') for v in row])
+
+
+def write_xls(result, path):
+    workbook = xlwt.Workbook(encoding='utf-8')
+    sheet = workbook.add_sheet('MIS')
+    bold = xlwt.easyxf('font: bold on')
+    for r, row in enumerate(_iter_rows(result)):
+        sheet.write(r, 0, row[0], bold)
+        for c, value in enumerate(row[1:], 1):
+            sheet.write(r, c, value)
+    workbook.save(path)
+
+
+WRITERS = {
+    'json': write_json,
+    'csv': write_csv,
+    'xls': write_xls,
+}
+
+
+def compute_job(job):
+    """ Compute an instance at a date in a worker process, and write its
+    result in each format. Returns a dictionary describing the job, with
+    the time of the computation and the result files or the error. """
+    dbname, instance_id, date, output_dir, formats = job
+    res = {
+        'instance_id': instance_id,
+        'date': date,
+    }
+    registry = openerp.registry(dbname)
+    with api.Environment.manage():
+        cr = registry.cursor()
+        try:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            instance = env['mis.report.instance'].browse(instance_id)
+            res['name'] = instance.name
+            if date:
+                instance.date = date
+            start = time.time()
+            result = instance.compute()
+            res['time'] = time.time() - start
+            base_name = '%d-%s-%s' % (instance.id, _slug(instance.name),
+                                      instance.pivot_date)
+            res['files'] = []
+            for fmt in formats:
+                path = os.path.join(output_dir, '%s.%s' % (base_name, fmt))
+                WRITERS[fmt](result, path)
+                res['files'].append(path)
+        except Exception as e:
+            _logger.error("computation of instance %s failed",
+                          instance_id, exc_info=True)
+            res['error'] = unicode(e)
+        finally:
+            cr.rollback()
+            cr.close()
+    return res
+
+
+def select_instances(env, instance_ids=None, name=None):
+    """ Return the ids of the instances to compute """
+    domain = []
+    if instance_ids:
+        domain.append(('id', 'in', instance_ids))
+    if name:
+        domain.append(('name', '=ilike', name))
+    return env['mis.report.instance'].search(domain).ids
+
+
+class Misbatch(Command):
+    """ Compute MIS report instances in parallel processes """
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog='%s misbatch' % sys.argv[0].split('/')[-1],
+            description=self.__doc__)
+        parser.add_argument('--output-dir', required=True)
+        parser.add_argument('--instance', type=int, action='append',
+                            dest='instance_ids', metavar='ID',
+                            help='id of an instance to compute '
+                                 '(default: all instances)')
+        parser.add_argument('--name',
+                            help='name pattern of the instances to '
+                                 'compute, with %% wildcards')
+        parser.add_argument('--date', action='append', dest='dates',
+                            help='base date of the computation '
+                                 '(default: the date of each instance)')
+        parser.add_argument('--format', action='append', dest='formats',
+                            choices=FORMATS,
+                            help='format of the results (default: json)')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count())
+        args, server_args = parser.parse_known_args(cmdargs)
+
+        openerp.tools.config.parse_config(server_args)
+        dbname = openerp.tools.config['db_name']
+        if not dbname:
+            parser.error('a database is required (-d)')
+        if not os.path.isdir(args.output_dir):
+            os.makedirs(args.output_dir)
+
+        registry = openerp.registry(dbname)
+        with api.Environment.manage():
+            cr = registry.cursor()
+            try:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                instance_ids = select_instances(
+                    env, args.instance_ids, args.name)
+            finally:
+                cr.close()
+        # the worker processes must open their own connections
+        openerp.sql_db.close_all()
+
+        jobs = [(dbname, instance_id, date, args.output_dir,
+                 args.formats or ['json'])
+                for instance_id in instance_ids
+                for date in args.dates or [None]]
+        _logger.info("computing %d instances with %d workers",
+                     len(jobs), args.workers)
+        start = time.time()
+        results = []
+        pool = multiprocessing.Pool(max(1, min(args.workers, len(jobs))))
+        try:
+            for res in pool.imap_unordered(compute_job, jobs):
+                results.append(res)
+                if 'error' in res:
+                    _logger.error("[%d/%d] %s at %s: %s",
+                                  len(results), len(jobs),
+                                  res.get('name', res['instance_id']),
+                                  res['date'] or 'instance date',
+                                  res['error'])
+                else:
+                    _logger.info("[%d/%d] %s at %s: %.3fs",
+                                 len(results), len(jobs), res['name'],
+                                 res['date'] or 'instance date',
+                                 res['time'])
+        finally:
+            pool.terminate()
+        summary = {
+            'database': dbname,
+            'time': time.time() - start,
+            'jobs': sorted(results, key=lambda r: (r['instance_id'],
+                                                   r['date'])),
+        }
+        with open(os.path.join(args.output_dir, 'misbatch.json'), 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        _logger.info("computed %d instances in %.3fs, %d errors",
+                     len(results), summary['time'],
+                     len([r for r in results if 'error' in r]))
+        if any('error' in r for r in results):
+            sys.exit(1)
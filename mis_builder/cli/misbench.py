@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Benchmark suite for MIS Builder.
+
+Generate a synthetic ledger (chart of accounts, fiscal years and periods,
+posted moves) and a large report template in a dedicated company::
+
+    openerp-server misbench generate -c odoo.cfg -d db --lines 2000000
+
+Then time the main steps of the report computation and rendering, write
+the results to a json file, and compare them to a previous run::
+
+    openerp-server misbench run -c odoo.cfg -d db \\
+        --output after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import sys
+import time
+
+import openerp
+from openerp import api, fields, SUPERUSER_ID
+from openerp.cli import Command
+
+from ..models import aep, mis_builder
+
+_logger = logging.getLogger(__name__)
+
+BENCH_NAME = 'MIS Builder Benchmark'
+BENCH_CODE = 'misbench'
+# account classes, with the type of their leaf accounts
+ACCOUNT_CLASSES = [
+    ('1', 'account.data_account_type_liability'),
+    ('2', 'account.data_account_type_asset'),
+    ('3', 'account.data_account_type_asset'),
+    ('4', 'account.data_account_type_liability'),
+    ('5', 'account.data_account_type_asset'),
+    ('6', 'account.data_account_type_expense'),
+    ('7', 'account.data_account_type_income'),
+]
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+class LedgerGenerator(object):
+    """ Generate a synthetic ledger and report in a dedicated company.
+
+    Accounts, fiscal years and the report are created with the ORM.
+    Moves and move lines are inserted in bulk with SQL, by cloning
+    a template move created with the ORM, so all the required columns
+    get sensible values.
+    """
+
+    def __init__(self, env, seed=1):
+        self.env = env
+        self.cr = env.cr
+        self.seed = seed
+
+    def _sql_value(self, value):
+        return self.cr.mogrify('%s', (value,))
+
+    def _get_columns(self, table):
+        self.cr.execute("SELECT column_name FROM information_schema.columns "
+                        "WHERE table_name = %s AND column_name != 'id' "
+                        "ORDER BY ordinal_position", (table,))
+        return [r[0] for r in self.cr.fetchall()]
+
+    def _clone(self, table, template_id, overrides, sources,
+               returning=False):
+        """ Insert rows in table, one per row of sources, copying the
+        template row except for the columns in overrides, which
+        map column names to sql expressions """
+        columns = self._get_columns(table)
+        select = [overrides.get(c, 't."%s"' % c) for c in columns]
+        sql = 'INSERT INTO %s (%s) SELECT %s FROM %s t, %s ' \
+            'WHERE t.id = %s' % (
+            table,
+            ', '.join('"%s"' % c for c in columns),
+            ', '.join(select),
+            table, sources, self._sql_value(template_id))
+        if not returning:
+            self.cr.execute(sql)
+            return None
+        self.cr.execute(sql + ' RETURNING id')
+        return [r[0] for r in self.cr.fetchall()]
+
+    def _create_company(self):
+        return self.env['res.company'].create({
+            'name': BENCH_NAME,
+            'currency_id': self.env.user.company_id.currency_id.id,
+        })
+
+    def _create_accounts(self, company, nb_accounts):
+        account_model = self.env['account.account'].with_context(
+            defer_parent_store_computation=True)
+        view_type = self.env.ref('account.data_account_type_view')
+        root = account_model.create({
+            'name': BENCH_NAME,
+            'code': BENCH_CODE,
+            'type': 'view',
+            'user_type': view_type.id,
+            'company_id': company.id,
+        })
+        leaves_by_class = {}
+        nb_leaves = max(1, nb_accounts // (len(ACCOUNT_CLASSES) * 10))
+        for class_code, user_type_xmlid in ACCOUNT_CLASSES:
+            user_type = self.env.ref(user_type_xmlid)
+            class_account = account_model.create({
+                'name': 'Class %s' % class_code,
+                'code': class_code,
+                'type': 'view',
+                'user_type': view_type.id,
+                'parent_id': root.id,
+                'company_id': company.id,
+            })
+            leaves = leaves_by_class[class_code] = []
+            for sub in range(10):
+                sub_code = '%s%d' % (class_code, sub)
+                sub_account = account_model.create({
+                    'name': 'Group %s' % sub_code,
+                    'code': sub_code,
+                    'type': 'view',
+                    'user_type': view_type.id,
+                    'parent_id': class_account.id,
+                    'company_id': company.id,
+                })
+                for i in range(nb_leaves):
+                    leaves.append(account_model.create({
+                        'name': 'Account %s%03d' % (sub_code, i),
+                        'code': '%s%03d' % (sub_code, i),
+                        'type': 'other',
+                        'user_type': user_type.id,
+                        'parent_id': sub_account.id,
+                        'company_id': company.id,
+                    }).id)
+        self.env['account.account']._parent_store_compute()
+        return root, leaves_by_class
+
+    def _create_fiscal_years(self, company, first_year, nb_years):
+        fy_model = self.env['account.fiscalyear']
+        for year in range(first_year, first_year + nb_years):
+            fy = fy_model.create({
+                'name': '%s %d' % (BENCH_CODE, year),
+                'code': '%s%d' % (BENCH_CODE[:2].upper(), year),
+                'date_start': '%d-01-01' % year,
+                'date_stop': '%d-12-31' % year,
+                'company_id': company.id,
+            })
+            fy.create_period()
+        return self.env['account.period'].search(
+            [('company_id', '=', company.id),
+             ('special', '=', False)], order='date_start')
+
+    def _create_moves(self, company, periods, leaves_by_class, nb_lines):
+        journal = self.env['account.journal'].create({
+            'name': BENCH_NAME,
+            'code': 'MISB',
+            'type': 'general',
+            'company_id': company.id,
+        })
+        debit_accounts = sum([leaves_by_class[c] for c in '2356'], [])
+        credit_accounts = sum([leaves_by_class[c] for c in '147'], [])
+        template = self.env['account.move'].create({
+            'journal_id': journal.id,
+            'period_id': periods[0].id,
+            'date': periods[0].date_start,
+            'line_id': [
+                (0, 0, {'name': BENCH_CODE,
+                        'account_id': debit_accounts[0],
+                        'debit': 1.0}),
+                (0, 0, {'name': BENCH_CODE,
+                        'account_id': credit_accounts[0],
+                        'credit': 1.0}),
+            ],
+        })
+        template_line = template.line_id[0]
+        self.cr.execute('SELECT setseed(%s)', (1.0 / (self.seed + 1),))
+        now = "(now() at time zone 'UTC')"
+        nb_moves = max(1, nb_lines // 2 // len(periods))
+        for period in periods:
+            days = (fields.Date.from_string(period.date_stop) -
+                    fields.Date.from_string(period.date_start)).days
+            move_ids = self._clone('account_move', template.id, {
+                'name': "'%s/' || g" % BENCH_CODE,
+                'period_id': self._sql_value(period.id),
+                'date': '%s::date + floor(random() * %d)::int' %
+                        (self._sql_value(period.date_start), days + 1),
+                'state': "'posted'",
+                'create_date': now,
+                'write_date': now,
+            }, 'generate_series(1, %d) AS g' % nb_moves, returning=True)
+            amount = 'round(((m.id * 7919) % 100000) / 100.0, 2)'
+            self._clone('account_move_line', template_line.id, {
+                'move_id': 'm.id',
+                'period_id': 'm.period_id',
+                'date': 'm.date',
+                'account_id':
+                    'CASE WHEN side = 0 '
+                    'THEN (%s)[1 + floor(random() * %d)::int] '
+                    'ELSE (%s)[1 + floor(random() * %d)::int] END' %
+                    (self._sql_value(debit_accounts), len(debit_accounts),
+                     self._sql_value(credit_accounts),
+                     len(credit_accounts)),
+                'debit': 'CASE WHEN side = 0 THEN %s ELSE 0 END' % amount,
+                'credit': 'CASE WHEN side = 1 THEN %s ELSE 0 END' % amount,
+                'state': "'valid'",
+                'create_date': now,
+                'write_date': now,
+            }, '(SELECT id, period_id, date FROM account_move '
+               'WHERE id = ANY(%s)) m, generate_series(0, 1) AS side' %
+               self._sql_value(move_ids))
+            _logger.info('generated %d moves in period %s',
+                         len(move_ids), period.name)
+        template.unlink()
+        self.cr.execute('ANALYZE account_move')
+        self.cr.execute('ANALYZE account_move_line')
+
+    def _create_report(self, root, periods, nb_kpis):
+        kpis = []
+
+        def add_kpi(name, expression, **kwargs):
+            if len(kpis) < nb_kpis:
+                vals = {
+                    'name': name,
+                    'description': name,
+                    'expression': expression,
+                    'sequence': len(kpis),
+                }
+                vals.update(kwargs)
+                kpis.append((0, 0, vals))
+
+        for class_code, _ in ACCOUNT_CLASSES:
+            add_kpi('c%s' % class_code, 'bal[%s%%]' % class_code)
+            add_kpi('c%s_i' % class_code, 'bali[%s%%]' % class_code)
+            add_kpi('c%s_e' % class_code, 'bale[%s%%]' % class_code)
+        add_kpi('result', 'c7 + c6')
+        add_kpi('margin', 'c7 and -(c7 + c6) / c7', type='pct')
+        add_kpi('c6_journal',
+                "bal[6%][('journal_id.code', '=', 'MISB')]")
+        for class_code, _ in ACCOUNT_CLASSES:
+            for sub in range(10):
+                sub_code = '%s%d' % (class_code, sub)
+                add_kpi('s%s' % sub_code, 'bal[%s%%]' % sub_code)
+                add_kpi('s%s_d' % sub_code, 'deb[%s%%]' % sub_code)
+                add_kpi('s%s_c' % sub_code, 'crd[%s%%]' % sub_code)
+                add_kpi('s%s_e' % sub_code, 'bale[%s%%]' % sub_code)
+        report = self.env['mis.report'].create({
+            'name': BENCH_NAME,
+            'code': BENCH_CODE,
+            'kpi_ids': kpis,
+        })
+        last_year_periods = periods[-12:]
+        period_vals = [(0, 0, {
+            'name': 'M%02d' % (i + 1),
+            'type': 'fp',
+            'offset': i - len(last_year_periods) + 1,
+            'duration': 1,
+            'sequence': i,
+        }) for i in range(len(last_year_periods))]
+        period_vals.append((0, 0, {
+            'name': 'YTD',
+            'type': 'fp',
+            'offset': -len(last_year_periods) + 1,
+            'duration': len(last_year_periods),
+            'sequence': len(last_year_periods),
+        }))
+        return self.env['mis.report.instance'].create({
+            'name': BENCH_NAME,
+            'report_id': report.id,
+            'root_account': root.id,
+            'date': periods[-1].date_stop,
+            'period_ids': period_vals,
+        })
+
+    def generate(self, nb_accounts, first_year, nb_years, nb_lines,
+                 nb_kpis):
+        if self.env['mis.report.instance'].search(
+                [('name', '=', BENCH_NAME)]):
+            raise ValueError('benchmark data already generated')
+        company = self._create_company()
+        root, leaves_by_class = self._create_accounts(company, nb_accounts)
+        periods = self._create_fiscal_years(company, first_year, nb_years)
+        self._create_moves(company, periods, leaves_by_class, nb_lines)
+        return self._create_report(root, periods, nb_kpis)
+
+
+def _clear_caches():
+    """ Clear the caches of the computations of the process """
+    for cache in (mis_builder._plan_cache, aep._data_cache,
+                  aep._strategy_cache, aep._delta_cache):
+        cache.clear()
+
+
+class Benchmark(object):
+    """ Time the computation and rendering of the benchmark report """
+
+    def __init__(self, env, runs=3):
+        self.env = env
+        self.runs = runs
+        self.timings = {}
+
+    def _time(self, name, func):
+        durations = []
+        try:
+            for i in range(self.runs):
+                self.env.invalidate_all()
+                # time cold computations, not hits of the caches
+                # filled by the previous runs
+                _clear_caches()
+                with self.env.cr.savepoint():
+                    start = time.time()
+                    func()
+                    durations.append(time.time() - start)
+        except Exception as e:
+            _logger.warning('benchmark %s failed', name, exc_info=True)
+            self.timings[name] = {'error': unicode(e)}
+            return
+        self.timings[name] = {
+            'min': min(durations),
+            'median': _median(durations),
+            'max': max(durations),
+            'runs': len(durations),
+        }
+        _logger.info('%s: %.3fs', name, self.timings[name]['median'])
+
+    def run(self):
+        cr = self.env.cr
+        instance = self.env['mis.report.instance'].search(
+            [('name', '=', BENCH_NAME)])
+        if not instance:
+            raise ValueError('benchmark data not generated')
+        report = instance.report_id
+        period = instance.period_ids.filtered('valid')[0]
+        lang_id = self.env['res.lang'].search(
+            [('code', '=', self.env.user.lang or 'en_US')]).id
+        aep = report._prepare_aep(instance.root_account)
+
+        self._time('prepare_aep',
+                   lambda: report._prepare_aep(instance.root_account))
+        self._time('do_queries', lambda: aep.do_queries(
+            period.date_from, period.date_to,
+            period.period_from, period.period_to,
+            instance.target_move))
+        self._time('report_compute',
+                   lambda: period._compute(report, lang_id, aep))
+        self._time('instance_compute', instance.compute)
+        self._time('xls_export', lambda: openerp.report.render_report(
+            cr, self.env.uid, instance.ids, 'mis.report.instance.xls',
+            {'model': 'mis.report.instance'}, dict(self.env.context)))
+        self._time('pdf_render', lambda: self.env['report'].get_pdf(
+            instance, 'mis_builder.report_mis_report_instance'))
+
+        cr.execute('SELECT count(*) FROM account_move_line '
+                   'WHERE company_id = %s', (instance.company_id.id,))
+        nb_lines = cr.fetchone()[0]
+        return {
+            'meta': {
+                'date': datetime.datetime.utcnow().isoformat(),
+                'database': cr.dbname,
+                'move_lines': nb_lines,
+                'accounts': self.env['account.account'].search_count(
+                    [('company_id', '=', instance.company_id.id)]),
+                'kpis': len(report.kpi_ids),
+                'periods': len(instance.period_ids),
+                'runs': self.runs,
+            },
+            'timings': self.timings,
+        }
+
+
+def compare(previous, current, out=sys.stdout):
+    """ Print a comparison of the median timings of two runs """
+    out.write('%-20s %10s %10s %8s\n' %
+              ('benchmark', 'previous', 'current', 'ratio'))
+    for name in sorted(current['timings']):
+        cur = current['timings'][name].get('median')
+        prev = previous['timings'].get(name, {}).get('median')
+        ratio = cur and prev and '%.2f' % (cur / prev) or '-'
+        out.write('%-20s %10s %10s %8s\n' % (
+            name,
+            prev is not None and '%.3f' % prev or '-',
+            cur is not None and '%.3f' % cur or '-',
+            ratio))
+
+
+class Misbench(Command):
+    """ Generate benchmark data and benchmark MIS Builder """
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog='%s misbench' % sys.argv[0].split('/')[-1],
+            description=self.__doc__)
+        subparsers = parser.add_subparsers(dest='action')
+        generate_parser = subparsers.add_parser(
+            'generate', help='generate the benchmark ledger and report')
+        generate_parser.add_argument('--accounts', type=int, default=700)
+        generate_parser.add_argument('--first-year', type=int,
+                                     default=datetime.date.today().year - 1)
+        generate_parser.add_argument('--years', type=int, default=2)
+        generate_parser.add_argument('--lines', type=int, default=1000000)
+        generate_parser.add_argument('--kpis', type=int, default=300)
+        generate_parser.add_argument('--seed', type=int, default=1)
+        run_parser = subparsers.add_parser(
+            'run', help='time the computation of the benchmark report')
+        run_parser.add_argument('--runs', type=int, default=3)
+        run_parser.add_argument('--output', default='misbench.json')
+        run_parser.add_argument('--compare', metavar='PREVIOUS_OUTPUT')
+        args, server_args = parser.parse_known_args(cmdargs)
+
+        openerp.tools.config.parse_config(server_args)
+        dbname = openerp.tools.config['db_name']
+        if not dbname:
+            parser.error('a database is required (-d)')
+
+        registry = openerp.registry(dbname)
+        with api.Environment.manage():
+            cr = registry.cursor()
+            try:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                if args.action == 'generate':
+                    LedgerGenerator(env, args.seed).generate(
+                        args.accounts, args.first_year, args.years,
+                        args.lines, args.kpis)
+                    cr.commit()
+                else:
+                    result = Benchmark(env, args.runs).run()
+                    with open(args.output, 'w') as f:
+                        json.dump(result, f, indent=2, sort_keys=True)
+                    if args.compare:
+                        with open(args.compare) as f:
+                            compare(json.load(f), result)
+                    cr.rollback()
+            finally:
+                cr.close()
@@ -4,3 +4,4 @@
 
 from . import mis_builder
 from . import aep
+from . import journal_change
@@ -83,13 +83,35 @@ True
 True
 >>> AccountingNone == None
 True
+
+Operands that declare _defers_accounting_none, such as vectors,
+apply the operation themselves:
+
+>>> class Operand(object):
+...     _defers_accounting_none = True
+...     def __rmul__(self, other):
+...         return 'deferred'
+>>> AccountingNone * Operand()
+'deferred'
 """
 
 __all__ = ['AccountingNone']
 
 
+def _defer(method):
+    """ Return NotImplemented for operands that declare
+    _defers_accounting_none, to let Python call their reflected method """
+    def wrapper(self, other):
+        if getattr(other, '_defers_accounting_none', False):
+            return NotImplemented
+        return method(self, other)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
 class AccountingNoneType(object):
 
+    @_defer
     def __add__(self, other):
         if other is None:
             return AccountingNone
@@ -97,21 +119,25 @@ class AccountingNoneType(object):
 
     __radd__ = __add__
 
+    @_defer
     def __sub__(self, other):
         if other is None:
             return AccountingNone
         return -other
 
+    @_defer
     def __rsub__(self, other):
         if other is None:
             return AccountingNone
         return other
 
+    @_defer
     def __iadd__(self, other):
         if other is None:
             return AccountingNone
         return other
 
+    @_defer
     def __isub__(self, other):
         if other is None:
             return AccountingNone
@@ -126,6 +152,7 @@ class AccountingNoneType(object):
     def __neg__(self):
         return self
 
+    @_defer
     def __div__(self, other):
         if other is AccountingNone:
             return AccountingNone
@@ -134,6 +161,7 @@ class AccountingNoneType(object):
     def __rdiv__(self, other):
         raise ZeroDivisionError
 
+    @_defer
     def __floordiv__(self, other):
         if other is AccountingNone:
             return AccountingNone
@@ -142,6 +170,7 @@ class AccountingNoneType(object):
     def __rfloordiv__(self, other):
         raise ZeroDivisionError
 
+    @_defer
     def __truediv__(self, other):
         if other is AccountingNone:
             return AccountingNone
@@ -150,6 +179,7 @@ class AccountingNoneType(object):
     def __rtruediv__(self, other):
         raise ZeroDivisionError
 
+    @_defer
     def __mul__(self, other):
         if other is None or other is AccountingNone:
             return AccountingNone
@@ -169,12 +199,15 @@ class AccountingNoneType(object):
     def __bool__(self):
         return False
 
+    @_defer
     def __eq__(self, other):
         return other == 0 or other is None or other is AccountingNone
 
+    @_defer
     def __lt__(self, other):
         return 0 < other
 
+    @_defer
     def __gt__(self, other):
         return 0 > other
 
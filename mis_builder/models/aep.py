@@ -2,19 +2,49 @@
 # © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import json
+import logging
 import re
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
 
+from openerp import fields
 from openerp.exceptions import Warning as UserError
 from openerp.models import expression
 from openerp.tools.safe_eval import safe_eval
 from openerp.tools.translate import _
 from .accounting_none import AccountingNone
+from .budget import NULL_BUDGET, BudgetExceeded, ExceededData
+from .data_cache import DataCache
+from .profiler import NULL_PROFILER
+from .query_result import get_query, get_sql
+from .vector import Vector
+
+_logger = logging.getLogger(__name__)
 
 MODE_VARIATION = 'p'
 MODE_INITIAL = 'i'
 MODE_END = 'e'
 
+# strategies of do_queries() to query the sums of the (domain, mode)
+# keys of a period (see _get_strategy)
+STRATEGY_AUTO = 'auto'
+STRATEGY_READ_GROUP = 'read_group'
+STRATEGY_MERGED = 'merged'
+# estimated cost of each additional statement (round trip, parsing and
+# planning, ORM processing), in units of the PostgreSQL planner costs
+STATEMENT_COST = 100.0
+
+# sums of debit and credit recently queried by do_queries(), with the
+# high-water mark of the journal items, see get_cached_data()
+_data_cache = DataCache()
+# strategies chosen by do_queries() for a set of keys, see _get_strategy()
+_strategy_cache = DataCache()
+# sums of debit and credit of open periods, with the high-water mark of
+# the journal items and the time of their last full query, see
+# _get_delta_base()
+_delta_cache = DataCache()
+
 
 class AccountingExpressionProcessor(object):
     """ Processor for accounting expressions.
@@ -45,6 +75,9 @@ class AccountingExpressionProcessor(object):
         * for each period, call do_queries(), then call replace_expr() for each
           expression to replace accounting variables with their resulting value
           for the given period.
+        * alternatively, call do_queries() and get_data() for each period,
+          then call replace_expr_vector() for each expression to replace
+          accounting variables with vectors of their values for all periods.
 
     How it works:
         * by accumulating the expressions before hand, it ensures to do the
@@ -53,7 +86,9 @@ class AccountingExpressionProcessor(object):
         * it queries using the orm read_group which reduces to a query with
           sum on debit and credit and group by on account_id (note: it seems
           the orm then does one query per account to fetch the account
-          name...);
+          name...), or with a statement summing all domains and modes at
+          once when the database estimates it is cheaper (see
+          _get_strategy);
         * additionally, one query per view/consolidation account is done to
           discover the children accounts.
     """
@@ -69,8 +104,16 @@ class AccountingExpressionProcessor(object):
         # after done_parsing: {(domain, mode): list(account_ids)}
         self._map_account_ids = defaultdict(set)
         self._account_ids_by_code = defaultdict(set)
+        # {dimension value: display name}
+        self._dimension_names = {}
+        # {account_id: company_id}, loaded when converting currencies
+        self._company_id_by_account_id = None
+        # the strategy of do_queries(), chosen by the first call
+        self._strategy = None
 
     def _load_account_codes(self, account_codes, root_account):
+        # root_account may contain several account charts, whose
+        # accounts are consolidated
         account_model = self.env['account.account']
         # TODO: account_obj is necessary because _get_children_and_consol
         #       does not work in new API?
@@ -85,15 +128,15 @@ class AccountingExpressionProcessor(object):
                 # None in _account_ids_by_code, so it is consistent
                 # with what _parse_match_object returns for an
                 # empty list of account codes, ie [None]
-                exact_codes.add(root_account.code)
+                exact_codes.update(root_account.mapped('code'))
             elif '%' in account_code:
                 like_codes.add(account_code)
             else:
                 exact_codes.add(account_code)
         for account in account_model.\
                 search([('code', 'in', list(exact_codes)),
-                        ('parent_id', 'child_of', root_account.id)]):
-            if account.code == root_account.code:
+                        ('parent_id', 'child_of', root_account.ids)]):
+            if account in root_account:
                 code = None
             else:
                 code = account.code
@@ -108,7 +151,7 @@ class AccountingExpressionProcessor(object):
         for like_code in like_codes:
             for account in account_model.\
                     search([('code', '=like', like_code),
-                            ('parent_id', 'child_of', root_account.id)]):
+                            ('parent_id', 'child_of', root_account.ids)]):
                 if account.type in ('view', 'consolidation'):
                     self._account_ids_by_code[like_code].update(
                         account_obj._get_children_and_consol(
@@ -154,7 +197,10 @@ class AccountingExpressionProcessor(object):
 
     def done_parsing(self, root_account):
         """Load account codes and replace account codes by
-        account ids in map."""
+        account ids in map.
+
+        root_account is the root of the account chart, or several
+        account charts to consolidate."""
         for key, account_codes in self._map_account_ids.items():
             self._load_account_codes(account_codes, root_account)
             account_ids = set()
@@ -162,6 +208,22 @@ class AccountingExpressionProcessor(object):
                 account_ids.update(self._account_ids_by_code[account_code])
             self._map_account_ids[key] = list(account_ids)
 
+    def copy(self, env):
+        """Return a processor bound to another environment, sharing
+        the accounts resolved by this one.
+
+        This is useful to query the same expressions on several
+        cursors (eg in different threads) while resolving the
+        account codes only once.
+
+        Prerequisite: done_parsing() must have been invoked.
+        """
+        aep = self.__class__(env)
+        aep._map_account_ids = self._map_account_ids
+        aep._account_ids_by_code = self._account_ids_by_code
+        aep._company_id_by_account_id = self._company_id_by_account_id
+        return aep
+
     @classmethod
     def has_account_var(cls, expr):
         """Test if an string contains an accounting variable."""
@@ -185,7 +247,7 @@ class AccountingExpressionProcessor(object):
             account_ids = set()
             for account_code in account_codes:
                 account_ids.update(self._account_ids_by_code[account_code])
-            aml_domain.append(('account_id', 'in', tuple(account_ids)))
+            aml_domain.extend(self._get_account_domain(account_ids))
             if field == 'crd':
                 aml_domain.append(('credit', '>', 0))
             elif field == 'deb':
@@ -199,6 +261,29 @@ class AccountingExpressionProcessor(object):
         return expression.OR(aml_domains) + \
             expression.OR(date_domain_by_mode.values())
 
+    def _get_account_domain(self, account_ids):
+        """Return a domain on account.move.line selecting the move lines
+        of a set of accounts.
+
+        When the accounts are whole subtrees of the account chart, the
+        domain is a child_of the top accounts, which is much more compact
+        than the list of all account ids for drilldown actions on large
+        charts (the ORM resolves it with the parent_left/parent_right
+        index of accounts). Otherwise it is the list of account ids.
+        """
+        if not account_ids:
+            return [('account_id', 'in', ())]
+        account_model = self.env['account.account']
+        accounts = account_model.browse(list(account_ids))
+        top_ids = [account.id for account in accounts
+                   if account.parent_id.id not in account_ids]
+        if len(top_ids) < len(account_ids):
+            subtree_ids = account_model.search(
+                [('id', 'child_of', top_ids)]).ids
+            if set(subtree_ids) == set(account_ids):
+                return [('account_id', 'child_of', top_ids)]
+        return [('account_id', 'in', tuple(account_ids))]
+
     def _period_has_moves(self, period):
         move_model = self.env['account.move']
         return bool(move_model.search([('period_id', '=', period.id)],
@@ -309,16 +394,47 @@ class AccountingExpressionProcessor(object):
         return expression.normalize_domain(domain)
 
     def do_queries(self, date_from, date_to, period_from, period_to,
-                   target_move, additional_move_line_filter=None):
+                   target_move, additional_move_line_filter=None,
+                   dimension=None, profiler=NULL_PROFILER,
+                   company_rates=None, budget=NULL_BUDGET):
         """Query sums of debit and credit for all accounts and domains
         used in expressions.
 
+        If dimension is the name of a field of account.move.line,
+        the sums are also grouped by the values of this field, in the
+        same queries (see get_data_by_dimension()).
+
+        If company_rates is a dictionary {company_id: rate}, the sums
+        of each account are converted from the currency of its company
+        by multiplying them by the rate of the company.
+
+        The queries are executed within the SQL budget: the data of
+        the queries exceeding it is replaced by ExceededData, so
+        expressions using it raise BudgetExceeded.
+
+        The sums of an open period (ending today or later) are cached
+        with the high-water mark of the journal items. When the same
+        period is queried again, only the journal items created since
+        are summed and added to the cached sums, unless journal items
+        below the mark have been changed since, or the period has not
+        been queried in full for the time to live of the cache (see
+        _get_delta_base).
+
         This method must be executed after done_parsing().
         """
-        aml_model = self.env['account.move.line']
+        cache_key = self._get_cache_key(date_from, date_to,
+                                        period_from, period_to,
+                                        target_move,
+                                        additional_move_line_filter,
+                                        company_rates)
         # {(domain, mode): {account_id: (debit, credit)}}
         self._data = defaultdict(dict)
+        # {dimension value: {(domain, mode): {account_id: (debit, credit)}}}
+        self._data_by_dim = defaultdict(lambda: defaultdict(dict))
+        if company_rates:
+            company_id_by_account_id = self._get_company_id_by_account_id()
         domain_by_mode = {}
+        domains = OrderedDict()
         for key in self._map_account_ids:
             domain, mode = key
             if mode not in domain_by_mode:
@@ -330,37 +446,493 @@ class AccountingExpressionProcessor(object):
             domain.append(('account_id', 'in', self._map_account_ids[key]))
             if additional_move_line_filter:
                 domain.extend(additional_move_line_filter)
-            # fetch sum of debit/credit, grouped by account_id
-            accs = aml_model.read_group(domain,
-                                        ['debit', 'credit', 'account_id'],
-                                        ['account_id'])
+            domains[key] = domain
+        mark = self.get_mark()
+        delta_base = None
+        full_time = time.time()
+        is_open = not dimension and date_to >= fields.Date.today()
+        if mark is not None and is_open:
+            delta_base = self._get_delta_base(cache_key)
+        if delta_base is not None:
+            # only sum the journal items created since the cached sums
+            base_mark, full_time, base_data = delta_base
+            for key, domain in domains.items():
+                domains[key] = domain + [('id', '>', base_mark[0])]
+                self._data[key] = dict(base_data[key])
+        if self._strategy is None:
+            self._strategy = self._get_strategy(domains, dimension,
+                                                budget=budget)
+        # fetch sum of debit/credit, grouped by account_id
+        if self._strategy == STRATEGY_MERGED:
+            sums_by_key = self._query_merged(domains, dimension,
+                                             profiler, budget)
+        else:
+            sums_by_key = self._query_read_group(domains, dimension,
+                                                 profiler, budget)
+        exceeded_keys = []
+        for key, sums in sums_by_key.items():
+            if sums is None:
+                self._data[key] = ExceededData()
+                exceeded_keys.append(key)
+                continue
+            for account_id, value, debit, credit in sums:
+                if company_rates:
+                    rate = company_rates[company_id_by_account_id[account_id]]
+                    debit, credit = debit * rate, credit * rate
+                if dimension:
+                    self._data_by_dim[value][key][account_id] = \
+                        (debit, credit)
+                debit_total, credit_total = \
+                    self._data[key].get(account_id, (0.0, 0.0))
+                self._data[key][account_id] = \
+                    (debit + debit_total, credit + credit_total)
+            if mark is None:
+                # the data of the current transaction may be rolled back
+                continue
+            account_ids = frozenset(self._map_account_ids[key])
+            _data_cache.put(cache_key + (key, ),
+                            (mark, account_ids, self._data[key]))
+            if is_open:
+                _delta_cache.put(cache_key + (key, ),
+                                 (mark, full_time, account_ids,
+                                  self._data[key]))
+        for value_data in self._data_by_dim.values():
+            for key in exceeded_keys:
+                value_data[key] = ExceededData()
+
+    def get_mark(self):
+        """ Return the high-water mark of the journal items: their
+        largest id and the snapshot of the transactions visible to the
+        current transaction (see mis.report.journal.change).
+
+        Return None if the current transaction has changed journal
+        items, as the data it reads may be rolled back.
+        """
+        # unlike txid_current(), txid_current_if_assigned() does not
+        # assign a transaction id to a read-only transaction (it is NULL)
+        self.env.cr.execute("""
+            SELECT (SELECT max(id) FROM account_move_line),
+                   txid_current_snapshot()::text,
+                   EXISTS(SELECT 1 FROM mis_report_journal_change
+                          WHERE txid = txid_current_if_assigned())
+        """)
+        line_id, snapshot, changed = self.env.cr.fetchone()
+        if changed:
+            return None
+        return (line_id or 0, snapshot)
+
+    def changed_since(self, mark, below_mark=False):
+        """ Return whether journal items have been changed by
+        transactions committed since the high-water mark or by the
+        current transaction, or only journal items below the mark if
+        below_mark """
+        line_id, snapshot = mark
+        self.env.cr.execute("""
+            SELECT EXISTS(
+                SELECT 1 FROM mis_report_journal_change
+                WHERE (NOT txid_visible_in_snapshot(txid, %s::txid_snapshot)
+                       OR txid = txid_current_if_assigned())
+                AND (%s OR line_id <= %s))
+        """, (snapshot, not below_mark, line_id))
+        return self.env.cr.fetchone()[0]
+
+    def _get_delta_base(self, cache_key):
+        """ Return the high-water mark, the time of the last full query
+        and the data {key: {account_id: (debit, credit)}} cached by a
+        previous do_queries() of the same open period for all keys, if
+        the journal items below the mark have not changed since, or None.
+
+        The journal items created since the mark are not changes below
+        the mark, unless their transaction was running at the time of the
+        mark (their ids may then be smaller). The period is computed in
+        full again when its last full query is older than the time to
+        live of the cache, however often it is refreshed.
+        """
+        base_mark = full_time = None
+        base_data = {}
+        for key, account_ids in self._map_account_ids.items():
+            cached = _delta_cache.get(cache_key + (key, ))
+            if cached is None or cached[2] != frozenset(account_ids):
+                return None
+            if base_mark is None:
+                base_mark, full_time = cached[:2]
+            elif cached[:2] != (base_mark, full_time):
+                return None
+            base_data[key] = cached[3]
+        if base_mark is None or \
+                time.time() - full_time > _delta_cache.ttl:
+            return None
+        if self.changed_since(base_mark, below_mark=True):
+            _logger.debug("journal items changed below the high-water "
+                          "mark %s, computing the period in full",
+                          base_mark)
+            return None
+        return base_mark, full_time, base_data
+
+    def _get_strategy(self, domains, dimension=None, budget=NULL_BUDGET):
+        """ Choose how do_queries() queries the sums of the keys of a
+        period: with a read_group per key, or with statements summing the
+        keys at once (see _get_merged_statements).
+
+        The costs of both strategies are estimated by the PostgreSQL
+        planner (EXPLAIN) on the domains of the first period, each
+        statement costing STATEMENT_COST more, within the SQL budget.
+        The strategy is chosen once per processor, ie per computation,
+        and cached for the same keys for the time to live of the cache,
+        unless the mis_builder.aep_strategy system parameter forces one
+        (read_group or merged).
+        """
+        strategy = self.env['ir.config_parameter'].sudo().get_param(
+            'mis_builder.aep_strategy', STRATEGY_AUTO)
+        if strategy in (STRATEGY_READ_GROUP, STRATEGY_MERGED):
+            return strategy
+        if len(domains) <= 1:
+            return STRATEGY_READ_GROUP
+        cache_key = (self.env.cr.dbname, bool(dimension),
+                     tuple(sorted(repr(key) for key in domains)))
+        strategy = _strategy_cache.get(cache_key)
+        if strategy is not None:
+            return strategy
+        aml_model = self.env['account.move.line']
+        select = ['"account_move_line".account_id',
+                  'SUM("account_move_line".debit)',
+                  'SUM("account_move_line".credit)']
+        if dimension:
+            select.insert(1, '"account_move_line"."%s"' % dimension)
+        statements = self._get_merged_statements(domains, dimension)
+        read_group_cost = merged_cost = 0.0
+        try:
+            with budget.statement(self.env.cr):
+                for domain in domains.values():
+                    sql, params = get_sql(get_query(aml_model, domain),
+                                          select, [])
+                    sql += ' GROUP BY %s' % ', '.join(select[:-2])
+                    read_group_cost += self._explain_cost(sql, params) + \
+                        STATEMENT_COST
+                for keys, sql, params in statements:
+                    merged_cost += self._explain_cost(sql, params) + \
+                        STATEMENT_COST
+                self.env.cr.execute("""
+                    SELECT reltuples FROM pg_class
+                    WHERE oid = 'account_move_line'::regclass
+                """)
+                rows = self.env.cr.fetchone()[0]
+        except BudgetExceeded:
+            # the queries will most likely exceed the budget too
+            return STRATEGY_READ_GROUP
+        strategy = STRATEGY_MERGED if merged_cost < read_group_cost \
+            else STRATEGY_READ_GROUP
+        _strategy_cache.put(cache_key, strategy)
+        _logger.info("accounting queries of %d keys on about %d journal "
+                     "items: %s strategy, estimated cost %.0f with a "
+                     "read_group per key, %.0f with %d merged statements",
+                     len(domains), rows, strategy,
+                     read_group_cost, merged_cost, len(statements))
+        return strategy
+
+    def _explain_cost(self, sql, params):
+        """ Return the total cost of a statement estimated by the
+        PostgreSQL planner """
+        self.env.cr.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = self.env.cr.fetchone()[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Total Cost']
+
+    def _query_read_group(self, domains, dimension, profiler, budget):
+        """ Query the sums of each key with a read_group.
+
+        Returns a dictionary {key: list of (account_id, dimension value,
+        debit, credit)}, the value being None for the keys exceeding
+        the budget. """
+        aml_model = self.env['account.move.line']
+        groupby = ['account_id']
+        if dimension:
+            groupby.append(dimension)
+        res = OrderedDict()
+        for key, domain in domains.items():
+            try:
+                with budget.statement(self.env.cr), \
+                        profiler.profile('aep_query', unicode(key)) as entry:
+                    accs = aml_model.read_group(
+                        domain, ['debit', 'credit'] + groupby,
+                        groupby, lazy=False)
+                    entry['rows'] = len(accs)
+            except BudgetExceeded:
+                res[key] = None
+                continue
+            res[key] = sums = []
             for acc in accs:
-                self._data[key][acc['account_id'][0]] = \
-                    (acc['debit'] or 0.0, acc['credit'] or 0.0)
+                value = None
+                if dimension:
+                    value = acc[dimension]
+                    if isinstance(value, tuple):
+                        # many2one: (id, display name)
+                        self._dimension_names[value[0]] = value[1]
+                        value = value[0]
+                    else:
+                        self._dimension_names.setdefault(value, value)
+                sums.append((acc['account_id'][0], value,
+                             acc['debit'] or 0.0, acc['credit'] or 0.0))
+        return res
+
+    def _get_merged_statements(self, domains, dimension=None):
+        """ Return SQL statements querying the sums of several keys at
+        once, as a list of (keys, sql, params).
+
+        The keys whose queries read the same tables (eg the journal items
+        joined with their moves, for posted moves only) are merged in one
+        statement, which scans the rows matching any key once and sums
+        the rows matching each key. """
+        aml_model = self.env['account.move.line']
+        table = '"%s"' % aml_model._table
+        # {from clause: [(key, where clause, where params)]}
+        conditions_by_from = OrderedDict()
+        for key, domain in domains.items():
+            from_clause, where_clause, where_params = \
+                get_query(aml_model, domain).get_sql()
+            conditions_by_from.setdefault(from_clause, []).append(
+                (key, where_clause or 'TRUE', where_params))
+        columns = ['account_id']
+        if dimension:
+            columns.append('"%s"' % dimension)
+        res = []
+        for from_clause, conditions in conditions_by_from.items():
+            select = list(columns)
+            params = []
+            flags = []
+            for i, (key, where_clause, where_params) \
+                    in enumerate(conditions):
+                flags.append('(%s) AS k%d' % (where_clause, i))
+                params.extend(where_params)
+                select.extend([
+                    'SUM(CASE WHEN k%d THEN debit END)' % i,
+                    'SUM(CASE WHEN k%d THEN credit END)' % i,
+                    'COUNT(CASE WHEN k%d THEN 1 END)' % i,
+                ])
+            sql = """
+                SELECT %s FROM (
+                    SELECT %s, %s.debit, %s.credit, %s FROM %s
+                ) AS aml
+                WHERE %s
+                GROUP BY %s
+            """ % (', '.join(select),
+                   ', '.join('%s.%s' % (table, c) for c in columns),
+                   table, table, ', '.join(flags), from_clause,
+                   ' OR '.join('k%d' % i for i in range(len(conditions))),
+                   ', '.join(columns))
+            res.append(([c[0] for c in conditions], sql, params))
+        return res
+
+    def _query_merged(self, domains, dimension, profiler, budget):
+        """ Query the sums of the keys with merged statements (see
+        _get_merged_statements), with the same result as
+        _query_read_group """
+        cr = self.env.cr
+        res = OrderedDict()
+        offset = 2 if dimension else 1
+        values = set()
+        for keys, sql, params in self._get_merged_statements(domains,
+                                                             dimension):
+            try:
+                with budget.statement(cr), \
+                        profiler.profile('aep_query',
+                                         unicode(keys)) as entry:
+                    cr.execute(sql, params)
+                    rows = cr.fetchall()
+                    entry['rows'] = len(rows)
+            except BudgetExceeded:
+                for key in keys:
+                    res[key] = None
+                continue
+            for key in keys:
+                res[key] = []
+            for row in rows:
+                value = None
+                if dimension:
+                    value = row[1] if row[1] is not None else False
+                    values.add(value)
+                for i, key in enumerate(keys):
+                    debit, credit, count = \
+                        row[offset + 3 * i:offset + 3 * i + 3]
+                    if count:
+                        res[key].append((row[0], value,
+                                         debit or 0.0, credit or 0.0))
+        if dimension:
+            field = self.env['account.move.line']._fields[dimension]
+            if field.type == 'many2one':
+                self._dimension_names.update(
+                    self.env[field.comodel_name].browse(
+                        [v for v in values if v]).name_get())
+                if False in values:
+                    self._dimension_names[False] = False
+            else:
+                for value in values:
+                    self._dimension_names.setdefault(value, value)
+        return res
+
+    def _get_cache_key(self, date_from, date_to, period_from, period_to,
+                       target_move, additional_move_line_filter=None,
+                       company_rates=None):
+        return (self.env.cr.dbname, self.env.uid,
+                date_from, date_to,
+                period_from.id if period_from else False,
+                period_to.id if period_to else False,
+                target_move,
+                repr(additional_move_line_filter or []),
+                repr(sorted((company_rates or {}).items())))
+
+    def get_cached_data(self, date_from, date_to, period_from, period_to,
+                        target_move, additional_move_line_filter=None,
+                        company_rates=None):
+        """Return the data of all domains and modes used in expressions,
+        as returned by get_data(), if a previous do_queries() with the same
+        arguments has queried all their accounts recently (possibly with
+        another processor, in the same process), and no journal item has
+        been changed since (see get_mark), or None.
 
-    def replace_expr(self, expr):
+        This method must be executed after done_parsing().
+        """
+        cache_key = self._get_cache_key(date_from, date_to,
+                                        period_from, period_to,
+                                        target_move,
+                                        additional_move_line_filter,
+                                        company_rates)
+        data = defaultdict(dict)
+        marks = set()
+        for key, account_ids in self._map_account_ids.items():
+            cached = _data_cache.get(cache_key + (key, ))
+            if cached is None or not cached[1].issuperset(account_ids):
+                return None
+            marks.add(cached[0])
+            data[key] = cached[2]
+        if any(self.changed_since(mark) for mark in marks):
+            return None
+        return data
+
+    def _get_company_id_by_account_id(self):
+        if self._company_id_by_account_id is None:
+            account_ids = set()
+            for ids in self._map_account_ids.values():
+                account_ids.update(ids)
+            self._company_id_by_account_id = {}
+            if account_ids:
+                self.env.cr.execute("""
+                    SELECT id, company_id FROM account_account
+                    WHERE id IN %s
+                """, (tuple(account_ids), ))
+                self._company_id_by_account_id.update(self.env.cr.fetchall())
+        return self._company_id_by_account_id
+
+    def replace_expr(self, expr, data=None):
         """Replace accounting variables in an expression by their amount.
 
         Returns a new expression string.
 
-        This method must be executed after do_queries().
+        This method must be executed after do_queries(), or with
+        the data of a period returned by get_data().
         """
+        if data is None:
+            data = self._data
+
         def f(mo):
-            field, mode, account_codes, domain = self._parse_match_object(mo)
+            return '(' + repr(self._get_value(mo, data)) + ')'
+        return self.ACC_RE.sub(f, expr)
+
+    def replace_expr_vector(self, expr, datas, variables):
+        """Replace accounting variables in an expression by variables
+        containing vectors of their amounts over several periods.
+
+        Returns a new expression string.
+
+        :param datas: the data of each period, as returned by get_data()
+                      after do_queries()
+        :param variables: a dictionary where the vectors are stored,
+                          keyed on the names of the variables used in the
+                          returned expression
+        """
+        def f(mo):
+            name = '_aep_%d' % len(variables)
+            variables[name] = Vector([self._get_value(mo, data)
+                                      for data in datas])
+            return name
+        return self.ACC_RE.sub(f, expr)
+
+    def get_data(self):
+        """Return the data queried by the last do_queries(), to be used
+        with replace_expr() or replace_expr_vector() """
+        return self._data
+
+    def get_data_by_dimension(self):
+        """Return the data queried by the last do_queries() with a
+        dimension, as a dictionary {dimension value: data} """
+        return self._data_by_dim
+
+    def get_data_by_account(self, expr, data=None):
+        """Split the data of the accounts used in an expression,
+        as a dictionary {account_id: data restricted to this account},
+        to evaluate the expression for each account with replace_expr().
+
+        Accounts without moves are omitted.
+        """
+        if data is None:
+            data = self._data
+        res = defaultdict(lambda: defaultdict(dict))
+        for mo in self.ACC_RE.finditer(expr):
+            _, mode, account_codes, domain = self._parse_match_object(mo)
             key = (domain, mode)
-            account_ids_data = self._data[key]
-            v = AccountingNone
+            account_ids_data = data[key]
             for account_code in account_codes:
-                account_ids = self._account_ids_by_code[account_code]
-                for account_id in account_ids:
-                    debit, credit = \
-                        account_ids_data.get(account_id,
-                                             (AccountingNone, AccountingNone))
-                    if field == 'bal':
-                        v += debit - credit
-                    elif field == 'deb':
-                        v += debit
-                    elif field == 'crd':
-                        v += credit
-            return '(' + repr(v) + ')'
-        return self.ACC_RE.sub(f, expr)
+                for account_id in self._account_ids_by_code[account_code]:
+                    if account_id in account_ids_data:
+                        res[account_id][key][account_id] = \
+                            account_ids_data[account_id]
+        return res
+
+    @staticmethod
+    def merge_data(datas):
+        """Return the sum of several data returned by get_data()
+        or get_data_by_dimension() """
+        res = defaultdict(dict)
+        for data in datas:
+            for key, account_ids_data in data.items():
+                if isinstance(account_ids_data, ExceededData):
+                    res[key] = ExceededData()
+                    continue
+                res_data = res[key]
+                if isinstance(res_data, ExceededData):
+                    continue
+                for account_id, (debit, credit) in account_ids_data.items():
+                    res_debit, res_credit = \
+                        res_data.get(account_id, (0.0, 0.0))
+                    res_data[account_id] = \
+                        (res_debit + debit, res_credit + credit)
+        return res
+
+    def get_dimension_names(self):
+        """Return the display names of all the dimension values queried
+        since done_parsing(), as a dictionary {dimension value: name},
+        many2one values being ids """
+        return self._dimension_names
+
+    def _get_value(self, mo, data):
+        field, mode, account_codes, domain = self._parse_match_object(mo)
+        key = (domain, mode)
+        account_ids_data = data[key]
+        if isinstance(account_ids_data, ExceededData):
+            raise BudgetExceeded("accounting data of %s not queried "
+                                 "within the SQL budget" % (mo.group(), ))
+        v = AccountingNone
+        for account_code in account_codes:
+            account_ids = self._account_ids_by_code[account_code]
+            for account_id in account_ids:
+                debit, credit = \
+                    account_ids_data.get(account_id,
+                                         (AccountingNone, AccountingNone))
+                if field == 'bal':
+                    v += debit - credit
+                elif field == 'deb':
+                    v += debit
+                elif field == 'crd':
+                    v += credit
+        return v
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Limits on the SQL time of report computations.
+
+A SqlBudget limits the total time spent in the SQL statements of a
+computation, the time of each statement (with a statement_timeout set
+in a savepoint, so the transaction can go on after a timeout), and the
+number of rows of non aggregated queries. When a limit is hit,
+BudgetExceeded is raised, and the data that could not be read is
+replaced by EXCEEDED (or ExceededData for accounting data), so the KPIs
+using it are rendered as #TIMEOUT while the others are computed.
+
+>>> budget = SqlBudget(total=10)
+>>> budget.elapsed = 11
+>>> with budget.statement(None):
+...     pass
+Traceback (most recent call last):
+ ...
+BudgetExceeded: SQL time budget of 10 seconds exceeded
+>>> uses_exceeded('sales - costs', {'sales': EXCEEDED})
+True
+>>> uses_exceeded('sales - costs', {'sales': 1.0})
+False
+>>> with NULL_BUDGET.statement(None):
+...     pass
+"""
+
+import re
+import time
+from contextlib import contextmanager
+
+from psycopg2.extensions import QueryCanceledError
+
+TIMEOUT = '#TIMEOUT'
+
+_NAME_RE = re.compile(r'\b[a-zA-Z_]\w*')
+
+
+class BudgetExceeded(Exception):
+    """ Raised when data can not be read within the budget, or when
+    evaluating an expression using such data """
+    pass
+
+
+class Exceeded(object):
+    """ The value of a query or KPI that could not be computed within
+    the budget """
+
+    def __repr__(self):
+        return 'EXCEEDED'
+
+
+EXCEEDED = Exceeded()
+
+
+class ExceededData(dict):
+    """ The (empty) accounting data of a domain and mode that could not
+    be queried within the budget (see AEP.do_queries) """
+    pass
+
+
+def uses_exceeded(expr, localdict):
+    """ Test if an expression uses a value that exceeded the budget """
+    return any(localdict.get(name) is EXCEEDED
+               for name in _NAME_RE.findall(expr))
+
+
+class SqlBudget(object):
+
+    def __init__(self, total=0, statement=0, max_rows=0,
+                 application_name=None):
+        """
+        :param total: maximum SQL time of the computation in seconds
+        :param statement: maximum time of each SQL statement in seconds
+        :param max_rows: maximum number of rows of non aggregated queries
+        :param application_name: the application name of the database
+            session while executing the statements, so they can be
+            canceled (see MisReportInstance.cancel_compute)
+
+        Zero means unlimited.
+        """
+        self.total = total
+        self.statement_timeout = statement
+        self.max_rows = max_rows
+        self.application_name = application_name
+        self.elapsed = 0.0
+        self.cancelled = False
+        self._defaults = None
+
+    def _get_timeout(self):
+        if self.cancelled:
+            raise BudgetExceeded("computation cancelled")
+        timeout = self.statement_timeout
+        if self.total:
+            remaining = self.total - self.elapsed
+            if remaining <= 0:
+                raise BudgetExceeded("SQL time budget of %s seconds "
+                                     "exceeded" % (self.total, ))
+            timeout = min(timeout, remaining) if timeout else remaining
+        return timeout
+
+    @contextmanager
+    def statement(self, cr):
+        """ Execute the statements of the enclosed block on cr within the
+        budget, raising BudgetExceeded if they take too long or if they
+        are canceled (see MisReportInstance.cancel_compute) """
+        timeout = self._get_timeout()
+        configure = bool(timeout or self.application_name)
+        start = time.time()
+        try:
+            with cr.savepoint():
+                if configure:
+                    self._configure(cr, timeout)
+                yield
+                if configure:
+                    self._configure(cr)
+        except QueryCanceledError:
+            if not timeout or time.time() - start < timeout:
+                # canceled before the timeout, by pg_cancel_backend
+                self.cancelled = True
+                raise BudgetExceeded("computation cancelled")
+            raise BudgetExceeded("SQL statement timeout of %.1f seconds "
+                                 "exceeded" % (timeout, ))
+        finally:
+            self.elapsed += time.time() - start
+
+    def _configure(self, cr, timeout=None):
+        """ Set the statement timeout (in seconds) and the application
+        name of the session of cr until the end of the savepoint, or
+        restore their defaults if timeout is None """
+        if self._defaults is None:
+            cr.execute("""
+                SELECT current_setting('statement_timeout'),
+                       current_setting('application_name')
+            """)
+            self._defaults = cr.fetchone()
+        settings = self._defaults
+        if timeout is not None:
+            settings = (
+                str(max(int(timeout * 1000), 1)) if timeout
+                else settings[0],
+                self.application_name or settings[1])
+        cr.execute("""
+            SELECT set_config('statement_timeout', %s, true),
+                   set_config('application_name', %s, true)
+        """, settings)
+
+    def check_rows(self, rows):
+        """ Raise BudgetExceeded if there are too many rows """
+        if self.max_rows and rows > self.max_rows:
+            raise BudgetExceeded("query of %d rows exceeding the limit "
+                                 "of %d rows" % (rows, self.max_rows))
+
+
+class NullBudget(object):
+    """ A budget without limits """
+
+    max_rows = 0
+
+    @contextmanager
+    def statement(self, cr):
+        yield
+
+    def check_rows(self, rows):
+        pass
+
+
+NULL_BUDGET = NullBudget()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
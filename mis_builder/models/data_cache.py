@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+A small thread safe cache of recently computed data, with a maximum
+number of entries (the least recently used are dropped first) and
+a time to live.
+
+>>> cache = DataCache(size=2, ttl=60)
+>>> cache.put('a', 1)
+>>> cache.put('b', 2)
+>>> cache.get('a')
+1
+>>> cache.put('c', 3)
+>>> cache.get('b') is None
+True
+>>> cache.get('a'), cache.get('c')
+(1, 3)
+>>> cache.clear()
+>>> cache.get('a') is None
+True
+>>> expired = DataCache(ttl=-1)
+>>> expired.put('a', 1)
+>>> expired.get('a') is None
+True
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# default maximum number of entries
+CACHE_SIZE = 256
+# default time to live of entries, in seconds
+CACHE_TTL = 600
+
+
+class DataCache(object):
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Return the value stored for key, or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            timestamp, value = entry
+            if time.time() - timestamp > self.ttl:
+                return None
+            self._entries[key] = entry
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Drop all entries """
+        with self._lock:
+            self._entries.clear()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
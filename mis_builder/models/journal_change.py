@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Log of the changes of the journal items: creations, modifications,
+deletions, and the posting or cancellation of moves (which update the
+state of the moves in SQL).
+
+Each change is recorded with the id of the transaction making it. A
+high-water mark of the journal items (see
+AccountingExpressionProcessor.get_mark) holds the largest id of the
+journal items and the snapshot of the transactions visible to the
+computation. The changes recorded by the transactions not visible in
+this snapshot are the changes committed since, whatever the order of
+the ids and write dates of the journal items (the write date being the
+start time of the writing transaction).
+
+The log is pruned by a cron job, every hour: it deletes the changes
+committed before its previous run, which are visible in all the marks
+still in use.
+"""
+
+import time
+
+from openerp import api, fields, models
+
+from .data_cache import CACHE_TTL
+
+# the time and snapshot of the previous pruning of the journal changes
+PRUNE_PARAM = 'mis_builder.journal_change_pruned'
+
+
+class MisReportJournalChange(models.Model):
+    """ A change of journal items """
+
+    _name = 'mis.report.journal.change'
+    _description = 'Changes of journal items'
+    _log_access = False
+    _order = 'id'
+
+    line_id = fields.Integer(
+        string='Journal item',
+        help='The smallest id of the changed journal items.')
+
+    def init(self, cr):
+        # the id of the transaction recording the change, which is
+        # larger than an integer field
+        cr.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'mis_report_journal_change'
+            AND column_name = 'txid'
+        """)
+        if not cr.fetchone():
+            cr.execute("""
+                ALTER TABLE mis_report_journal_change
+                ADD COLUMN txid bigint NOT NULL DEFAULT txid_current()
+            """)
+
+    @api.model
+    def _record(self, move_ids=(), line_ids=()):
+        """ Record a change of the journal items of moves move_ids and
+        of the journal items line_ids """
+        self.env.cr.execute("""
+            INSERT INTO mis_report_journal_change (line_id)
+            SELECT line_id FROM (
+                SELECT min(id) AS line_id FROM account_move_line
+                WHERE move_id IN %s OR id IN %s
+            ) AS changed WHERE line_id IS NOT NULL
+        """, (tuple(move_ids) or (0, ), tuple(line_ids) or (0, )))
+
+    @api.model
+    def _prune(self, min_interval=CACHE_TTL):
+        """ Delete the changes committed before the previous pruning,
+        if it is older than min_interval seconds (the time to live of
+        the marks) """
+        param_model = self.env['ir.config_parameter'].sudo()
+        pruned = param_model.get_param(PRUNE_PARAM)
+        if pruned:
+            pruned_time, snapshot = pruned.split(' ', 1)
+            if time.time() - float(pruned_time) < min_interval:
+                return
+            self.env.cr.execute("""
+                DELETE FROM mis_report_journal_change
+                WHERE txid_visible_in_snapshot(txid, %s::txid_snapshot)
+            """, (snapshot, ))
+        self.env.cr.execute("SELECT txid_current_snapshot()")
+        param_model.set_param(
+            PRUNE_PARAM, '%f %s' % (time.time(), self.env.cr.fetchone()[0]))
+
+
+def _ids(ids):
+    if isinstance(ids, (int, long)):
+        return [ids]
+    return ids
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    def create(self, cr, uid, vals, context=None):
+        # the journal items created with the move are recorded once
+        ctx = dict(context or {}, mis_report_move_create=True)
+        move_id = super(AccountMove, self).create(cr, uid, vals, context=ctx)
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, move_ids=[move_id])
+        return move_id
+
+    def post(self, cr, uid, ids, context=None):
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, move_ids=_ids(ids))
+        return super(AccountMove, self).post(cr, uid, ids, context=context)
+
+    def button_cancel(self, cr, uid, ids, context=None):
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, move_ids=_ids(ids))
+        return super(AccountMove, self).button_cancel(
+            cr, uid, ids, context=context)
+
+    def unlink(self, cr, uid, ids, context=None, check=True):
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, move_ids=_ids(ids))
+        return super(AccountMove, self).unlink(
+            cr, uid, ids, context=context, check=check)
+
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    def create(self, cr, uid, vals, context=None, check=True):
+        line_id = super(AccountMoveLine, self).create(
+            cr, uid, vals, context=context, check=check)
+        if not (context or {}).get('mis_report_move_create'):
+            self.pool['mis.report.journal.change']._record(
+                cr, uid, line_ids=[line_id])
+        return line_id
+
+    def write(self, cr, uid, ids, vals, context=None, check=True,
+              update_check=True):
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, line_ids=_ids(ids))
+        return super(AccountMoveLine, self).write(
+            cr, uid, ids, vals, context=context, check=check,
+            update_check=update_check)
+
+    def unlink(self, cr, uid, ids, context=None, check=True):
+        self.pool['mis.report.journal.change']._record(
+            cr, uid, line_ids=_ids(ids))
+        return super(AccountMoveLine, self).unlink(
+            cr, uid, ids, context=context, check=check)
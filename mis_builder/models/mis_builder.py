@@ -2,30 +2,60 @@
 # © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import base64
+import bisect
 import datetime
 import dateutil
+import gzip
+import json
 import logging
 import re
+import threading
 import time
 import traceback
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
 import pytz
 
+import openerp
 from openerp import api, fields, models, _
+from openerp.exceptions import ValidationError, Warning as UserError
 from openerp.tools.safe_eval import safe_eval
 
 from .aep import AccountingExpressionProcessor as AEP
+from .data_cache import DataCache
 from .aggregate import _sum, _avg, _min, _max
 from .accounting_none import AccountingNone
+from .budget import EXCEEDED, NULL_BUDGET, TIMEOUT, BudgetExceeded, \
+    SqlBudget, uses_exceeded
+from .plan import Formatter, KpiPlan, ReportPlan
+from .profiler import NULL_PROFILER, Profiler
+from .replica import on_replica, replica_env
+from .query_result import LazyQueryResults, QueryRows, aggregate_in_db, \
+    aggregate_in_python, date_ranges_domain, load_query_results, \
+    search_ids_by_date_range
+from .vector import DIV0, ERR, KpiError, Vector, VectorFallback, \
+    vectorize, check_vectorizable
 
 _logger = logging.getLogger(__name__)
 
+# the compiled plans of the reports (see MisReport._get_plan)
+_plan_cache = DataCache()
 
-class AutoStruct(object):
+# default number of threads used to compute several instances at once
+COMPUTE_WORKERS = 4
 
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+# special dimension values of the result of MisReport._compute_breakdown
+BREAKDOWN_TOTAL = '__total__'
+BREAKDOWN_OTHERS = '__others__'
+
+# names of the compressed attachments of mis.report.instance.snapshot
+RESULT_ATTACHMENT = 'result.json.gz'
+PDF_ATTACHMENT = 'report.pdf.gz'
+XLS_ATTACHMENT = 'report.xls.gz'
 
 
 def _get_selection_label(selection, value):
@@ -149,16 +179,8 @@ class MisReportKpi(models.Model):
     def render(self, lang_id, value):
         """ render a KPI value as a unicode string, ready for display """
         assert len(self) == 1
-        if value is None or value is AccountingNone:
-            return ''
-        elif self.type == 'num':
-            return self._render_num(lang_id, value, self.divider,
-                                    self.dp, self.prefix, self.suffix)
-        elif self.type == 'pct':
-            return self._render_num(lang_id, value, 0.01,
-                                    self.dp, '', '%')
-        else:
-            return unicode(value)
+        return KpiPlan(self).render(
+            self.report_id._get_formatter(lang_id), value)
 
     def render_comparison(self, lang_id, value, base_value,
                           average_value, average_base_value):
@@ -167,58 +189,9 @@ class MisReportKpi(models.Model):
         If the difference is 0, an empty string is returned.
         """
         assert len(self) == 1
-        if value is None:
-            value = AccountingNone
-        if base_value is None:
-            base_value = AccountingNone
-        if self.type == 'pct':
-            delta = value - base_value
-            if delta and round(delta, self.dp) != 0:
-                return self._render_num(
-                    lang_id,
-                    delta,
-                    0.01, self.dp, '', _('pp'),
-                    sign='+')
-        elif self.type == 'num':
-            if value and average_value:
-                value = value / float(average_value)
-            if base_value and average_base_value:
-                base_value = base_value / float(average_base_value)
-            if self.compare_method == 'diff':
-                delta = value - base_value
-                if delta and round(delta, self.dp) != 0:
-                    return self._render_num(
-                        lang_id,
-                        delta,
-                        self.divider, self.dp, self.prefix, self.suffix,
-                        sign='+')
-            elif self.compare_method == 'pct':
-                if base_value and round(base_value, self.dp) != 0:
-                    delta = (value - base_value) / abs(base_value)
-                    if delta and round(delta * 100, self.dp) != 0:
-                        return self._render_num(
-                            lang_id,
-                            delta,
-                            0.01, self.dp, '', '%',
-                            sign='+')
-        return ''
-
-    def _render_num(self, lang_id, value, divider,
-                    dp, prefix, suffix, sign='-'):
-        divider_label = _get_selection_label(
-            self._columns['divider'].selection, divider)
-        if divider_label == '1':
-            divider_label = ''
-        # format number following user language
-        value = round(value / float(divider or 1), dp) or 0
-        value = self.env['res.lang'].browse(lang_id).format(
-            '%%%s.%df' % (sign, dp),
-            value,
-            grouping=True)
-        value = u'%s\N{NARROW NO-BREAK SPACE}%s\N{NO-BREAK SPACE}%s%s' % \
-            (prefix or '', value, divider_label, suffix or '')
-        value = value.replace('-', u'\N{NON-BREAKING HYPHEN}')
-        return value
+        return KpiPlan(self).render_comparison(
+            self.report_id._get_formatter(lang_id), value, base_value,
+            average_value, average_base_value)
 
 
 class MisReportQuery(models.Model):
@@ -248,7 +221,24 @@ class MisReportQuery(models.Model):
                                   ('avg', _('Average')),
                                   ('min', _('Min')),
                                   ('max', _('Max'))],
-                                 string='Aggregate')
+                                 string='Aggregate',
+                                 help='Without aggregate, the query '
+                                      'returns the matching records as '
+                                      'rows with one attribute per '
+                                      'fetched field (the id for many2one '
+                                      'fields), which can be iterated, '
+                                      'counted with len() and indexed '
+                                      '(eg query[0].field).')
+    groupby_field_ids = fields.Many2many(
+        comodel_name='ir.model.fields',
+        relation='mis_report_query_groupby_field_rel',
+        column1='query_id',
+        column2='field_id',
+        string='Fields to group by',
+        help='When an aggregate is set, the query returns a mapping '
+             'from the values of these fields (a tuple if there are '
+             'several fields, the id for many2one fields) to the '
+             'aggregated values.')
     date_field = fields.Many2one('ir.model.fields', required=True,
                                  string='Date field',
                                  domain=[('ttype', 'in',
@@ -264,16 +254,26 @@ class MisReportQuery(models.Model):
     def _check_name(self):
         return _is_valid_python_var(self.name)
 
+    @api.one
+    @api.constrains('aggregate', 'groupby_field_ids')
+    def _check_groupby(self):
+        if self.groupby_field_ids and not self.aggregate:
+            raise ValidationError(
+                _('Query %s: an aggregate is required to group by '
+                  'fields.') % self.name)
+
 
 class MisReport(models.Model):
     """ A MIS report template (without period information)
 
     The MIS report holds:
     * a list of explicit queries; the result of each query is
-      stored in a variable with same name as a query, containing as list
-      of data structures populated with attributes for each fields to fetch;
+      stored in a variable with same name as a query, containing an
+      iterable of rows with attributes for each fields to fetch
+      (many2one fields contain the id of the related record);
       when queries have an aggregate method and no fields to group, it returns
-      a data structure with the aggregated fields
+      a data structure with the aggregated fields; with fields to group,
+      it returns a mapping from the group values to such data structures
     * a list of KPI to be evaluated based on the variables resulting
       from the accounting data and queries (KPI expressions can references
       queries and accounting expression - see AccoutingExpressionProcessor)
@@ -307,11 +307,49 @@ class MisReport(models.Model):
 
     # TODO: kpi name cannot be start with query name
 
+    @api.multi
+    def _get_plan(self):
+        """ Return the ReportPlan of the report, compiled once and cached
+        until the report, its KPIs or its queries are modified """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT r.write_date,
+                   (SELECT max(write_date) FROM mis_report_kpi
+                    WHERE report_id = r.id),
+                   (SELECT count(*) FROM mis_report_kpi
+                    WHERE report_id = r.id),
+                   (SELECT max(write_date) FROM mis_report_query
+                    WHERE report_id = r.id),
+                   (SELECT count(*) FROM mis_report_query
+                    WHERE report_id = r.id),
+                   now() at time zone 'UTC'
+            FROM mis_report r WHERE r.id = %s
+        """, (self.id, ))
+        report_date, kpi_date, kpi_count, query_date, query_count, now = \
+            self.env.cr.fetchone()
+        if any(write_date and write_date >= now
+               for write_date in (report_date, kpi_date, query_date)):
+            # modified in the current transaction, which may modify it
+            # again without changing the write dates
+            return ReportPlan(self)
+        key = (self.env.cr.dbname, self.id, self.env.lang,
+               report_date, kpi_date, kpi_count, query_date, query_count)
+        plan = _plan_cache.get(key)
+        if plan is None:
+            plan = ReportPlan(self)
+            _plan_cache.put(key, plan)
+        return plan
+
+    @api.model
+    def _get_formatter(self, lang_id):
+        """ Return the Formatter of the KPI values in a language """
+        return Formatter(self.env['res.lang'].browse(lang_id), _('pp'))
+
     @api.multi
     def _prepare_aep(self, root_account):
         self.ensure_one()
         aep = AEP(self.env)
-        for kpi in self.kpi_ids:
+        for kpi in self._get_plan().kpis:
             aep.parse_expr(kpi.expression)
         aep.done_parsing(root_account)
         return aep
@@ -320,9 +358,74 @@ class MisReport(models.Model):
     def _fetch_queries(self, date_from, date_to,
                        get_additional_query_filter=None):
         self.ensure_one()
-        res = {}
-        for query in self.query_ids:
-            model = self.env[query.model_id.model]
+        return self._fetch_queries_by_period(
+            [(None, date_from, date_to, get_additional_query_filter)])[None]
+
+    @api.multi
+    def _get_used_query_names(self):
+        """ Return the names of the queries used in the expressions or
+        css styles of the KPIs """
+        self.ensure_one()
+        return self._get_plan().used_query_names
+
+    @api.multi
+    def _lazy_queries_by_period(self, periods, profiler=NULL_PROFILER,
+                                env=None, budget=NULL_BUDGET):
+        """ Return the LazyQueryResults of the queries used by the
+        KPIs for several periods (see _fetch_queries_by_period for the
+        arguments). Each query is fetched for all periods when an
+        expression uses it for the first time, and the queries that are
+        not used by any expression are not fetched at all. """
+        self.ensure_one()
+
+        def fetch(query_names):
+            return self._fetch_queries_by_period(
+                periods, profiler=profiler, env=env, budget=budget,
+                query_names=query_names)
+
+        return LazyQueryResults(fetch, [period[0] for period in periods],
+                                self._get_used_query_names())
+
+    @api.multi
+    def _fetch_queries_by_period(self, periods, profiler=NULL_PROFILER,
+                                 env=None, budget=NULL_BUDGET,
+                                 query_names=None):
+        """ Fetch the queries of the report for several periods at once.
+
+        Aggregated queries on stored fields are executed with one
+        SQL statement for all periods, bucketing the records on the
+        query date field. Non aggregated queries search the records
+        of all periods once and split them by period in memory.
+        Periods with different additional filters are fetched
+        separately.
+
+        :param periods: a list of tuples
+                        (key, date_from, date_to,
+                         get_additional_query_filter)
+                        where key is an opaque period identifier
+                        and get_additional_query_filter is an optional
+                        bound method (see _compute)
+        :param profiler: a Profiler recording the time spent
+                         in each query
+        :param env: the environment to read the records of the
+                    queries with, if not the one of the report
+                    (see replica_env)
+        :param budget: the SqlBudget of the computation; the result of
+                       the queries exceeding it is EXCEEDED
+        :param query_names: the names of the queries to fetch, if not
+                            all queries of the report
+
+        Returns a dictionary {key: {query name: query result}}.
+        """
+        self.ensure_one()
+        res = dict((period[0], {}) for period in periods)
+        tz_name = self._context.get('tz', 'UTC')
+        queries = self.query_ids
+        if query_names is not None:
+            queries = queries.filtered(lambda q: q.name in query_names)
+        for query in queries:
+            profile_entry = profiler.start('query', query.name)
+            model = (env or self.env)[query.model_id.model]
             eval_context = {
                 'env': self.env,
                 'time': time,
@@ -332,55 +435,80 @@ class MisReport(models.Model):
                 'uid': self.env.uid,
                 'context': self.env.context,
             }
-            domain = query.domain and \
+            base_domain = query.domain and \
                 safe_eval(query.domain, eval_context) or []
-            if get_additional_query_filter:
-                domain.extend(get_additional_query_filter(query))
-            if query.date_field.ttype == 'date':
-                domain.extend([(query.date_field.name, '>=', date_from),
-                               (query.date_field.name, '<=', date_to)])
-            else:
-                datetime_from = _utc_midnight(
-                    date_from, self._context.get('tz', 'UTC'))
-                datetime_to = _utc_midnight(
-                    date_to, self._context.get('tz', 'UTC'), add_day=1)
-                domain.extend([(query.date_field.name, '>=', datetime_from),
-                               (query.date_field.name, '<', datetime_to)])
+            date_field = query.date_field.name
             field_names = [f.name for f in query.field_ids]
-            all_stored = all([model._fields[f].store for f in field_names])
-            if not query.aggregate:
-                data = model.search_read(domain, field_names)
-                res[query.name] = [AutoStruct(**d) for d in data]
-            elif query.aggregate == 'sum' and all_stored:
-                # use read_group to sum stored fields
-                data = model.read_group(
-                    domain, field_names, [])
-                s = AutoStruct(count=data[0]['__count'])
-                for field_name in field_names:
-                    try:
-                        v = data[0][field_name]
-                    except KeyError:
-                        _logger.error('field %s not found in read_group '
-                                      'for %s; not summable?',
-                                      field_name, model._name)
-                        v = AccountingNone
-                    setattr(s, field_name, v)
-                res[query.name] = s
-            else:
-                data = model.search_read(domain, field_names)
-                s = AutoStruct(count=len(data))
-                if query.aggregate == 'min':
-                    agg = _min
-                elif query.aggregate == 'max':
-                    agg = _max
-                elif query.aggregate == 'avg':
-                    agg = _avg
-                elif query.aggregate == 'sum':
-                    agg = _sum
-                for field_name in field_names:
-                    setattr(s, field_name,
-                            agg([d[field_name] for d in data]))
-                res[query.name] = s
+            groupby_names = [f.name for f in query.groupby_field_ids]
+            all_stored = all([model._fields[f].store
+                              for f in field_names + groupby_names])
+            # group periods by additional filter, with their
+            # [start, stop[ date range on the query date field
+            periods_by_filter = OrderedDict()
+            for key, date_from, date_to, get_additional_query_filter \
+                    in periods:
+                domain = list(base_domain)
+                if get_additional_query_filter:
+                    domain.extend(get_additional_query_filter(query))
+                if query.date_field.ttype == 'date':
+                    date_range = (date_from, fields.Date.to_string(
+                        fields.Date.from_string(date_to) +
+                        datetime.timedelta(days=1)))
+                else:
+                    date_range = (_utc_midnight(date_from, tz_name),
+                                  _utc_midnight(date_to, tz_name, add_day=1))
+                periods_by_filter.setdefault(
+                    repr(domain), (domain, []))[1].append((key, date_range))
+            for domain, key_ranges in periods_by_filter.values():
+                date_ranges = sorted(set(r for k, r in key_ranges))
+                domain = domain + date_ranges_domain(date_field, date_ranges)
+                try:
+                    with budget.statement(model.env.cr):
+                        if not query.aggregate:
+                            ids_by_range = dict(zip(
+                                date_ranges,
+                                search_ids_by_date_range(
+                                    model, domain, date_field, date_ranges)))
+                            rows = sum(
+                                len(ids) for ids in ids_by_range.values())
+                            profile_entry['rows'] = rows
+                            budget.check_rows(rows)
+                        elif all_stored:
+                            # aggregate stored fields in the database
+                            s_by_range = dict(zip(
+                                date_ranges,
+                                aggregate_in_db(model, domain, field_names,
+                                                query.aggregate,
+                                                date_field, date_ranges,
+                                                groupby_names)))
+                        else:
+                            s_by_key = dict(
+                                (key, aggregate_in_python(
+                                    model,
+                                    domain + date_ranges_domain(
+                                        date_field, [date_range]),
+                                    field_names, query.aggregate,
+                                    groupby_names))
+                                for key, date_range in key_ranges)
+                except BudgetExceeded:
+                    _logger.warning("query %s exceeded the SQL budget",
+                                    query.name, exc_info=True)
+                    for key, date_range in key_ranges:
+                        res[key][query.name] = EXCEEDED
+                    continue
+                for key, date_range in key_ranges:
+                    if not query.aggregate:
+                        res[key][query.name] = QueryRows(
+                            model,
+                            domain + date_ranges_domain(
+                                date_field, [date_range]),
+                            field_names,
+                            ids=ids_by_range[date_range])
+                    elif all_stored:
+                        res[key][query.name] = s_by_range[date_range]
+                    else:
+                        res[key][query.name] = s_by_key[key]
+            profiler.stop(profile_entry)
         return res
 
     @api.multi
@@ -392,12 +520,17 @@ class MisReport(models.Model):
                  get_additional_query_filter=None,
                  period_id=None,
                  report_instance_id=None,
+                 query_results=None,
+                 profiler=NULL_PROFILER,
+                 company_rates=None,
+                 budget=NULL_BUDGET,
                  ):
         """ Evaluate a report for a given period.
 
         It returns a dictionary keyed on kpi.name with the following values:
             * val: the evaluated kpi, or None if there is no data or an error
-            * val_r: the rendered kpi as a string, or #ERR, #DIV
+            * val_r: the rendered kpi as a string, or #ERR, #DIV,
+                     #TIMEOUT
             * val_c: a comment (explaining the error, typically)
             * style: the css style of the kpi
                      (may change in the future!)
@@ -430,44 +563,62 @@ class MisReport(models.Model):
         :param period_id: an optional opaque value that is returned as
                           query_id field in the result (may change in the
                           future!)
+        :param query_results: the results of the queries of the report for
+                              the period, if they have been fetched
+                              already (see _fetch_queries_by_period),
+                              or their lazy results (see
+                              _lazy_queries_by_period)
+        :param profiler: a Profiler recording the time spent in
+                         the computation steps
+        :param company_rates: a dictionary {company_id: rate} converting
+                              the amounts of each company to the
+                              currency of the report
+                              (see AEP.do_queries)
+        :param budget: the SqlBudget of the computation; the KPIs using
+                       data that could not be read within the budget
+                       are rendered as #TIMEOUT
         """
         self.ensure_one()
         res = {}
 
-        localdict = {
-            'registry': self.pool,
-            'sum': _sum,
-            'min': _min,
-            'max': _max,
-            'len': len,
-            'avg': _avg,
-            'AccountingNone': AccountingNone,
-        }
+        localdict = self._get_localdict()
 
-        localdict.update(self._fetch_queries(
-            date_from, date_to, get_additional_query_filter))
+        if query_results is None:
+            query_results = self._lazy_queries_by_period(
+                [(None, date_from, date_to, get_additional_query_filter)],
+                profiler=profiler, budget=budget)[None]
 
         additional_move_line_filter = None
         if get_additional_move_line_filter:
             additional_move_line_filter = get_additional_move_line_filter()
-        aep.do_queries(date_from, date_to,
-                       period_from, period_to,
-                       target_move,
-                       additional_move_line_filter)
-
-        compute_queue = self.kpi_ids
-        recompute_queue = self.env['mis.report.kpi']
+        with profiler.profile('do_queries', period_id):
+            aep.do_queries(date_from, date_to,
+                           period_from, period_to,
+                           target_move,
+                           additional_move_line_filter,
+                           profiler=profiler,
+                           company_rates=company_rates,
+                           budget=budget)
+
+        formatter = self._get_formatter(lang_id)
+        compute_queue = self._get_plan().kpis
+        recompute_queue = []
         inherit_subreport_vals = {}
 
         while True:
             for kpi in compute_queue:
+                profile_entry = profiler.start('kpi', kpi.name)
                 inherit_report_id = False
                 inherit_active_subreport_ids = self.env['mis.report']
+                # the errors of the queries are not errors of the kpi
+                load_query_results(localdict, query_results, kpi.names)
                 try:
                     kpi_val_comment = kpi.name + " = " + kpi.expression
+                    if uses_exceeded(kpi.expression, localdict):
+                        raise BudgetExceeded()
                     kpi_eval_expression = aep.replace_expr(kpi.expression)
 
-                    if '.' in kpi.expression:
+                    if kpi.has_dot:
                         #
                         # Sub report search
                         #
@@ -511,10 +662,16 @@ class MisReport(models.Model):
                                     # Recursively compute all of the
                                     # inherit_report_id KPIs
                                     # TODO: Recompute only within period_id
-                                    inherit_subreport_vals_res = \
-                                        report_instance_id._compute(
-                                            report_id=inherit_report_id
-                                        )
+                                    with profiler.profile(
+                                            'sub_report',
+                                            inherit_report_id.code):
+                                        inherit_subreport_vals_res = \
+                                            report_instance_id._compute(
+                                                report_id=inherit_report_id,
+                                                profiler=profiler,
+                                                pivot=False,
+                                                budget=budget,
+                                            )
 
                                     content = []
                                     for d in inherit_subreport_vals_res:
@@ -553,8 +710,14 @@ class MisReport(models.Model):
                     kpi_val = None
                     kpi_val_rendered = '#DIV/0'
                     kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
+                except BudgetExceeded:
+                    # the kpis using this one can not be computed either
+                    localdict[kpi.name] = EXCEEDED
+                    kpi_val = None
+                    kpi_val_rendered = TIMEOUT
+                    kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
                 except (NameError, ValueError):
-                    recompute_queue |= kpi
+                    recompute_queue.append(kpi)
                     kpi_val = None
                     kpi_val_rendered = '#ERR'
                     kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
@@ -563,8 +726,11 @@ class MisReport(models.Model):
                     kpi_val_rendered = '#ERR'
                     kpi_val_comment += '\n\n%s' % (traceback.format_exc(),)
                 else:
-                    kpi_val_rendered = kpi.render(lang_id, kpi_val)
+                    kpi_val_rendered = kpi.render(formatter, kpi_val)
 
+                if kpi.css_style:
+                    load_query_results(localdict, query_results,
+                                       kpi.style_names)
                 try:
                     kpi_style = None
                     if kpi.css_style:
@@ -576,7 +742,7 @@ class MisReport(models.Model):
 
                 drilldown = (not inherit_active_subreport_ids and
                              kpi_val is not None and
-                             AEP.has_account_var(kpi.expression))
+                             kpi.has_account_var)
 
                 res[kpi.name] = {
                     'val': None if kpi_val is AccountingNone else kpi_val,
@@ -594,6 +760,373 @@ class MisReport(models.Model):
                                       False,
                     'inherit_subreport_vals': inherit_subreport_vals
                 }
+                profiler.stop(profile_entry)
+
+            if len(recompute_queue) == 0:
+                # nothing to recompute, we are done
+                break
+            if len(recompute_queue) == len(compute_queue):
+                # could not compute anything in this iteration
+                # (ie real Value errors or cyclic dependency)
+                # so we stop trying
+                break
+            # try again
+            compute_queue = recompute_queue
+            recompute_queue = []
+
+        return res
+
+    @api.multi
+    def _get_localdict(self, vector=False):
+        """ Return the functions and constants available in
+        KPI expressions, accepting vectors if vector is True """
+        self.ensure_one()
+        functions = {
+            'sum': _sum,
+            'min': _min,
+            'max': _max,
+            'len': len,
+            'avg': _avg,
+        }
+        if vector:
+            functions = dict((name, vectorize(function))
+                             for name, function in functions.items())
+        functions.update({
+            'registry': self.pool,
+            'AccountingNone': AccountingNone,
+        })
+        return functions
+
+    @api.multi
+    def _has_sub_reports(self):
+        """ Return True if a KPI expression references a KPI of another
+        report, with the <report code>.<kpi name> notation """
+        self.ensure_one()
+        codes = None
+        for kpi in self._get_plan().kpis:
+            if not kpi.has_dot:
+                continue
+            if codes is None:
+                codes = set(self.search([]).mapped('code'))
+            for sub_expression in _sub_expressions(kpi.expression):
+                if sub_expression.split('.')[0] in codes:
+                    return True
+        return False
+
+    @api.multi
+    def _compute_columns(self, lang_id, aep, periods, target_move,
+                         query_results_by_period=None,
+                         profiler=NULL_PROFILER,
+                         company_rates_by_period=None,
+                         budget=NULL_BUDGET):
+        """ Evaluate a report for several periods at once.
+
+        Each KPI expression is evaluated once for all periods, on
+        vectors of values (see vector.Vector). Expressions that can not
+        be evaluated on vectors (eg using conditions or loops) are
+        evaluated for each period. References to other reports are not
+        supported (see _has_sub_reports).
+
+        :param periods: a list of tuples
+                        (key, date_from, date_to, period_from, period_to,
+                         get_additional_move_line_filter,
+                         get_additional_query_filter)
+                        where key is the period_id of the result
+                        (see _compute for the other elements)
+        :param target_move: all|posted
+        :param query_results_by_period: the results of the queries,
+                                        if they have been fetched already
+                                        (see _fetch_queries_by_period),
+                                        or their lazy results (see
+                                        _lazy_queries_by_period)
+        :param profiler: a Profiler recording the time spent in
+                         the computation steps
+        :param company_rates_by_period: a dictionary {key: company_rates}
+                                        (see _compute)
+        :param budget: the SqlBudget of the computation (see _compute)
+
+        Returns a dictionary {key: result of _compute for the period}.
+        """
+        self.ensure_one()
+        keys = [period[0] for period in periods]
+        if query_results_by_period is None:
+            query_results_by_period = self._lazy_queries_by_period(
+                [(period[0], period[1], period[2], period[6])
+                 for period in periods],
+                profiler=profiler, budget=budget)
+        datas = [data for key, data, data_by_dimension
+                 in self._do_aep_queries(
+                     aep, periods, target_move, profiler=profiler,
+                     company_rates_by_period=company_rates_by_period,
+                     budget=budget)]
+        return self._evaluate_columns(
+            lang_id, aep, keys, datas,
+            [query_results_by_period[key] for key in keys],
+            profiler=profiler)
+
+    @api.model
+    def _do_aep_queries(self, aep, periods, target_move, dimension=None,
+                        profiler=NULL_PROFILER,
+                        company_rates_by_period=None,
+                        budget=NULL_BUDGET):
+        """ Query the accounting data of each period (see _compute_columns
+        for the periods argument), optionally grouped by a field of
+        account.move.line.
+
+        Returns a list of (key, data, data_by_dimension) where data is
+        the result of aep.get_data(), and data_by_dimension the result of
+        aep.get_data_by_dimension() if a dimension is given. """
+        res = []
+        for key, date_from, date_to, period_from, period_to, \
+                get_additional_move_line_filter, _get_query_filter \
+                in periods:
+            additional_move_line_filter = None
+            if get_additional_move_line_filter:
+                additional_move_line_filter = \
+                    get_additional_move_line_filter()
+            with profiler.profile('do_queries', key):
+                aep.do_queries(date_from, date_to,
+                               period_from, period_to,
+                               target_move,
+                               additional_move_line_filter,
+                               dimension=dimension,
+                               profiler=profiler,
+                               company_rates=(company_rates_by_period or
+                                              {}).get(key),
+                               budget=budget)
+            res.append((key, aep.get_data(),
+                        dimension and aep.get_data_by_dimension() or None))
+        return res
+
+    @api.multi
+    def _compute_breakdown(self, lang_id, aep, periods, target_move,
+                           dimension,
+                           query_results_by_period=None,
+                           top=None,
+                           profiler=NULL_PROFILER,
+                           company_rates_by_period=None,
+                           budget=NULL_BUDGET,
+                           columnar=True):
+        """ Evaluate a report for several periods at once, for each
+        value of a field of account.move.line (eg analytic_account_id).
+
+        The accounting data of each period is queried once, grouped by
+        account and dimension value, and the KPIs are evaluated on
+        vectors of all (period, dimension value) pairs (see
+        _compute_columns), or for each pair if columnar is False.
+        Queries are not broken down: their results for the period are
+        available in all slices.
+
+        Values are ranked by decreasing accounting volume (sum of debit
+        and credit) over all periods. If top is given, only the top
+        values are kept, the others being grouped in a BREAKDOWN_OTHERS
+        slice.
+
+        Returns a tuple (values, names) where values is a dictionary
+        {(key, dimension value): result of _compute for the period and
+        dimension value}, including the BREAKDOWN_TOTAL value for the
+        totals of the period, and names is an ordered dictionary
+        {dimension value: display name of the value} of the slices,
+        many2one values being ids.
+        """
+        self.ensure_one()
+        if query_results_by_period is None:
+            query_results_by_period = self._lazy_queries_by_period(
+                [(period[0], period[1], period[2], period[6])
+                 for period in periods],
+                profiler=profiler, budget=budget)
+        datas_by_period = self._do_aep_queries(
+            aep, periods, target_move, dimension=dimension,
+            profiler=profiler,
+            company_rates_by_period=company_rates_by_period,
+            budget=budget)
+        dimension_names = aep.get_dimension_names()
+        volumes = dict((value, 0.0) for value in dimension_names)
+        for key, data, data_by_dimension in datas_by_period:
+            for value, value_data in data_by_dimension.items():
+                for account_data in value_data.values():
+                    for debit, credit in account_data.values():
+                        volumes[value] += abs(debit) + abs(credit)
+        ranked = sorted(dimension_names, key=lambda v: -volumes[v])
+        others = []
+        if top and len(ranked) > top:
+            ranked, others = ranked[:top], ranked[top:]
+        names = OrderedDict((value, dimension_names[value])
+                            for value in ranked)
+        if others:
+            names[BREAKDOWN_OTHERS] = _('Others')
+
+        keys = []
+        datas = []
+        query_results = []
+        for key, data, data_by_dimension in datas_by_period:
+            for value in ranked:
+                keys.append((key, value))
+                datas.append(data_by_dimension.get(value) or
+                             defaultdict(dict))
+            if others:
+                keys.append((key, BREAKDOWN_OTHERS))
+                datas.append(AEP.merge_data(
+                    [data_by_dimension[value] for value in others
+                     if value in data_by_dimension]))
+            keys.append((key, BREAKDOWN_TOTAL))
+            datas.append(data)
+            query_results.extend(
+                [query_results_by_period[key]] * (len(names) + 1))
+        values = self._evaluate_columns(
+            lang_id, aep, keys, datas, query_results, profiler=profiler,
+            columnar=columnar)
+        for (key, value), kpi_values in values.items():
+            for kpi_value in kpi_values.values():
+                kpi_value['period_id'] = key
+                if value == BREAKDOWN_OTHERS:
+                    kpi_value['drilldown'] = False
+                elif value != BREAKDOWN_TOTAL:
+                    kpi_value.update({
+                        'dimension': dimension,
+                        'dimension_value': value,
+                    })
+        return values, names
+
+    @api.multi
+    def _evaluate_columns(self, lang_id, aep, keys, datas, query_results,
+                          profiler=NULL_PROFILER, columnar=True):
+        """ Evaluate the KPIs on vectors of the accounting data and query
+        results of several columns (see _compute_columns).
+
+        :param keys: the period_id of the result of each column
+        :param datas: the accounting data of each column
+                      (see aep.get_data())
+        :param query_results: the query results of each column
+                              (see _compute)
+        :param columnar: False to evaluate the KPIs for each column
+
+        Returns a dictionary {key: result of _compute for the column}.
+        """
+        self.ensure_one()
+        localdicts = [self._get_localdict() for query_result in query_results]
+
+        # vectors of the variables of all periods
+        vlocaldict = self._get_localdict(vector=True)
+        aep_vectors = {}
+
+        def load_queries(names):
+            """ Add the results of the queries of names to the
+            localdicts, and their vectors to vlocaldict """
+            for localdict, query_result in zip(localdicts, query_results):
+                load_query_results(localdict, query_result, names)
+            for name in names:
+                if name not in vlocaldict and query_results and \
+                        name in query_results[0]:
+                    vlocaldict[name] = Vector(
+                        [localdict[name] for localdict in localdicts])
+
+        res = dict((key, {}) for key in keys)
+        formatter = self._get_formatter(lang_id)
+        compute_queue = self._get_plan().kpis
+        recompute_queue = []
+
+        while True:
+            for kpi in compute_queue:
+                profile_entry = profiler.start('kpi', kpi.name)
+                kpi_val_comment = kpi.name + " = " + kpi.expression
+                # the errors of the queries are not errors of the kpi
+                load_queries(kpi.names)
+                try:
+                    if any(uses_exceeded(kpi.expression, localdict)
+                           for localdict in localdicts):
+                        raise BudgetExceeded()
+                    if not columnar:
+                        raise VectorFallback()
+                    expr = aep.replace_expr_vector(
+                        kpi.expression, datas, aep_vectors)
+                    check_vectorizable(expr)
+                    kpi_vals = safe_eval(
+                        expr, dict(vlocaldict, **aep_vectors))
+                    if isinstance(kpi_vals, Vector):
+                        kpi_vals = kpi_vals.values
+                    else:
+                        kpi_vals = [kpi_vals] * len(keys)
+                except:
+                    # evaluate the expression for each period
+                    kpi_vals = []
+                    for data, localdict in zip(datas, localdicts):
+                        try:
+                            if uses_exceeded(kpi.expression, localdict):
+                                raise BudgetExceeded()
+                            kpi_val = safe_eval(
+                                aep.replace_expr(kpi.expression, data),
+                                localdict)
+                        except ZeroDivisionError:
+                            kpi_val = KpiError(DIV0, traceback.format_exc())
+                        except BudgetExceeded:
+                            kpi_val = KpiError(TIMEOUT,
+                                               traceback.format_exc())
+                        except (NameError, ValueError):
+                            # once per pass, so that the pass ends when
+                            # no more kpi can be computed
+                            if kpi not in recompute_queue:
+                                recompute_queue.append(kpi)
+                            kpi_val = KpiError(ERR, traceback.format_exc())
+                        except:
+                            kpi_val = KpiError(ERR, traceback.format_exc())
+                        kpi_vals.append(kpi_val)
+
+                if any(isinstance(v, KpiError) for v in kpi_vals):
+                    # like when evaluating each period, the kpi is
+                    # undefined in expressions of the next kpis
+                    vlocaldict.pop(kpi.name, None)
+                else:
+                    vlocaldict[kpi.name] = Vector(kpi_vals)
+
+                for key, kpi_val, localdict, query_result in zip(
+                        keys, kpi_vals, localdicts, query_results):
+                    if isinstance(kpi_val, KpiError):
+                        if kpi_val.code == TIMEOUT:
+                            # the kpis using this one can not be
+                            # computed either
+                            localdict[kpi.name] = EXCEEDED
+                        kpi_val_rendered = kpi_val.code
+                        kpi_val_comment_period = kpi_val_comment + \
+                            '\n\n%s' % (kpi_val.comment, )
+                        kpi_val = None
+                    else:
+                        localdict[kpi.name] = kpi_val
+                        kpi_val_rendered = kpi.render(formatter, kpi_val)
+                        kpi_val_comment_period = kpi_val_comment
+
+                    if kpi.css_style:
+                        load_query_results(localdict, query_result,
+                                           kpi.style_names)
+                    try:
+                        kpi_style = None
+                        if kpi.css_style:
+                            kpi_style = safe_eval(kpi.css_style, localdict)
+                    except:
+                        _logger.warning("error evaluating css stype "
+                                        "expression %s",
+                                        kpi.css_style, exc_info=True)
+                        kpi_style = None
+
+                    drilldown = (kpi_val is not None and
+                                 kpi.has_account_var)
+
+                    res[key][kpi.name] = {
+                        'val': None if kpi_val is AccountingNone else kpi_val,
+                        'val_r': kpi_val_rendered,
+                        'val_c': kpi_val_comment_period,
+                        'style': kpi_style,
+                        'prefix': kpi.prefix,
+                        'suffix': kpi.suffix,
+                        'dp': kpi.dp,
+                        'is_percentage': kpi.type == 'pct',
+                        'period_id': key,
+                        'expr': kpi.expression,
+                        'drilldown': drilldown,
+                        'sub_report_ids': False,
+                        'inherit_subreport_vals': {},
+                    }
+                profiler.stop(profile_entry)
 
             if len(recompute_queue) == 0:
                 # nothing to recompute, we are done
@@ -605,7 +1138,7 @@ class MisReport(models.Model):
                 break
             # try again
             compute_queue = recompute_queue
-            recompute_queue = self.env['mis.report.kpi']
+            recompute_queue = []
 
         return res
 
@@ -621,49 +1154,59 @@ class MisReportInstancePeriod(models.Model):
     @api.one
     @api.depends('report_instance_id.pivot_date', 'type', 'offset', 'duration')
     def _compute_dates(self):
-        self.date_from = False
-        self.date_to = False
-        self.period_from = False
-        self.period_to = False
-        self.valid = False
-        d = fields.Date.from_string(self.report_instance_id.pivot_date)
+        self.update(self._get_dates(self.report_instance_id.pivot_date))
+
+    @api.multi
+    def _get_dates(self, pivot_date):
+        """ Return the dates of the period for a pivot date, as a
+        dictionary with date_from, date_to, period_from, period_to
+        and valid """
+        self.ensure_one()
+        res = {
+            'date_from': False,
+            'date_to': False,
+            'period_from': self.env['account.period'],
+            'period_to': self.env['account.period'],
+            'valid': False,
+        }
+        d = fields.Date.from_string(pivot_date)
         if self.type == 'd':
             date_from = d + datetime.timedelta(days=self.offset)
             date_to = date_from + \
                 datetime.timedelta(days=self.duration - 1)
-            self.date_from = fields.Date.to_string(date_from)
-            self.date_to = fields.Date.to_string(date_to)
-            self.valid = True
+            res.update({
+                'date_from': fields.Date.to_string(date_from),
+                'date_to': fields.Date.to_string(date_to),
+                'valid': True,
+            })
         elif self.type == 'w':
             date_from = d - datetime.timedelta(d.weekday())
             date_from = date_from + datetime.timedelta(days=self.offset * 7)
             date_to = date_from + \
                 datetime.timedelta(days=(7 * self.duration) - 1)
-            self.date_from = fields.Date.to_string(date_from)
-            self.date_to = fields.Date.to_string(date_to)
-            self.valid = True
+            res.update({
+                'date_from': fields.Date.to_string(date_from),
+                'date_to': fields.Date.to_string(date_to),
+                'valid': True,
+            })
         elif self.type == 'fp':
-            current_periods = self.env['account.period'].search(
-                [('special', '=', False),
-                 ('date_start', '<=', d),
-                 ('date_stop', '>=', d),
-                 ('company_id', '=',
-                  self.report_instance_id.company_id.id)])
-            if current_periods:
-                all_periods = self.env['account.period'].search(
-                    [('special', '=', False),
-                     ('company_id', '=',
-                      self.report_instance_id.company_id.id)],
-                    order='date_start')
-                all_period_ids = [p.id for p in all_periods]
-                p = all_period_ids.index(current_periods[0].id) + self.offset
-                if p >= 0 and p + self.duration <= len(all_period_ids):
-                    periods = all_periods[p:p + self.duration]
-                    self.date_from = periods[0].date_start
-                    self.date_to = periods[-1].date_stop
-                    self.period_from = periods[0]
-                    self.period_to = periods[-1]
-                    self.valid = True
+            calendar = self.report_instance_id._get_fiscal_calendar()
+            current = [i for i, (period_id, date_start, date_stop)
+                       in enumerate(calendar)
+                       if date_start <= pivot_date <= date_stop]
+            if current:
+                p = current[0] + self.offset
+                if p >= 0 and p + self.duration <= len(calendar):
+                    periods = calendar[p:p + self.duration]
+                    period_model = self.env['account.period']
+                    res.update({
+                        'date_from': periods[0][1],
+                        'date_to': periods[-1][2],
+                        'period_from': period_model.browse(periods[0][0]),
+                        'period_to': period_model.browse(periods[-1][0]),
+                        'valid': True,
+                    })
+        return res
 
     _name = 'mis.report.instance.period'
 
@@ -748,18 +1291,20 @@ class MisReportInstancePeriod(models.Model):
         return []
 
     @api.multi
-    def drilldown(self, expr):
+    def drilldown(self, expr, dimension=None, dimension_value=None):
         self.ensure_one()
         if AEP.has_account_var(expr):
             aep = AEP(self.env)
             aep.parse_expr(expr)
-            aep.done_parsing(self.report_instance_id.root_account)
+            aep.done_parsing(self.report_instance_id._get_root_accounts())
             domain = aep.get_aml_domain_for_expr(
                 expr,
                 self.date_from, self.date_to,
                 self.period_from, self.period_to,
                 self.report_instance_id.target_move)
             domain.extend(self._get_additional_move_line_filter())
+            if dimension:
+                domain.append((dimension, '=', dimension_value))
             return {
                 'name': expr + ' - ' + self.name,
                 'domain': domain,
@@ -817,7 +1362,40 @@ class MisReportInstancePeriod(models.Model):
         return action
 
     @api.multi
-    def _compute(self, report_id, lang_id, aep):
+    def _get_aep_data(self, aep, company_rates=None):
+        """ Return the data of the accounting expressions parsed by aep
+        for this period (see AEP.get_data), reusing the sums queried by
+        a recent computation of the report when possible """
+        self.ensure_one()
+        kwargs = dict(
+            date_from=self.date_from,
+            date_to=self.date_to,
+            period_from=self.period_from,
+            period_to=self.period_to,
+            target_move=self.report_instance_id.target_move,
+            additional_move_line_filter=(
+                self._get_additional_move_line_filter()),
+            company_rates=company_rates,
+        )
+        data = aep.get_cached_data(**kwargs)
+        if data is None:
+            aep.do_queries(**kwargs)
+            data = aep.get_data()
+        return data
+
+    @api.multi
+    def _get_compute_args(self):
+        """ Return the periods as expected by MisReport._compute_columns """
+        return [(period.id, period.date_from, period.date_to,
+                 period.period_from, period.period_to,
+                 period._get_additional_move_line_filter,
+                 period._get_additional_query_filter)
+                for period in self]
+
+    @api.multi
+    def _compute(self, report_id, lang_id, aep, query_results=None,
+                 profiler=NULL_PROFILER, company_rates=None,
+                 budget=NULL_BUDGET):
         self.ensure_one()
         return report_id._compute(
             lang_id, aep,
@@ -828,6 +1406,10 @@ class MisReportInstancePeriod(models.Model):
             self._get_additional_query_filter,
             period_id=self.id,
             report_instance_id=self.report_instance_id,
+            query_results=query_results,
+            profiler=profiler,
+            company_rates=company_rates,
+            budget=budget,
         )
 
 
@@ -835,10 +1417,24 @@ class MisReportInstance(models.Model):
     """The MIS report instance combines everything to compute
     a MIS report template for a set of periods."""
 
+    @api.model
+    def _get_pivot_dimension_domain(self):
+        """ The stored many2one fields of the journal items, which the
+        accounting queries can be grouped by """
+        aml_fields = self.env['account.move.line']._fields
+        return [('model', '=', 'account.move.line'),
+                ('ttype', '=', 'many2one'),
+                ('name', 'in', [name for name, field in aml_fields.items()
+                                if field.store])]
+
     @api.one
     @api.depends('date')
     def _compute_pivot_date(self):
-        if self.date:
+        pivot_date = self.env.context.get('mis_report_pivot_date')
+        if pivot_date:
+            # computing several pivot dates (see compute_pivot_dates)
+            self.pivot_date = pivot_date
+        elif self.date:
             self.pivot_date = self.date
         else:
             self.pivot_date = fields.Date.context_today(self)
@@ -877,6 +1473,57 @@ class MisReportInstance(models.Model):
                                    string="Account chart",
                                    required=True)
     landscape_pdf = fields.Boolean(string='Landscape PDF')
+    consolidation_root_account_ids = fields.Many2many(
+        comodel_name='account.account',
+        relation='mis_report_instance_consolidation_account_rel',
+        column1='instance_id',
+        column2='account_id',
+        domain='[("parent_id", "=", False)]',
+        string='Consolidated account charts',
+        help='Account charts of other companies, consolidated with the '
+             'account chart of the report.')
+    currency_id = fields.Many2one(
+        comodel_name='res.currency',
+        string='Currency',
+        help='Currency of the report (leave empty to use the currency '
+             'of the company). The amounts of companies in other '
+             'currencies are converted at the rate of the last day of '
+             'each period.')
+    pivot_dimension_id = fields.Many2one(
+        comodel_name='ir.model.fields',
+        string='Breakdown by',
+        domain=lambda self: self._get_pivot_dimension_domain(),
+        help='Expand the rows or columns of the report for each value '
+             'of this field of the journal items (eg partner, journal). '
+             'Queries are not broken down.')
+    pivot_layout = fields.Selection([('rows', 'Rows'),
+                                     ('cols', 'Columns')],
+                                    string='Breakdown in',
+                                    required=True,
+                                    default='rows')
+    pivot_top = fields.Integer(
+        string='Number of values',
+        default=10,
+        help='Number of values with the largest amounts to display, '
+             'the other values being grouped (0 to display all values).')
+    sql_time_budget = fields.Integer(
+        string='SQL time budget (s)',
+        help='Maximum time spent in SQL queries to compute the report, '
+             'in seconds. The values that can not be computed within '
+             'this time are displayed as #TIMEOUT. Leave empty to use '
+             'the mis_builder.sql_time_budget system parameter.')
+    snapshot_ids = fields.One2many(
+        comodel_name='mis.report.instance.snapshot',
+        inverse_name='report_instance_id',
+        string='Snapshots')
+    snapshot_id = fields.Many2one(
+        comodel_name='mis.report.instance.snapshot',
+        string='Frozen snapshot',
+        readonly=True,
+        copy=False,
+        help='The report displays, prints and exports this snapshot '
+             'instead of computing the report, until it is refreshed '
+             'or unfrozen.')
 
     @api.one
     def copy(self, default=None):
@@ -908,6 +1555,8 @@ class MisReportInstance(models.Model):
     @api.multi
     def print_pdf(self):
         self.ensure_one()
+        if self._get_valid_snapshot().has_pdf:
+            return self.snapshot_id._download('pdf_file', 'pdf_filename')
         data = {'context': self.env.context}
         return {
             'name': 'MIS report instance QWEB PDF report',
@@ -922,6 +1571,8 @@ class MisReportInstance(models.Model):
     @api.multi
     def export_xls(self):
         self.ensure_one()
+        if self._get_valid_snapshot().has_xls:
+            return self.snapshot_id._download('xls_file', 'xls_filename')
         return {
             'name': 'MIS report instance XLS report',
             'model': 'mis.report.instance',
@@ -947,7 +1598,88 @@ class MisReportInstance(models.Model):
         }
 
     @api.multi
-    def compute(self):
+    def _get_root_accounts(self):
+        """ Return the roots of the account charts to consolidate """
+        self.ensure_one()
+        return self.root_account | self.consolidation_root_account_ids
+
+    @api.multi
+    def _get_fiscal_calendar(self):
+        """ Return the fiscal periods of the company of the instance,
+        as a list of (period id, date_start, date_stop) sorted by date,
+        read once for all pivot dates by compute_pivot_dates() """
+        self.ensure_one()
+        calendars = self.env.context.get('mis_report_fiscal_calendars')
+        if calendars and self.company_id.id in calendars:
+            return calendars[self.company_id.id]
+        periods = self.env['account.period'].search_read(
+            [('special', '=', False),
+             ('company_id', '=', self.company_id.id)],
+            ['date_start', 'date_stop'], order='date_start')
+        return [(p['id'], p['date_start'], p['date_stop']) for p in periods]
+
+    @api.multi
+    def _get_company_rates_by_period(self, periods):
+        """ Return the rates converting the amounts of the consolidated
+        companies to the currency of the report, as a dictionary
+        {period id: {company_id: rate}}, or an empty dictionary
+        if all companies use the currency of the report.
+
+        The rates at the end of each period are looked up in the
+        currency rates, loaded once for all periods.
+        """
+        self.ensure_one()
+        rates_by_date = self._get_company_rates_by_date(
+            periods.mapped('date_to'))
+        return dict((period.id, rates_by_date[period.date_to])
+                    for period in periods if period.date_to in rates_by_date)
+
+    @api.multi
+    def _get_company_rates_by_date(self, dates):
+        """ Return the rates converting the amounts of the consolidated
+        companies to the currency of the report at the end of each
+        date, as a dictionary {date: {company_id: rate}}, or an empty
+        dictionary if all companies use the currency of the report
+        (see _get_company_rates_by_period) """
+        self.ensure_one()
+        companies = self._get_root_accounts().mapped('company_id')
+        currency = self.currency_id or self.company_id.currency_id
+        if all(c.currency_id == currency for c in companies) or not dates:
+            return {}
+        currencies = companies.mapped('currency_id') | currency
+        date_max = max(dates) + ' 23:59:59'
+        self.env.cr.execute("""
+            SELECT currency_id, name, rate FROM res_currency_rate
+            WHERE currency_id IN %s AND name <= %s
+            ORDER BY currency_id, name
+        """, (tuple(currencies.ids), date_max))
+        rates_by_currency_id = defaultdict(list)
+        for currency_id, name, rate in self.env.cr.fetchall():
+            rates_by_currency_id[currency_id].append((name, rate))
+
+        def get_rate(currency, date):
+            date = date + ' 23:59:59'
+            rates = rates_by_currency_id[currency.id]
+            i = bisect.bisect_right(rates, (date, float('inf')))
+            if not i:
+                raise UserError(_("No rate found for the currency %s "
+                                  "at the date %s.") %
+                                (currency.name, date[:10]))
+            return rates[i - 1][1]
+
+        res = {}
+        for date in set(dates):
+            report_rate = get_rate(currency, date)
+            res[date] = dict(
+                (company.id, report_rate / get_rate(company.currency_id,
+                                                    date))
+                for company in companies)
+        return res
+
+    @api.multi
+    def _get_report_to_compute(self):
+        """ Return the report template to compute for this instance,
+        taking the sub report being displayed into account """
         self.ensure_one()
 
         sub_report_ids = self.env.context.get('sub_report_ids')
@@ -961,31 +1693,674 @@ class MisReportInstance(models.Model):
                     report_id = self.env['mis.report'].browse(sub_report_id)
                     break
 
+        return report_id
+
+    @api.multi
+    def compute(self):
+        self.ensure_one()
+
+        report_id = self._get_report_to_compute()
+
+        if self._get_valid_snapshot() and report_id == self.report_id:
+            return self.snapshot_id.get_result()
+
         return self._compute(
             report_id=report_id,
             kpi_ids=report_id.kpi_ids,
         )
 
-    def _compute(self, report_id, kpi_ids=False):
+    @api.model
+    def _get_compute_workers(self):
+        """ Maximum number of threads used by _compute_concurrently() """
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            'mis_builder.compute_workers', COMPUTE_WORKERS))
+
+    @api.multi
+    def _compute_concurrently(self):
+        """ Compute several instances concurrently.
+
+        Each instance is computed in its own thread, on its own cursor,
+        so the total time is close to the time of the slowest instance.
+        Accounts are resolved once in the current environment for each
+        distinct (report, account chart) pair, and shared by all
+        instances using it.
+
+        The threads only read committed data: the changes not committed
+        yet by the current transaction are not visible to them. Set the
+        mis_builder.compute_workers system parameter to 1 to compute
+        the instances sequentially in the current transaction, which is
+        always the case in test mode (where all cursors are the same).
+
+        Returns a dictionary {instance id: result of compute()}.
+        """
+        if len(self) <= 1 or self._get_compute_workers() <= 1 or \
+                openerp.tools.config['test_enable'] or \
+                getattr(self.pool, 'test_cr', None) is not None:
+            return {instance.id: instance.compute() for instance in self}
+
+        res = {}
+        aeps = {}
+        jobs = []
+        for instance in self:
+            report = instance._get_report_to_compute()
+            if instance._get_valid_snapshot() and \
+                    report == instance.report_id:
+                res[instance.id] = instance.snapshot_id.get_result()
+                continue
+            root_accounts = instance._get_root_accounts()
+            key = (report.id, tuple(sorted(root_accounts.ids)))
+            if key not in aeps:
+                aeps[key] = report._prepare_aep(root_accounts)
+            jobs.append((instance.id, report.id, aeps[key]))
+
+        dbname = self.env.cr.dbname
+        uid = self.env.uid
+        context = self.env.context
+
+        def compute_job(job):
+            instance_id, report_id, aep = job
+            threading.current_thread().dbname = dbname
+            with api.Environment.manage():
+                cr = openerp.registry(dbname).cursor()
+                try:
+                    env = api.Environment(cr, uid, context)
+                    instance = env['mis.report.instance'].browse(instance_id)
+                    report = env['mis.report'].browse(report_id)
+                    return instance_id, instance._compute(
+                        report_id=report,
+                        kpi_ids=report.kpi_ids,
+                        aep=aep.copy(env),
+                    )
+                finally:
+                    # read only: close without commit
+                    cr.close()
+
+        if not jobs:
+            return res
+        pool = ThreadPool(min(len(jobs), self._get_compute_workers()))
+        try:
+            res.update(pool.map(compute_job, jobs))
+            return res
+        finally:
+            pool.terminate()
+
+    @api.multi
+    def compute_profile(self):
+        """ Compute the instance, profiling the computation.
+
+        Returns a dictionary with the result of compute() as 'result'
+        and the profile of the computation as 'profile'
+        (see Profiler.get_profile()).
+        """
+        self.ensure_one()
+        profiler = Profiler(self.env.cr)
+        report_id = self._get_report_to_compute()
+        with profiler.profile('compute', self.name):
+            result = self._compute(
+                report_id=report_id,
+                kpi_ids=report_id.kpi_ids,
+                profiler=profiler,
+            )
+        return {
+            'result': result,
+            'profile': profiler.get_profile(),
+        }
+
+    @api.multi
+    def compute_pivot_dates(self, pivot_dates, series=False):
+        """ Compute the instance at several pivot dates at once (eg the
+        month ends of the last years, for trend charts).
+
+        The accounts are resolved and the fiscal periods are read once
+        for all pivot dates, and each distinct period of all pivot dates
+        (same dates and filters) is queried and evaluated once, the
+        queries being fetched for all periods at once. The instance is
+        computed without breakdown, from live data even if it is frozen.
+
+        Returns a list with the result of compute() at each pivot date,
+        or if series is True a time series as a dictionary with
+            * pivot_dates: the pivot dates
+            * kpis: a list with, for each kpi, a dictionary with
+                    kpi_name and kpi_unique_name (as in the rows of the
+                    result of compute()) and periods, a list with, for
+                    each period of the instance, a dictionary with the
+                    name of the period and vals, the value of the kpi
+                    at each pivot date
+        """
+        self.ensure_one()
+        report_id = self.report_id
+        lang_id = self._get_lang_id()
+        aep = report_id._prepare_aep(self._get_root_accounts())
+        calendars = {self.company_id.id: self._get_fiscal_calendar()}
+        instances = [self.with_context(mis_report_pivot_date=pivot_date,
+                                       mis_report_fiscal_calendars=calendars)
+                     for pivot_date in pivot_dates]
+
+        # the distinct periods of all pivot dates, by dates and filters
+        periods_by_bucket = OrderedDict()
+        buckets = {}
+        for i, instance in enumerate(instances):
+            for period in instance.period_ids.filtered('valid'):
+                bucket = (
+                    period.date_from, period.date_to,
+                    period.period_from.id, period.period_to.id,
+                    repr(period._get_additional_move_line_filter()),
+                    repr([period._get_additional_query_filter(query)
+                          for query in report_id.query_ids]))
+                periods_by_bucket.setdefault(bucket, period)
+                buckets[(i, period.id)] = bucket
+
+        compute_args = [(bucket, ) + period._get_compute_args()[0][1:]
+                        for bucket, period in periods_by_bucket.items()]
+        rates_by_date = self._get_company_rates_by_date(
+            [bucket[1] for bucket in periods_by_bucket])
+        company_rates_by_bucket = dict(
+            (bucket, rates_by_date[bucket[1]])
+            for bucket in periods_by_bucket if bucket[1] in rates_by_date)
+        budget = self._get_sql_budget()
+
+        def compute_buckets(read_env):
+            query_results_by_bucket = report_id._lazy_queries_by_period(
+                [(args[0], args[1], args[2], args[6])
+                 for args in compute_args],
+                env=read_env, budget=budget)
+            read_aep = aep.copy(read_env)
+            if self._use_columnar_evaluation(report_id):
+                return report_id._compute_columns(
+                    lang_id, read_aep, compute_args, self.target_move,
+                    query_results_by_period=query_results_by_bucket,
+                    company_rates_by_period=company_rates_by_bucket,
+                    budget=budget)
+            kpi_values_by_bucket = {}
+            for bucket, period in periods_by_bucket.items():
+                kpi_values_by_bucket[bucket] = period._compute(
+                    report_id, lang_id, read_aep,
+                    query_results=query_results_by_bucket[bucket],
+                    company_rates=company_rates_by_bucket.get(bucket),
+                    budget=budget)
+            return kpi_values_by_bucket
+
+        with self._cancellable(budget):
+            kpi_values_by_bucket = on_replica(self.env, compute_buckets)
+
+        results = []
+        kpi_values_by_pivot_date = []
+        for i, instance in enumerate(instances):
+            kpi_values_by_period_ids = {}
+            for period in instance.period_ids.filtered('valid'):
+                kpi_values = kpi_values_by_bucket[buckets[(i, period.id)]]
+                kpi_values_by_period_ids[period.id] = dict(
+                    (kpi_name, dict(kpi_value, period_id=period.id))
+                    for kpi_name, kpi_value in kpi_values.items())
+            kpi_values_by_pivot_date.append(kpi_values_by_period_ids)
+            results.append(instance._format_result(
+                report_id, report_id.kpi_ids, lang_id,
+                kpi_values_by_period_ids))
+        if not series:
+            return results
+
+        kpis = []
+        for kpi in report_id._get_plan().kpis:
+            kpis.append({
+                'kpi_name': kpi.description,
+                'kpi_unique_name': kpi.name,
+                'periods': [{
+                    'name': period.name,
+                    'vals': [
+                        kpi_values_by_period_ids[period.id][kpi.name]['val']
+                        if period.id in kpi_values_by_period_ids else None
+                        for kpi_values_by_period_ids
+                        in kpi_values_by_pivot_date],
+                } for period in self.period_ids],
+            })
+        return {
+            'pivot_dates': list(pivot_dates),
+            'kpis': kpis,
+        }
+
+    @api.multi
+    def freeze(self):
+        """ Compute the instances and store their result in a new
+        snapshot, with its PDF and XLS renderings. Until it is refreshed
+        (by freezing the instance again) or unfrozen, the snapshot is
+        displayed, printed and exported instead of computing the report,
+        as long as the pivot date and the settings of the instance do not
+        change (see _get_valid_snapshot).
+        """
+        snapshot_model = self.env['mis.report.instance.snapshot']
+        for instance in self:
+            watermark = snapshot_model._get_watermark()
+            result = instance._compute(
+                report_id=instance.report_id,
+                kpi_ids=instance.report_id.kpi_ids,
+            )
+            snapshot = snapshot_model.create({
+                'name': u'%s - %s' % (instance.name, instance.pivot_date),
+                'report_instance_id': instance.id,
+                'pivot_date': instance.pivot_date,
+                'settings': instance._get_snapshot_settings(),
+                'watermark': watermark,
+            })
+            snapshot._store(RESULT_ATTACHMENT, json.dumps(result))
+            instance.snapshot_id = snapshot
+            # render the snapshot that is now frozen
+            snapshot._render()
+        return True
+
+    @api.multi
+    def _get_snapshot_settings(self):
+        """ Return the settings of the instance determining its result,
+        at its pivot date, as a json string """
+        self.ensure_one()
+        return json.dumps({
+            'report_id': self.report_id.id,
+            'target_move': self.target_move,
+            'company_id': self.company_id.id,
+            'root_account': self.root_account.id,
+            'consolidation_root_account_ids':
+                self.consolidation_root_account_ids.ids,
+            'currency_id': self.currency_id.id,
+            'pivot_dimension_id': self.pivot_dimension_id.id,
+            'pivot_layout': self.pivot_layout,
+            'pivot_top': self.pivot_top,
+            'landscape_pdf': self.landscape_pdf,
+            'periods': [{
+                'id': period.id,
+                'name': period.name,
+                'date_from': period.date_from,
+                'date_to': period.date_to,
+                'period_from': period.period_from.id,
+                'period_to': period.period_to.id,
+                'normalize_factor': period.normalize_factor,
+                'comparison_column_ids': period.comparison_column_ids.ids,
+                'move_line_filter':
+                    repr(period._get_additional_move_line_filter()),
+                'query_filters': [
+                    repr(period._get_additional_query_filter(query))
+                    for query in self.report_id.query_ids],
+            } for period in self.period_ids.filtered('valid')],
+        }, sort_keys=True)
+
+    @api.multi
+    def _get_valid_snapshot(self):
+        """ Return the frozen snapshot of the instance if it has been
+        taken at the current pivot date with the current settings, and
+        an empty recordset otherwise (the report is then computed) """
+        self.ensure_one()
+        snapshot = self.snapshot_id
+        if not snapshot or snapshot.pivot_date != self.pivot_date or \
+                snapshot.settings != self._get_snapshot_settings():
+            return snapshot.browse()
+        return snapshot
+
+    @api.multi
+    def unfreeze(self):
+        """ Compute the report from the live data again """
+        self.write({'snapshot_id': False})
+        return True
+
+    @api.multi
+    def _use_columnar_evaluation(self, report_id):
+        """ Evaluate the KPIs of all periods at once (see
+        MisReport._compute_columns), unless the report references
+        other reports or the mis_builder.columnar_evaluation system
+        parameter is 0 """
+        if report_id._has_sub_reports():
+            return False
+        return bool(int(self.env['ir.config_parameter'].sudo().get_param(
+            'mis_builder.columnar_evaluation', '1')))
+
+    def _compute(self, report_id, kpi_ids=False, aep=None,
+                 profiler=NULL_PROFILER, pivot=True, budget=None):
+
+        if aep is None:
+            with profiler.profile('prepare_aep', report_id.code):
+                aep = report_id._prepare_aep(self._get_root_accounts())
+
+        if budget is None:
+            budget = self._get_sql_budget()
+
+        # read the move lines and query results on the replica, if any
+        with self._cancellable(budget):
+            return on_replica(self.env, lambda read_env: self._compute_data(
+                report_id, kpi_ids, aep.copy(read_env), read_env,
+                profiler=profiler, pivot=pivot, budget=budget))
+
+    @api.multi
+    def _get_sql_budget(self):
+        """ Return the SqlBudget of the computation of the instance,
+        from its SQL time budget or the mis_builder.sql_time_budget system
+        parameter (in seconds), and the mis_builder.statement_timeout
+        (in seconds) and mis_builder.query_max_rows system parameters """
+        self.ensure_one()
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return SqlBudget(
+            total=(self.sql_time_budget or
+                   float(get_param('mis_builder.sql_time_budget', 0))),
+            statement=float(get_param('mis_builder.statement_timeout', 0)),
+            max_rows=int(get_param('mis_builder.query_max_rows', 0)))
+
+    @api.multi
+    def _get_application_name(self):
+        """ Return the application name of the database sessions
+        computing the instance for the current user, with the token of
+        the computation given by the widget in the context
+        (mis_report_compute_token) """
+        self.ensure_one()
+        return 'mis_builder/%s/%s/%s' % (
+            self.id, self.env.uid,
+            self.env.context.get('mis_report_compute_token', ''))
+
+    @api.multi
+    @contextmanager
+    def _cancellable(self, budget):
+        """ Name the database sessions while they execute the SQL
+        statements of budget (each in a savepoint) to compute the
+        instance, so cancel_compute() only cancels these statements """
+        self.ensure_one()
+        budget.application_name = self._get_application_name()
+        try:
+            yield
+        finally:
+            budget.application_name = None
+
+    @api.multi
+    def cancel_compute(self):
+        """ Cancel the SQL statement being executed by the computation
+        of the instance by the current user with the same token (see
+        _get_application_name). The values not computed yet are displayed
+        as #TIMEOUT. """
+        self.ensure_one()
+        with replica_env(self.env) as read_env:
+            crs = [self.env.cr]
+            if read_env is not self.env:
+                crs.append(read_env.cr)
+            for cr in crs:
+                cr.execute("""
+                    SELECT pg_cancel_backend(pid) FROM pg_stat_activity
+                    WHERE application_name = %s AND pid <> pg_backend_pid()
+                """, (self._get_application_name(), ))
+        return True
+
+    @api.multi
+    def _compute_data(self, report_id, kpi_ids, aep, read_env,
+                      profiler=NULL_PROFILER, pivot=True,
+                      budget=NULL_BUDGET):
+        """ Compute the instance, reading the accounting data and the
+        query results with read_env, aep being bound to read_env """
+        lang_id = self._get_lang_id()
+
+        # fetch the queries used by the kpis for all periods at once,
+        # when they are first used
+        valid_periods = self.period_ids.filtered('valid')
+        query_results_by_period_ids = report_id._lazy_queries_by_period([
+            (period.id, period.date_from, period.date_to,
+             period._get_additional_query_filter)
+            for period in valid_periods], profiler=profiler, env=read_env,
+            budget=budget)
+
+        company_rates_by_period_ids = \
+            self._get_company_rates_by_period(valid_periods)
+
+        if pivot and self.pivot_dimension_id and \
+                not report_id._has_sub_reports():
+            return self._compute_pivot(
+                report_id, kpi_ids or report_id.kpi_ids, aep, lang_id,
+                valid_periods, query_results_by_period_ids,
+                profiler=profiler,
+                company_rates_by_period_ids=company_rates_by_period_ids,
+                budget=budget)
+
+        if self._use_columnar_evaluation(report_id):
+            # compute kpi values for all periods at once
+            kpi_values_by_period_ids = report_id._compute_columns(
+                lang_id, aep,
+                valid_periods._get_compute_args(),
+                self.target_move,
+                query_results_by_period=query_results_by_period_ids,
+                profiler=profiler,
+                company_rates_by_period=company_rates_by_period_ids,
+                budget=budget)
+        else:
+            # compute kpi values for each period
+            kpi_values_by_period_ids = {}
+
+            for period in valid_periods:
+                kpi_values = period._compute(
+                    report_id, lang_id, aep,
+                    query_results=query_results_by_period_ids[period.id],
+                    profiler=profiler,
+                    company_rates=company_rates_by_period_ids.get(period.id),
+                    budget=budget)
+                kpi_values_by_period_ids[period.id] = kpi_values
 
-        aep = report_id._prepare_aep(self.root_account)
+        return self._format_result(
+            report_id, kpi_ids, lang_id, kpi_values_by_period_ids)
 
+    @api.multi
+    def compute_breakdown(self, dimension='analytic_account_id', top=None):
+        """ Compute the instance for each value of a field of
+        account.move.line, with one accounting query per period
+        (see MisReport._compute_breakdown).
+
+        Returns a list of dictionaries, sorted by decreasing accounting
+        volume, with
+            * value: the dimension value (an id for many2one fields)
+            * name: its display name
+            * result: the result of compute() for this value
+        """
+        self.ensure_one()
+        report_id = self._get_report_to_compute()
+        if report_id._has_sub_reports():
+            raise UserError(_("Reports referencing other reports can not "
+                              "be broken down."))
+        aep = report_id._prepare_aep(self._get_root_accounts())
+        lang_id = self._get_lang_id()
+        valid_periods = self.period_ids.filtered('valid')
+        budget = self._get_sql_budget()
+
+        def compute_breakdown(read_env):
+            query_results_by_period_ids = \
+                report_id._lazy_queries_by_period([
+                    (period.id, period.date_from, period.date_to,
+                     period._get_additional_query_filter)
+                    for period in valid_periods],
+                    env=read_env, budget=budget)
+            return report_id._compute_breakdown(
+                lang_id, aep.copy(read_env),
+                valid_periods._get_compute_args(),
+                self.target_move,
+                dimension,
+                query_results_by_period=query_results_by_period_ids,
+                top=top,
+                company_rates_by_period=self._get_company_rates_by_period(
+                    valid_periods),
+                budget=budget,
+                columnar=self._use_columnar_evaluation(report_id))
+
+        with self._cancellable(budget):
+            values, names = on_replica(self.env, compute_breakdown)
+        res = []
+        for value in names:
+            res.append({
+                'value': value,
+                'name': names[value] or _('Undefined'),
+                'result': self._format_result(
+                    report_id, report_id.kpi_ids, lang_id,
+                    self._get_breakdown_slice(
+                        values, valid_periods, value)),
+            })
+        return res
+
+    @api.multi
+    def expand(self, kpi_name):
+        """ Return the contribution of each account to a kpi, as rows
+        with the columns of the result of compute().
+
+        The sums of the accounts are taken from the last computation of
+        the instance when it is recent enough and no journal item has been
+        changed since, so expanding a kpi right after displaying the
+        report does not query the move lines again.
+
+        Each row is a dictionary with
+            * account_id: the id of the account
+            * kpi_name: the code and name of the account
+            * cols: the value of the kpi for the account in each column,
+                    as in the result of compute()
+        """
+        self.ensure_one()
+        report_id = self._get_report_to_compute()
+        kpi = report_id._get_plan().kpis_by_name.get(kpi_name)
+        if not kpi or not kpi.has_account_var:
+            return []
+        aep = AEP(self.env)
+        aep.parse_expr(kpi.expression)
+        aep.done_parsing(self._get_root_accounts())
+        formatter = report_id._get_formatter(self._get_lang_id())
+        localdict = report_id._get_localdict()
+        valid_periods = self.period_ids.filtered('valid')
+        company_rates_by_period_ids = \
+            self._get_company_rates_by_period(valid_periods)
+        datas_by_account_by_period_ids = {}
+        account_ids = set()
+        for period in valid_periods:
+            datas_by_account = aep.get_data_by_account(
+                kpi.expression,
+                period._get_aep_data(
+                    aep, company_rates_by_period_ids.get(period.id)))
+            datas_by_account_by_period_ids[period.id] = datas_by_account
+            account_ids.update(datas_by_account)
+
+        def evaluate(account_id, period):
+            data = datas_by_account_by_period_ids[period.id].get(account_id)
+            if data is None:
+                return AccountingNone, kpi.render(formatter, AccountingNone)
+            try:
+                val = safe_eval(aep.replace_expr(kpi.expression, data),
+                                localdict)
+            except ZeroDivisionError:
+                return None, DIV0
+            except:
+                return None, ERR
+            return val, kpi.render(formatter, val)
+
+        res = []
+        accounts = self.env['account.account'].browse(list(account_ids))
+        for account in accounts.sorted(key=lambda a: a.code):
+            cols = []
+            for period in self.period_ids:
+                if not period.valid:
+                    continue
+                val, val_r = evaluate(account.id, period)
+                cols.append({
+                    'val': None if val is AccountingNone else val,
+                    'val_r': val_r,
+                    'period_id': period.id,
+                })
+                for compare_col in period.comparison_column_ids:
+                    if compare_col not in valid_periods:
+                        continue
+                    compare_val = evaluate(account.id, compare_col)[0]
+                    cols.append({
+                        'val_r': kpi.render_comparison(
+                            formatter, val, compare_val,
+                            period.normalize_factor,
+                            compare_col.normalize_factor)
+                    })
+            res.append({
+                'account_id': account.id,
+                'kpi_name': u'%s %s' % (account.code, account.name),
+                'cols': cols,
+            })
+        return res
+
+    @api.model
+    def _get_breakdown_slice(self, values, periods, value):
+        """ Return the kpi values of each period for a dimension value,
+        from the result of MisReport._compute_breakdown """
+        return dict((period.id, values[(period.id, value)])
+                    for period in periods)
+
+    @api.multi
+    def _compute_pivot(self, report_id, kpi_ids, aep, lang_id,
+                       valid_periods, query_results_by_period_ids,
+                       profiler=NULL_PROFILER,
+                       company_rates_by_period_ids=None,
+                       budget=NULL_BUDGET):
+        """ Compute the instance, expanding the rows or columns of the
+        result for each value of the pivot dimension, with one
+        accounting query per period (see MisReport._compute_breakdown) """
+        self.ensure_one()
+        values, names = report_id._compute_breakdown(
+            lang_id, aep,
+            valid_periods._get_compute_args(),
+            self.target_move,
+            self.pivot_dimension_id.name,
+            query_results_by_period=query_results_by_period_ids,
+            top=self.pivot_top,
+            profiler=profiler,
+            company_rates_by_period=company_rates_by_period_ids,
+            budget=budget,
+            columnar=self._use_columnar_evaluation(report_id))
+        result = self._format_result(
+            report_id, kpi_ids, lang_id,
+            self._get_breakdown_slice(values, valid_periods,
+                                      BREAKDOWN_TOTAL))
+        slices = [(names[value] or _('Undefined'),
+                   self._format_result(
+                       report_id, kpi_ids, lang_id,
+                       self._get_breakdown_slice(
+                           values, valid_periods, value)))
+                  for value in names]
+        for t, table in enumerate(result):
+            if self.pivot_layout == 'rows':
+                # a row for each value below the row of each kpi
+                content = []
+                for r, row in enumerate(table['content']):
+                    content.append(row)
+                    for name, slice_result in slices:
+                        content.append(dict(
+                            slice_result[t]['content'][r],
+                            kpi_name=u'\u2003' + name))
+                table['content'] = content
+            else:
+                # a column for each value before the column of
+                # each period
+                header = table['header'][0]
+                cols = []
+                for c, col in enumerate(header['cols']):
+                    for name, slice_result in slices:
+                        cols.append(dict(
+                            slice_result[t]['header'][0]['cols'][c],
+                            name=u'%s - %s' % (col['name'], name)))
+                    cols.append(col)
+                table['header'] = [dict(header, cols=cols)]
+                content = []
+                for r, row in enumerate(table['content']):
+                    row_cols = []
+                    for c, value in enumerate(row['cols']):
+                        for name, slice_result in slices:
+                            row_cols.append(
+                                slice_result[t]['content'][r]['cols'][c])
+                        row_cols.append(value)
+                    content.append(dict(row, cols=row_cols))
+                table['content'] = content
+        return result
+
+    @api.model
+    def _get_lang_id(self):
         # fetch user language only once
         # TODO: is this necessary?
         lang = self.env.user.lang
         if not lang:
             lang = 'en_US'
-        lang_id = self.env['res.lang'].search([('code', '=', lang)]).id
-
-        # compute kpi values for each period
-        kpi_values_by_period_ids = {}
-
-        for period in self.period_ids:
-            if not period.valid:
-                continue
-            kpi_values = period._compute(report_id, lang_id, aep)
-            kpi_values_by_period_ids[period.id] = kpi_values
+        return self.env['res.lang'].search([('code', '=', lang)]).id
 
+    @api.multi
+    def _format_result(self, report_id, kpi_ids, lang_id,
+                       kpi_values_by_period_ids):
+        """ Prepare the header and content of the result of compute()
+        from the kpi values of each period """
         # prepare header and content
         header = [{
             'kpi_name': '',
@@ -994,11 +2369,13 @@ class MisReportInstance(models.Model):
         content = []
         rows_by_kpi_name = {}
 
-        kpi_ids = kpi_ids or report_id.kpi_ids
+        plan = report_id._get_plan()
+        kpis = plan.get_kpis(kpi_ids and kpi_ids.ids)
+        formatter = report_id._get_formatter(lang_id)
 
         column = 0
 
-        for kpi in kpi_ids:
+        for kpi in kpis:
             if kpi.column_break:
                 column += 1
                 header_column = dict(header[0])
@@ -1013,6 +2390,8 @@ class MisReportInstance(models.Model):
                 'default_style': kpi.default_css_style,
                 'column': column,
                 'column_title': kpi.column_title,
+                'expandable': (not self.pivot_dimension_id and
+                               kpi.has_account_var),
             }
             content.append(rows_by_kpi_name[kpi.name])
 
@@ -1053,10 +2432,10 @@ class MisReportInstance(models.Model):
                                                    compare_col.name),
                              date=''))
                     # add comparison values
-                    for kpi in report_id.kpi_ids:
+                    for kpi in plan.kpis:
                         rows_by_kpi_name[kpi.name]['cols'].append({
                             'val_r': kpi.render_comparison(
-                                lang_id,
+                                formatter,
                                 kpi_values[kpi.name]['val'],
                                 compare_kpi_values[kpi.name]['val'],
                                 period.normalize_factor,
@@ -1075,3 +2454,155 @@ class MisReportInstance(models.Model):
                     if row['column'] == column and not row['column_title']],
             })
         return result
+
+
+class MisReportInstanceSnapshot(models.Model):
+    """ A frozen result of a report instance, stored with its PDF and XLS
+    renderings in compressed attachments """
+
+    _name = 'mis.report.instance.snapshot'
+    _order = 'id desc'
+
+    name = fields.Char(required=True, readonly=True)
+    report_instance_id = fields.Many2one(
+        comodel_name='mis.report.instance',
+        string='Report instance',
+        required=True,
+        readonly=True,
+        ondelete='cascade')
+    pivot_date = fields.Date(readonly=True)
+    settings = fields.Text(
+        readonly=True,
+        help='The settings of the instance when the snapshot was taken '
+             '(see mis.report.instance._get_snapshot_settings).')
+    watermark = fields.Integer(
+        readonly=True,
+        help='The largest id of the journal items when the snapshot '
+             'was taken.')
+    outdated = fields.Boolean(
+        compute='_compute_outdated',
+        string='New journal items',
+        help='Journal items have been created since the snapshot '
+             'was taken.')
+    has_pdf = fields.Boolean(compute='_compute_has_files', string='PDF')
+    has_xls = fields.Boolean(compute='_compute_has_files', string='XLS')
+    # the files are only decompressed when downloaded
+    pdf_file = fields.Binary(compute='_compute_pdf_file', string='PDF')
+    pdf_filename = fields.Char(compute='_compute_has_files')
+    xls_file = fields.Binary(compute='_compute_xls_file', string='XLS')
+    xls_filename = fields.Char(compute='_compute_has_files')
+
+    @api.model
+    def _get_watermark(self):
+        self.env.cr.execute("SELECT max(id) FROM account_move_line")
+        return self.env.cr.fetchone()[0] or 0
+
+    @api.one
+    def _compute_outdated(self):
+        self.env.cr.execute("""
+            SELECT EXISTS(SELECT 1 FROM account_move_line WHERE id > %s)
+        """, (self.watermark, ))
+        self.outdated = self.env.cr.fetchone()[0]
+
+    @api.one
+    def _compute_has_files(self):
+        self.has_pdf = bool(self._get_attachment(PDF_ATTACHMENT))
+        self.pdf_filename = self.has_pdf and self.name + '.pdf'
+        self.has_xls = bool(self._get_attachment(XLS_ATTACHMENT))
+        self.xls_filename = self.has_xls and self.name + '.xls'
+
+    @api.one
+    def _compute_pdf_file(self):
+        pdf = self._load(PDF_ATTACHMENT)
+        self.pdf_file = pdf and base64.b64encode(pdf)
+
+    @api.one
+    def _compute_xls_file(self):
+        xls = self._load(XLS_ATTACHMENT)
+        self.xls_file = xls and base64.b64encode(xls)
+
+    @api.multi
+    def _store(self, name, content):
+        """ Store content in a compressed attachment """
+        self.ensure_one()
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(content)
+        self.env['ir.attachment'].create({
+            'name': name,
+            'datas_fname': name,
+            'datas': base64.b64encode(buf.getvalue()),
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+
+    @api.multi
+    def _get_attachment(self, name):
+        self.ensure_one()
+        return self.env['ir.attachment'].search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('name', '=', name),
+        ], limit=1)
+
+    @api.multi
+    def _load(self, name):
+        """ Return the content of a compressed attachment, or None """
+        attachment = self._get_attachment(name)
+        if not attachment:
+            return None
+        buf = StringIO(base64.b64decode(attachment.datas))
+        with gzip.GzipFile(fileobj=buf, mode='rb') as f:
+            return f.read()
+
+    @api.multi
+    def get_result(self):
+        """ Return the stored result of compute() """
+        self.ensure_one()
+        return json.loads(self._load(RESULT_ATTACHMENT))
+
+    @api.multi
+    def _render(self):
+        """ Render and store the PDF and XLS reports of the snapshot,
+        which must be the frozen snapshot of its instance """
+        self.ensure_one()
+        instance = self.report_instance_id
+        try:
+            with self.env.cr.savepoint():
+                pdf = self.env['report'].get_pdf(
+                    instance, 'mis_builder.report_mis_report_instance')
+            self._store(PDF_ATTACHMENT, pdf)
+        except Exception:
+            _logger.warning("could not render the PDF of snapshot %s",
+                            self.name, exc_info=True)
+        try:
+            with self.env.cr.savepoint():
+                xls, report_format = openerp.report.render_report(
+                    self.env.cr, self.env.uid, instance.ids,
+                    'mis.report.instance.xls',
+                    {'model': 'mis.report.instance'},
+                    dict(self.env.context))
+            self._store(XLS_ATTACHMENT, xls)
+        except Exception:
+            _logger.warning("could not render the XLS of snapshot %s",
+                            self.name, exc_info=True)
+
+    @api.multi
+    def download_pdf(self):
+        return self._download('pdf_file', 'pdf_filename')
+
+    @api.multi
+    def download_xls(self):
+        return self._download('xls_file', 'xls_filename')
+
+    @api.multi
+    def _download(self, field_name, filename_field_name):
+        """ Return an action downloading a file of the snapshot """
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/binary/saveas?model=%s&field=%s&id=%d'
+                   '&filename_field=%s' % (self._name, field_name, self.id,
+                                           filename_field_name),
+            'target': 'self',
+        }
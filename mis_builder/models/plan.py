@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Compiled plans of MIS reports.
+
+The computation of a report reads the definition of its KPIs for each
+period and each KPI, then again to render and format the values. A
+ReportPlan is a copy of this definition in plain objects with
+__slots__. It is read once with the ORM and cached until the report, its
+KPIs or its queries are modified (see MisReport._get_plan). The
+expressions are analysed once: the names they use, their accounting
+variables and their references to other reports. The rendering
+parameters are resolved at the same time.
+
+The expressions themselves are still evaluated with safe_eval, which
+does not accept code objects.
+"""
+
+from .accounting_none import AccountingNone
+from .aep import AccountingExpressionProcessor as AEP
+from .query_result import expression_names
+
+
+class Formatter(object):
+    """ Format the KPI values in a language (see KpiPlan.render) """
+
+    __slots__ = ('lang', 'pp')
+
+    def __init__(self, lang, pp):
+        """
+        :param lang: a res.lang record
+        :param pp: the translation of the suffix of percentage points
+        """
+        self.lang = lang
+        self.pp = pp
+
+    def format_num(self, value, divider, dp, prefix, suffix,
+                   divider_label='', sign='-'):
+        # format number following user language
+        value = round(value / float(divider or 1), dp) or 0
+        value = self.lang.format('%%%s.%df' % (sign, dp), value,
+                                 grouping=True)
+        value = u'%s\N{NARROW NO-BREAK SPACE}%s\N{NO-BREAK SPACE}%s%s' % \
+            (prefix or '', value, divider_label, suffix or '')
+        value = value.replace('-', u'\N{NON-BREAKING HYPHEN}')
+        return value
+
+
+class KpiPlan(object):
+    """ The definition of a mis.report.kpi """
+
+    __slots__ = ('id', 'name', 'description', 'expression', 'css_style',
+                 'default_css_style', 'type', 'divider', 'divider_label',
+                 'dp', 'prefix', 'suffix', 'compare_method', 'column_break',
+                 'column_title', 'names', 'style_names', 'has_account_var',
+                 'has_dot')
+
+    def __init__(self, kpi):
+        self.id = kpi.id
+        self.name = kpi.name
+        self.description = kpi.description
+        self.expression = kpi.expression
+        self.css_style = kpi.css_style
+        self.default_css_style = kpi.default_css_style
+        self.type = kpi.type
+        self.divider = kpi.divider
+        divider_label = dict(
+            kpi._columns['divider'].selection).get(kpi.divider, '')
+        self.divider_label = divider_label if divider_label != '1' else ''
+        self.dp = kpi.dp
+        self.prefix = kpi.prefix
+        self.suffix = kpi.suffix
+        self.compare_method = kpi.compare_method
+        self.column_break = kpi.column_break
+        self.column_title = kpi.column_title
+        self.names = frozenset(expression_names(kpi.expression))
+        self.style_names = frozenset(expression_names(kpi.css_style))
+        self.has_account_var = AEP.has_account_var(kpi.expression)
+        self.has_dot = '.' in kpi.expression
+
+    def render(self, formatter, value):
+        """ render a KPI value as a unicode string, ready for display """
+        if value is None or value is AccountingNone:
+            return ''
+        elif self.type == 'num':
+            return formatter.format_num(value, self.divider, self.dp,
+                                        self.prefix, self.suffix,
+                                        self.divider_label)
+        elif self.type == 'pct':
+            return formatter.format_num(value, 0.01, self.dp, '', '%')
+        else:
+            return unicode(value)
+
+    def render_comparison(self, formatter, value, base_value,
+                          average_value, average_base_value):
+        """ render the comparison of two KPI values, ready for display
+
+        If the difference is 0, an empty string is returned.
+        """
+        if value is None:
+            value = AccountingNone
+        if base_value is None:
+            base_value = AccountingNone
+        if self.type == 'pct':
+            delta = value - base_value
+            if delta and round(delta, self.dp) != 0:
+                return formatter.format_num(delta, 0.01, self.dp,
+                                            '', formatter.pp, sign='+')
+        elif self.type == 'num':
+            if value and average_value:
+                value = value / float(average_value)
+            if base_value and average_base_value:
+                base_value = base_value / float(average_base_value)
+            if self.compare_method == 'diff':
+                delta = value - base_value
+                if delta and round(delta, self.dp) != 0:
+                    return formatter.format_num(
+                        delta, self.divider, self.dp,
+                        self.prefix, self.suffix, self.divider_label,
+                        sign='+')
+            elif self.compare_method == 'pct':
+                if base_value and round(base_value, self.dp) != 0:
+                    delta = (value - base_value) / abs(base_value)
+                    if delta and round(delta * 100, self.dp) != 0:
+                        return formatter.format_num(
+                            delta, 0.01, self.dp, '', '%', sign='+')
+        return ''
+
+
+class ReportPlan(object):
+    """ The definition of a mis.report: its KPIs in sequence and the
+    names of its queries """
+
+    __slots__ = ('report_id', 'kpis', 'kpis_by_name', 'query_names',
+                 'used_query_names')
+
+    def __init__(self, report):
+        self.report_id = report.id
+        self.kpis = [KpiPlan(kpi) for kpi in report.kpi_ids]
+        self.kpis_by_name = dict((kpi.name, kpi) for kpi in self.kpis)
+        self.query_names = [query.name for query in report.query_ids]
+        names = set()
+        for kpi in self.kpis:
+            names |= kpi.names | kpi.style_names
+        # the queries used in the expressions or css styles of the KPIs
+        self.used_query_names = [name for name in self.query_names
+                                 if name in names]
+
+    def get_kpis(self, kpi_ids=None):
+        """ Return the plans of the KPIs of ids kpi_ids in sequence,
+        or of all KPIs """
+        if not kpi_ids:
+            return self.kpis
+        kpi_ids = set(kpi_ids)
+        return [kpi for kpi in self.kpis if kpi.id in kpi_ids]
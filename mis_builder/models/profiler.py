@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Profiling of report computations.
+
+A Profiler records the wall time, number of SQL queries and optionally
+number of rows of each step of a computation, such as:
+    * prepare_aep: resolution of accounts,
+    * query: fetch of a mis.report.query (keyed on the query name),
+    * do_queries: fetch of accounting data for a period,
+    * aep_query: one (domain, mode) query of do_queries,
+    * sub_report: computation of a sub report (keyed on its code),
+    * kpi: evaluation of a KPI for a period (keyed on the KPI name).
+
+>>> class Cursor(object):
+...     sql_log_count = 0
+>>> cr = Cursor()
+>>> profiler = Profiler(cr)
+>>> with profiler.profile('query', 'invoices') as entry:
+...     cr.sql_log_count += 2
+...     entry['rows'] = 10
+>>> with profiler.profile('kpi', 'sales'):
+...     pass
+>>> profile = profiler.get_profile()
+>>> [(p['phase'], p['count'], p['sql_count']) for p in profile['phases']]
+[('kpi', 1, 0), ('query', 1, 2)]
+>>> sorted((e['key'], e.get('rows')) for e in profile['entries'])
+[('invoices', 10), ('sales', None)]
+>>> with NULL_PROFILER.profile('kpi', 'sales') as entry:
+...     entry['rows'] = 1
+>>> NULL_PROFILER.get_profile()
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class Profiler(object):
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.entries = []
+
+    def _sql_count(self):
+        return getattr(self.cr, 'sql_log_count', 0)
+
+    def start(self, phase, key=None):
+        """ Start profiling, returning an entry to pass to stop().
+        The entry is a dictionary that may be completed with additional
+        information such as rows. """
+        return {
+            'phase': phase,
+            'key': key,
+            'time': time.time(),
+            'sql_count': self._sql_count(),
+        }
+
+    def stop(self, entry):
+        entry['time'] = time.time() - entry['time']
+        entry['sql_count'] = self._sql_count() - entry['sql_count']
+        self.entries.append(entry)
+
+    @contextmanager
+    def profile(self, phase, key=None):
+        """ Profile the enclosed block, yielding the entry """
+        entry = self.start(phase, key)
+        try:
+            yield entry
+        finally:
+            self.stop(entry)
+
+    def get_profile(self):
+        """ Return the profile as a dictionary with
+            * phases: the total time, number of SQL queries and number of
+                      occurences of each phase,
+            * entries: all profiled entries, slowest first. """
+        phases = {}
+        for entry in self.entries:
+            phase = phases.setdefault(entry['phase'], {
+                'phase': entry['phase'],
+                'time': 0.0,
+                'sql_count': 0,
+                'count': 0,
+            })
+            phase['time'] += entry['time']
+            phase['sql_count'] += entry['sql_count']
+            phase['count'] += 1
+        return {
+            'phases': [phases[p] for p in sorted(phases)],
+            'entries': sorted(self.entries,
+                              key=lambda e: e['time'], reverse=True),
+        }
+
+
+class NullProfiler(object):
+    """ A profiler that does nothing """
+
+    def start(self, phase, key=None):
+        return {}
+
+    def stop(self, entry):
+        pass
+
+    @contextmanager
+    def profile(self, phase, key=None):
+        yield {}
+
+    def get_profile(self):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import re
+from collections import OrderedDict, namedtuple
+
+from openerp.models import expression
+
+from .accounting_none import AccountingNone
+from .aggregate import _sum, _avg, _min, _max
+
+_logger = logging.getLogger(__name__)
+
+# number of records read at once when iterating query results
+CHUNK_SIZE = 1000
+
+# SQL aggregate functions for mis.report.query aggregate methods;
+# they return NULL (ie None) for empty sets, same as the
+# functions of aggregate.py
+SQL_AGGREGATES = {
+    'sum': 'SUM',
+    'avg': 'AVG',
+    'min': 'MIN',
+    'max': 'MAX',
+}
+
+PYTHON_AGGREGATES = {
+    'sum': _sum,
+    'avg': _avg,
+    'min': _min,
+    'max': _max,
+}
+
+# field types that can be summed or averaged
+NUMERIC_TYPES = ('integer', 'float')
+
+_row_classes = {}
+
+_NAME_RE = re.compile(r'\b[a-zA-Z_]\w*')
+
+
+class AutoStruct(object):
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+class GroupedResult(dict):
+    """ Result of an aggregated query with fields to group by.
+
+    It maps the values of the fields to group by (a tuple if there
+    are several such fields, many2one fields being represented by
+    the id of the related record) to an AutoStruct with a count
+    attribute and one attribute per aggregated field.
+    Missing groups have a count of 0 and None aggregated values.
+    """
+
+    def __init__(self, field_names):
+        super(GroupedResult, self).__init__()
+        self.field_names = field_names
+
+    def __missing__(self, key):
+        s = AutoStruct(count=0)
+        for field_name in self.field_names:
+            setattr(s, field_name, None)
+        return s
+
+
+def _row_class(field_names):
+    """ Return a compact tuple based class (without per instance
+    __dict__) with one attribute per field name """
+    field_names = tuple(field_names)
+    row_class = _row_classes.get(field_names)
+    if row_class is None:
+        row_class = namedtuple('QueryRow', field_names)
+        _row_classes[field_names] = row_class
+    return row_class
+
+
+class QueryRows(object):
+    """ Lazy result of a non aggregated mis.report.query.
+
+    Records matching the query domain are read by chunks while iterating,
+    and exposed as compact read only rows with one attribute per
+    field to fetch (plus id). Many2one fields hold the raw id
+    of the related record, without display name.
+
+    Only the ids of the matching records and the rows of the last chunk
+    read are kept in memory, so KPI expressions such as
+    sum([s.amount for s in inv]) stream over large results, while
+    results of one chunk are read once, however many times they are
+    iterated or indexed (inv[0]). len() does not read the records.
+    """
+
+    def __init__(self, model, domain, field_names, chunk_size=CHUNK_SIZE,
+                 ids=None):
+        self.model = model
+        self.domain = domain
+        if 'id' in field_names:
+            self.field_names = list(field_names)
+        else:
+            self.field_names = ['id'] + list(field_names)
+        self.chunk_size = chunk_size
+        # ids of the matching records, if they are already known
+        self._ids = ids
+        # (index of the first row, rows) of the last chunk read
+        self._chunk = None
+
+    def _get_ids(self):
+        if self._ids is None:
+            self._ids = self.model.search(self.domain).ids
+        return self._ids
+
+    def _read_chunk(self, start):
+        """ Return the rows of the chunk of records starting at index
+        start """
+        if self._chunk is None or self._chunk[0] != start:
+            chunk_ids = self._get_ids()[start:start + self.chunk_size]
+            data = self.model.browse(chunk_ids).read(
+                self.field_names, load='_classic_write')
+            # do not keep the records read in the environment cache
+            self.model.invalidate_cache(ids=chunk_ids)
+            row_class = _row_class(self.field_names)
+            self._chunk = (start, [row_class(*[d[f] for f in self.field_names])
+                                   for d in data])
+        return self._chunk[1]
+
+    def __len__(self):
+        return len(self._get_ids())
+
+    def __nonzero__(self):
+        return bool(self._get_ids())
+
+    def __iter__(self):
+        for start in range(0, len(self._get_ids()), self.chunk_size):
+            for row in self._read_chunk(start):
+                yield row
+
+    def __getitem__(self, index):
+        """ Return the row at index, or a list of rows for a slice """
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("query row index out of range")
+        start = index - index % self.chunk_size
+        return self._read_chunk(start)[index - start]
+
+
+def expression_names(expr):
+    """ Return the names used in a python expression, as a set.
+
+    Attribute names and words of string literals are included, so it is
+    a superset of the variables of the expression. """
+    return set(_NAME_RE.findall(expr or ''))
+
+
+class LazyQueryResults(object):
+    """ Results of the queries of a report for several periods, each
+    query being fetched for all the periods on first access.
+
+    fetch is a function taking a list of query names and returning their
+    results as {key: {query name: query result}}, and names are the
+    names of the queries that may be accessed (see
+    MisReport._lazy_queries_by_period). lazy_results[key] is a read
+    only mapping {query name: query result} of the period key, to pass
+    to load_query_results().
+    """
+
+    def __init__(self, fetch, keys, names):
+        self._fetch = fetch
+        self._results = dict((key, {}) for key in keys)
+        self.names = frozenset(names)
+        self._pending = set(names)
+
+    def load(self, names):
+        """ Fetch the queries of names that have not been fetched yet """
+        names = self._pending.intersection(names)
+        if not names:
+            return
+        for key, results in self._fetch(sorted(names)).items():
+            self._results[key].update(results)
+        self._pending -= names
+
+    def __getitem__(self, key):
+        return _PeriodQueryResults(self, key)
+
+
+class _PeriodQueryResults(object):
+    """ The lazy query results of a period (see LazyQueryResults) """
+
+    def __init__(self, lazy_results, key):
+        self._lazy_results = lazy_results
+        self._key = key
+
+    def __contains__(self, name):
+        return name in self._lazy_results.names
+
+    def __iter__(self):
+        return iter(self._lazy_results.names)
+
+    def __getitem__(self, name):
+        if name not in self._lazy_results.names:
+            raise KeyError(name)
+        self._lazy_results.load([name])
+        return self._lazy_results._results[self._key][name]
+
+
+def load_query_results(localdict, query_results, names):
+    """ Add to localdict the results of the queries of names (eg the
+    names used in an expression, see expression_names) that are not in
+    localdict yet.
+
+    query_results is a dictionary {query name: query result} or the lazy
+    results of a period (see LazyQueryResults), in which case the queries
+    are fetched on first use. """
+    names = [name for name in names
+             if name in query_results and name not in localdict]
+    if isinstance(query_results, _PeriodQueryResults):
+        # fetch the queries of the expression at once
+        query_results._lazy_results.load(names)
+    for name in names:
+        localdict[name] = query_results[name]
+
+
+def date_ranges_domain(date_field, date_ranges):
+    """ Domain matching records with date_field in any
+    of the [start, stop[ date_ranges """
+    return expression.OR([[(date_field, '>=', start),
+                           (date_field, '<', stop)]
+                          for start, stop in date_ranges])
+
+
+def _date_range_condition(date_column):
+    return '%s >= %%s AND %s < %%s' % (date_column, date_column)
+
+
+def get_query(model, domain):
+    """ Return the Query of the records of model matching domain,
+    with the record rules of the current user """
+    model.check_access_rights('read')
+    query = model._where_calc(domain)
+    model._apply_ir_rules(query, 'read')
+    return query
+
+
+def get_sql(query, select, select_params):
+    """ Return the SQL statement selecting the columns select from a
+    Query, and its parameters """
+    from_clause, where_clause, where_params = query.get_sql()
+    sql = 'SELECT %s FROM %s' % (', '.join(select), from_clause)
+    if where_clause:
+        sql += ' WHERE %s' % where_clause
+    return sql, select_params + where_params
+
+
+def aggregate_in_db(model, domain, field_names, aggregate,
+                    date_field=None, date_ranges=None, groupby=None):
+    """ Aggregate stored fields of the records matching domain
+    with a single SQL query.
+
+    Returns an AutoStruct with a count attribute and one attribute
+    per field name. Fields that cannot be aggregated with
+    the given method are set to AccountingNone.
+
+    If a list of stored fields to groupby is provided, the aggregation
+    is grouped in the database and a GroupedResult is returned
+    instead.
+
+    If date_field and a list of [start, stop[ date_ranges are provided,
+    records are bucketed by date range in the same query, and a list
+    of results is returned, one per date range. The domain
+    is not restricted to the date ranges by this function.
+    """
+    query = get_query(model, domain)
+    group_columns = [model._inherits_join_calc(field_name, query)
+                     for field_name in groupby or []]
+    sql_agg = SQL_AGGREGATES[aggregate]
+    agg_field_names = []
+    agg_columns = []
+    for field_name in field_names:
+        if aggregate in ('sum', 'avg') and \
+                model._fields[field_name].type not in NUMERIC_TYPES:
+            _logger.error('field %s of %s cannot be aggregated with %s',
+                          field_name, model._name, aggregate)
+            continue
+        agg_columns.append(model._inherits_join_calc(field_name, query))
+        agg_field_names.append(field_name)
+    select = list(group_columns)
+    select_params = []
+    if date_ranges is None:
+        select.append('COUNT(*)')
+        select.extend(['%s(%s)' % (sql_agg, column)
+                       for column in agg_columns])
+    else:
+        condition = _date_range_condition(
+            model._inherits_join_calc(date_field, query))
+        for date_range in date_ranges:
+            select.append('COUNT(CASE WHEN %s THEN 1 END)' % condition)
+            select.extend(['%s(CASE WHEN %s THEN %s END)' %
+                           (sql_agg, condition, column)
+                           for column in agg_columns])
+            select_params.extend(list(date_range) * (1 + len(agg_columns)))
+    sql, params = get_sql(query, select, select_params)
+    if group_columns:
+        sql += ' GROUP BY %s' % ', '.join(group_columns)
+    model.env.cr.execute(sql, params)
+    nb_ranges = 1 if date_ranges is None else len(date_ranges)
+    if groupby:
+        res = [GroupedResult(field_names) for i in range(nb_ranges)]
+    else:
+        res = [None] * nb_ranges
+    width = 1 + len(agg_columns)
+    for row in model.env.cr.fetchall():
+        if len(group_columns) == 1:
+            group = row[0]
+        else:
+            group = tuple(row[:len(group_columns)])
+        row = row[len(group_columns):]
+        for i in range(nb_ranges):
+            values = row[i * width:(i + 1) * width]
+            s = AutoStruct(count=values[0])
+            for field_name in field_names:
+                setattr(s, field_name, AccountingNone)
+            for field_name, v in zip(agg_field_names, values[1:]):
+                setattr(s, field_name, v)
+            if not groupby:
+                res[i] = s
+            elif s.count:
+                res[i][group] = s
+    if date_ranges is None:
+        return res[0]
+    return res
+
+
+def aggregate_in_python(model, domain, field_names, aggregate,
+                        groupby=None):
+    """ Same as aggregate_in_db() for one date range, but reading
+    the records and aggregating in python, which works for non stored
+    fields too. """
+    agg = PYTHON_AGGREGATES[aggregate]
+    groupby = groupby or []
+    data = model.search_read(domain, list(field_names) + list(groupby))
+    data_by_group = OrderedDict()
+    for d in data:
+        group = [d[field_name] for field_name in groupby]
+        # many2one: keep the id
+        group = tuple(isinstance(v, tuple) and v[0] or v for v in group)
+        if len(group) == 1:
+            group = group[0]
+        data_by_group.setdefault(group, []).append(d)
+    res = GroupedResult(field_names)
+    for group, group_data in data_by_group.items():
+        s = AutoStruct(count=len(group_data))
+        for field_name in field_names:
+            setattr(s, field_name,
+                    agg([d[field_name] for d in group_data]))
+        res[group] = s
+    if groupby:
+        return res
+    # no data: same as an empty group
+    return res[()]
+
+
+def search_ids_by_date_range(model, domain, date_field, date_ranges):
+    """ Search the records matching domain with a single SQL query,
+    and split their ids by [start, stop[ date range of date_field.
+
+    Returns a list of lists of ids, one per date range. The domain
+    is not restricted to the date ranges by this function.
+    """
+    query = get_query(model, domain)
+    select = ['"%s".id' % model._table,
+              model._inherits_join_calc(date_field, query)]
+    sql, params = get_sql(query, select, [])
+    model.env.cr.execute(sql + ' ORDER BY "%s".id' % model._table, params)
+    res = [[] for date_range in date_ranges]
+    for record_id, date in model.env.cr.fetchall():
+        if not date:
+            continue
+        for ids, (start, stop) in zip(res, date_ranges):
+            if start <= date < stop:
+                ids.append(record_id)
+    return res
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Vectors of values over several periods, to evaluate a KPI expression
+once for all the columns of a report.
+
+Arithmetic operations, comparisons, attribute access, item access and
+calls apply element by element, a scalar operand being broadcast to all
+elements. AccountingNone elements keep their semantics.
+
+>>> a = Vector([1, 2, 3])
+>>> b = Vector([2, 2, 0])
+>>> a + b
+Vector([3, 4, 3])
+>>> a * 2
+Vector([2, 4, 6])
+>>> -a
+Vector([-1, -2, -3])
+
+An element that cannot be computed becomes a KpiError, which propagates
+in subsequent operations:
+
+>>> c = a / b
+>>> c
+Vector([0, 1, KpiError('#DIV/0')])
+>>> (c + 1).values[2].code
+'#DIV/0'
+
+Functions of scalars are made to accept vectors with vectorize():
+
+>>> vsum = vectorize(sum)
+>>> vsum(Vector([[1, 2], [], 3]))
+Vector([3, 0, KpiError('#ERR')])
+>>> vectorize(max)(a, b)
+Vector([2, 2, 3])
+
+Control flow cannot be evaluated element by element, so it raises
+VectorFallback, to let the caller evaluate the expression
+for each period:
+
+>>> if a > 1:
+...     pass
+Traceback (most recent call last):
+ ...
+VectorFallback: a vector has no truth value
+>>> [x for x in a]
+Traceback (most recent call last):
+ ...
+VectorFallback: a vector is not iterable
+
+Identity tests and conditional expressions do not call the methods of
+their operands, so they would silently give the same result for all the
+periods. check_vectorizable() raises VectorFallback for the expressions
+using them, before they are evaluated on vectors:
+
+>>> check_vectorizable('(a is not AccountingNone) * a')
+Traceback (most recent call last):
+ ...
+VectorFallback: identity test on vectors
+>>> check_vectorizable('a if a is not AccountingNone else 0')
+Traceback (most recent call last):
+ ...
+VectorFallback: conditional expression on vectors
+>>> check_vectorizable('a and -(a + b) / a')
+"""
+
+import ast
+import operator
+import traceback
+
+__all__ = ['Vector', 'KpiError', 'VectorFallback', 'vectorize',
+           'check_vectorizable']
+
+DIV0 = '#DIV/0'
+ERR = '#ERR'
+
+
+class VectorFallback(TypeError):
+    """ Raised when an expression can not be evaluated on vectors """
+    pass
+
+
+class KpiError(object):
+    """ An element of a vector that could not be computed.
+
+    code is the rendered error (#DIV/0 or #ERR), and comment
+    explains the error (typically a traceback).
+    """
+
+    __slots__ = ('code', 'comment')
+
+    def __init__(self, code, comment=''):
+        self.code = code
+        self.comment = comment
+
+    def __repr__(self):
+        return 'KpiError(%r)' % (self.code, )
+
+
+def _apply(func, *args):
+    """ Apply func to scalar args, returning a KpiError if an
+    argument is a KpiError, or if func raises an exception """
+    for arg in args:
+        if isinstance(arg, KpiError):
+            return arg
+    try:
+        return func(*args)
+    except ZeroDivisionError:
+        return KpiError(DIV0, traceback.format_exc())
+    except VectorFallback:
+        raise
+    except Exception:
+        return KpiError(ERR, traceback.format_exc())
+
+
+def _size(args):
+    size = None
+    for arg in args:
+        if isinstance(arg, Vector):
+            if size is None:
+                size = len(arg.values)
+            elif size != len(arg.values):
+                raise ValueError("vectors of different sizes")
+    return size
+
+
+def _elements(arg, i):
+    if isinstance(arg, Vector):
+        return arg.values[i]
+    return arg
+
+
+def vectorize(func):
+    """ Make a function of scalars accept vectors, returning a vector
+    if one of its positional arguments is a vector """
+    def vfunc(*args):
+        size = _size(args)
+        if size is None:
+            return func(*args)
+        return Vector([_apply(func, *[_elements(arg, i) for arg in args])
+                       for i in range(size)])
+    vfunc.__name__ = func.__name__
+    return vfunc
+
+
+def check_vectorizable(expr):
+    """ Raise VectorFallback if expr uses identity tests (is, is not),
+    conditional expressions or isinstance(), whose results do not depend
+    on the values of the vectors """
+    tree = compile(expr, '<expression>', 'eval', ast.PyCF_ONLY_AST)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Compare) and \
+                any(isinstance(op, (ast.Is, ast.IsNot)) for op in node.ops):
+            raise VectorFallback("identity test on vectors")
+        if isinstance(node, ast.IfExp):
+            raise VectorFallback("conditional expression on vectors")
+        if isinstance(node, ast.Name) and node.id == 'isinstance':
+            raise VectorFallback("type test on vectors")
+
+
+def _binary(op):
+    vop = vectorize(op)
+
+    def method(self, other):
+        return vop(self, other)
+    return method
+
+
+def _reflected(op):
+    vop = vectorize(op)
+
+    def method(self, other):
+        return vop(other, self)
+    return method
+
+
+def _unary(op):
+    vop = vectorize(op)
+
+    def method(self):
+        return vop(self)
+    return method
+
+
+class Vector(object):
+
+    __slots__ = ('values', )
+
+    # AccountingNone leaves the operations with vectors to their
+    # reflected methods
+    _defers_accounting_none = True
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __repr__(self):
+        return 'Vector(%r)' % (self.values, )
+
+    def __len__(self):
+        raise VectorFallback("a vector has no length")
+
+    def __iter__(self):
+        raise VectorFallback("a vector is not iterable")
+
+    def __nonzero__(self):
+        raise VectorFallback("a vector has no truth value")
+
+    __bool__ = __nonzero__
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Vector([_apply(getattr, v, name) for v in self.values])
+
+    def __call__(self, *args):
+        return vectorize(lambda f, *a: f(*a))(self, *args)
+
+    __add__ = _binary(operator.add)
+    __radd__ = _reflected(operator.add)
+    __sub__ = _binary(operator.sub)
+    __rsub__ = _reflected(operator.sub)
+    __mul__ = _binary(operator.mul)
+    __rmul__ = _reflected(operator.mul)
+    __div__ = _binary(operator.div)
+    __rdiv__ = _reflected(operator.div)
+    __truediv__ = _binary(operator.truediv)
+    __rtruediv__ = _reflected(operator.truediv)
+    __floordiv__ = _binary(operator.floordiv)
+    __rfloordiv__ = _reflected(operator.floordiv)
+    __mod__ = _binary(operator.mod)
+    __rmod__ = _reflected(operator.mod)
+    __pow__ = _binary(operator.pow)
+    __rpow__ = _reflected(operator.pow)
+    __getitem__ = _binary(operator.getitem)
+    __lt__ = _binary(operator.lt)
+    __le__ = _binary(operator.le)
+    __eq__ = _binary(operator.eq)
+    __ne__ = _binary(operator.ne)
+    __gt__ = _binary(operator.gt)
+    __ge__ = _binary(operator.ge)
+    __neg__ = _unary(operator.neg)
+    __pos__ = _unary(operator.pos)
+    __abs__ = _unary(operator.abs)
+
+    __hash__ = None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
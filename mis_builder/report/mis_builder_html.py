@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+"""
+Fast html rendering of computed MIS reports, for the QWeb PDF report.
+
+Iterating the computed result cell by cell in a QWeb template is slow for
+large reports, and wkhtmltopdf uses a lot of memory to lay out very tall
+tables. render_tables() builds the html of the report body in one pass,
+replacing inline styles by css classes, and splits it in page sized
+fragments. The selectors of the css classes are more specific than the
+rules of bootstrap on table cells (.table-condensed>tbody>tr>td), so
+they override them like the inline styles did.
+
+The styles are edited by users, so only the declarations of the
+properties of STYLE_PROPERTIES with plain values are kept in the style
+element:
+
+>>> sanitize_style('color: red; font-weight:bold;')
+u'color: red; font-weight: bold'
+>>> sanitize_style('color: red} body {display: none')
+u''
+>>> sanitize_style('background: url(http://example.com/x.png); '
+...                'background-color: rgb(255, 0, 0)')
+u'background-color: rgb(255, 0, 0)'
+
+>>> tables = [{
+...     'header': [{'kpi_name': '',
+...                 'cols': [{'name': 'Q1', 'date': '2016'}]}],
+...     'content': [
+...         {'kpi_name': 'Sales & co',
+...          'default_style': 'font-weight: bold',
+...          'cols': [{'val_r': u'1\\xa0000', 'style': None}]},
+...         {'kpi_name': 'Costs', 'default_style': False,
+...          'cols': [{'val_r': u'<5>', 'style': 'color: red'}]},
+...         {'kpi_name': 'Other', 'default_style': '</style>',
+...          'cols': [{'val_r': u'0', 'style': None}]},
+...     ],
+... }]
+>>> fragments = render_tables(tables, rows_per_page=1)
+>>> len(fragments)
+3
+>>> print(fragments[0])  # doctest: +NORMALIZE_WHITESPACE
+<style>.table > tbody > tr > td.mis_s0,
+.table > tbody > tr > td > div.mis_s0
+{font-weight: bold}
+.table > tbody > tr > td.mis_s1,
+.table > tbody > tr > td > div.mis_s1
+{color: red}</style><table class="table table-condensed"><tr><td><table
+class="table table-condensed"><thead><tr><th><div></div></th><th
+class="text-center"><div>Q1</div><div>2016</div></th></tr></thead><tbody><tr><td
+class="mis_s0"><div class="text-left">Sales &amp; co</div></td><td
+class="mis_s0"><div class="text-right">1 000</div></td></tr></tbody></table></td></tr></table>
+>>> print(fragments[1])  # doctest: +NORMALIZE_WHITESPACE
+<table class="table table-condensed"><tr><td><table
+class="table table-condensed"><thead><tr><th><div></div></th><th
+class="text-center"><div>Q1</div><div>2016</div></th></tr></thead><tbody><tr><td><div
+class="text-left">Costs</div></td><td><div class="text-right mis_s1">&lt;5&gt;</div></td></tr></tbody></table></td></tr></table>
+>>> 'style' in fragments[2]
+False
+"""
+
+import re
+from cgi import escape
+
+# default number of kpi rows in each html fragment
+ROWS_PER_PAGE = 50
+# the css properties kept in the style element
+STYLE_PROPERTIES = frozenset([
+    'background-color', 'border', 'border-bottom', 'border-left',
+    'border-right', 'border-top', 'color', 'font-family', 'font-size',
+    'font-style', 'font-variant', 'font-weight', 'letter-spacing',
+    'line-height', 'padding', 'padding-bottom', 'padding-left',
+    'padding-right', 'padding-top', 'text-align', 'text-decoration',
+    'text-indent', 'text-transform', 'vertical-align', 'white-space',
+])
+# words, numbers, units, colors and color functions
+_STYLE_VALUE_RE = re.compile(
+    r'^(?:[\w\s#%.,+-]|(?:rgba?|hsla?)\([\d\s.,%]*\))*$')
+
+
+def _esc(value):
+    if not value:
+        return u''
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return escape(value, True)
+
+
+def sanitize_style(style):
+    """ Return the declarations of style whose property is in
+    STYLE_PROPERTIES and whose value is plain (without urls, escapes,
+    braces or tags) """
+    declarations = []
+    for declaration in (style or u'').split(';'):
+        if ':' not in declaration:
+            continue
+        name, value = declaration.split(':', 1)
+        name = name.strip().lower()
+        value = value.strip()
+        if name in STYLE_PROPERTIES and value and \
+                _STYLE_VALUE_RE.match(value):
+            declarations.append(u'%s: %s' % (name, value))
+    return u'; '.join(declarations)
+
+
+def _render_header(table):
+    html = [u'<thead><tr>']
+    for h in table['header']:
+        html.append(u'<th><div>%s</div></th>' % _esc(h['kpi_name']))
+        for col in h['cols']:
+            html.append(u'<th class="text-center"><div>%s</div>'
+                        u'<div>%s</div></th>' %
+                        (_esc(col['name']), _esc(col['date'])))
+    html.append(u'</tr></thead>')
+    return u''.join(html)
+
+
+def render_tables(tables, rows_per_page=ROWS_PER_PAGE):
+    """ Render the result of mis.report.instance.compute() as html.
+
+    Returns a list of html fragments (unicode strings), each containing
+    at most rows_per_page rows of each table of the result. The
+    first fragment starts with a style element declaring the css
+    classes used by all fragments.
+    """
+    css_classes = {}
+
+    def css_class(style):
+        style = sanitize_style(style)
+        if not style:
+            return u''
+        if style not in css_classes:
+            css_classes[style] = u'mis_s%d' % len(css_classes)
+        return css_classes[style]
+
+    headers = [_render_header(table) for table in tables]
+    nb_rows = max([len(table['content']) for table in tables] or [0])
+    fragments = []
+    for start in range(0, max(nb_rows, 1), rows_per_page):
+        html = [u'<table class="table table-condensed"><tr>']
+        for table, header in zip(tables, headers):
+            html.append(u'<td><table class="table table-condensed">')
+            html.append(header)
+            html.append(u'<tbody>')
+            for row in table['content'][start:start + rows_per_page]:
+                row_class = css_class(row.get('default_style'))
+                td = row_class and u'<td class="%s">' % row_class or u'<td>'
+                html.append(u'<tr>%s<div class="text-left">%s</div></td>' %
+                            (td, _esc(row['kpi_name'])))
+                for value in row['cols']:
+                    cell_class = css_class(value.get('style'))
+                    html.append(u'%s<div class="text-right%s">%s</div></td>' %
+                                (td,
+                                 cell_class and u' ' + cell_class or u'',
+                                 _esc(value.get('val_r'))))
+                html.append(u'</tr>')
+            html.append(u'</tbody></table></td>')
+        html.append(u'</tr></table>')
+        fragments.append(u''.join(html))
+    if css_classes and fragments:
+        css = u'\n'.join(
+            u'.table > tbody > tr > td.%s, .table > tbody > tr > td > div.%s'
+            u'\n{%s}' % (cls, cls, style)
+            for style, cls in sorted(css_classes.items(),
+                                     key=lambda item: item[1]))
+        fragments[0] = u'<style>%s</style>' % css + fragments[0]
+    return fragments
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
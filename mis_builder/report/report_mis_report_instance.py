@@ -6,6 +6,8 @@ import logging
 
 from openerp import api, models
 
+from .mis_builder_html import render_tables, ROWS_PER_PAGE
+
 _logger = logging.getLogger(__name__)
 
 
@@ -16,14 +18,18 @@ class ReportMisReportInstance(models.AbstractModel):
     @api.multi
     def render_html(self, data=None):
         docs = self.env['mis.report.instance'].browse(self._ids)
-        docs_computed = {}
-        for doc in docs:
-            docs_computed[doc.id] = doc.compute()
+        docs_computed = docs._compute_concurrently()
+        rows_per_page = int(self.env['ir.config_parameter'].sudo().get_param(
+            'mis_builder.pdf_rows_per_page', ROWS_PER_PAGE))
+        docs_html = {}
+        for doc_id, computed in docs_computed.items():
+            docs_html[doc_id] = render_tables(computed, rows_per_page)
         docargs = {
             'doc_ids': self._ids,
             'doc_model': 'mis.report.instance',
             'docs': docs,
             'docs_computed': docs_computed,
+            'docs_html': docs_html,
         }
         return self.env['report'].\
             render('mis_builder.report_mis_report_instance', docargs)
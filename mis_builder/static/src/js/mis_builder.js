@@ -10,7 +10,9 @@ openerp.mis_builder = function(instance) {
         init: function() {
             this._super.apply(this, arguments);
             this.mis_report_data = null;
+            this.mis_report_profile = null;
             this.mis_report_instance_id = false;
+            this.compute_token = false;
             this.field_manager.on("view_content_has_changed", this, this.reload_widget);
         },
 
@@ -76,13 +78,45 @@ openerp.mis_builder = function(instance) {
                 self.do_action(result);
             });
         },
+        cancel: function() {
+            var self = this;
+            context = new instance.web.CompoundContext(self.build_context(), self.get_context()|| {});
+            context.add({'mis_report_compute_token': self.compute_token});
+            new instance.web.Model("mis.report.instance").call(
+                "cancel_compute",
+                [self.mis_report_instance_id],
+                {'context': context}
+            );
+        },
         generate_content: function() {
             var self = this;
             context = new instance.web.CompoundContext(self.build_context(), self.get_context()|| {});
+            // allow to cancel the computation while it runs: the token
+            // identifies it, and the call does not block the UI, so
+            // the Cancel button remains clickable
+            self.compute_token = Math.random().toString(36).slice(2, 10);
+            context.add({'mis_report_compute_token': self.compute_token});
+            var options = {'shadow': true};
+            self.$(".oe_mis_builder_cancel").show();
+            if (instance.session.debug) {
+                // in debug mode, display the profile of the computation
+                new instance.web.Model("mis.report.instance").call(
+                    "compute_profile",
+                    [self.mis_report_instance_id],
+                    {'context': context},
+                    options
+                ).then(function(result){
+                    self.mis_report_data = result.result;
+                    self.mis_report_profile = result.profile;
+                    self.renderElement();
+                });
+                return;
+            }
             new instance.web.Model("mis.report.instance").call(
                 "compute", 
                 [self.mis_report_instance_id], 
-                {'context': context}
+                {'context': context},
+                options
             ).then(function(result){
                 self.mis_report_data = result;
                 self.renderElement();
@@ -94,6 +128,7 @@ openerp.mis_builder = function(instance) {
             self.$(".oe_mis_builder_print").click(_.bind(this.print, this));
             self.$(".oe_mis_builder_export").click(_.bind(this.export_pdf, this));
             self.$(".oe_mis_builder_settings").click(_.bind(this.display_settings, this));
+            self.$(".oe_mis_builder_cancel").click(_.bind(this.cancel, this));
             var Users = new instance.web.Model('res.users');
             Users.call('has_group', ['account.group_account_user']).done(function (res) {
                 if (res) {
@@ -104,6 +139,47 @@ openerp.mis_builder = function(instance) {
         events: {
             "click a.mis_builder_drilldown": "drilldown",
             "click a.mis_builder_sub_report": "sub_report",
+            "click a.mis_builder_expand": "expand",
+        },
+
+        expand: function(event) {
+            var self = this;
+            var $link = $(event.target);
+            var $row = $link.closest("tr");
+            var kpi_name = JSON.parse($link.data("kpi-name"));
+            var $detail = $row.nextAll("tr.mis_builder_expanded").filter(function() {
+                return $(this).data("kpi-name") === kpi_name;
+            });
+            if ($detail.length) {
+                // collapse
+                $detail.remove();
+                $link.text("+");
+                return;
+            }
+            context = new instance.web.CompoundContext(self.build_context(), self.get_context()|| {});
+            new instance.web.Model("mis.report.instance").call(
+                "expand",
+                [self.mis_report_instance_id, kpi_name],
+                {'context': context}
+            ).then(function(result) {
+                var $after = $row;
+                _.each(result, function(detail) {
+                    var $tr = $("<tr/>")
+                        .addClass("mis_builder_expanded")
+                        .data("kpi-name", kpi_name);
+                    $("<td/>").addClass("mis_builder_expanded_name")
+                        .append($("<div/>").text(detail.kpi_name))
+                        .appendTo($tr);
+                    _.each(detail.cols, function(col) {
+                        $("<td/>").addClass("mis_builder_ralign")
+                            .append($("<div/>").text(col.val_r || ""))
+                            .appendTo($tr);
+                    });
+                    $after.after($tr);
+                    $after = $tr;
+                });
+                $link.text("-");
+            });
         },
 
         drilldown: function(event) {
@@ -112,10 +188,12 @@ openerp.mis_builder = function(instance) {
             if (drilldown) {
                 var period_id = JSON.parse($(event.target).data("period-id"));
                 var val_c = JSON.parse($(event.target).data("expr"));
+                var dimension = JSON.parse($(event.target).data("dimension") || "null");
+                var dimension_value = JSON.parse($(event.target).data("dimension-value") || "null");
                 context = new instance.web.CompoundContext(self.build_context(), self.get_context()|| {});
                 new instance.web.Model("mis.report.instance.period").call(
                     "drilldown",
-                    [period_id, val_c],
+                    [period_id, val_c, dimension, dimension_value],
                     {'context': context}
                 ).then(function(result) {
                     if (result) {
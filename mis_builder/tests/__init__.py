@@ -3,3 +3,8 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from . import test_mis_builder
+from . import test_budget
+from . import test_journal_change
+from . import test_replica
+from . import test_snapshot
+from . import test_vector
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+
+def create_move(env, root_account, amount, journal_type='general'):
+    """ Create a draft move of amount between two accounts of the chart
+    of root_account """
+    accounts = env['account.account'].search(
+        [('type', '=', 'other'),
+         ('id', 'child_of', root_account.id)], limit=2)
+    return env['account.move'].create({
+        'journal_id': env['account.journal'].search(
+            [('type', '=', journal_type)], limit=1).id,
+        'line_id': [(0, 0, {'name': 'debit',
+                            'account_id': accounts[0].id,
+                            'debit': amount}),
+                    (0, 0, {'name': 'credit',
+                            'account_id': accounts[1].id,
+                            'credit': amount})],
+    })
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import openerp.tests.common as common
+
+from ..models.budget import TIMEOUT, BudgetExceeded, SqlBudget
+from .accounting import create_move
+
+
+class TestBudget(common.TransactionCase):
+
+    def test_statement_timeout(self):
+        # a statement exceeding its timeout is canceled, and the
+        # transaction goes on
+        budget = SqlBudget(statement=0.1)
+        with self.assertRaises(BudgetExceeded):
+            with budget.statement(self.env.cr):
+                self.env.cr.execute("SELECT pg_sleep(1)")
+        self.env.cr.execute("SELECT 1")
+
+    def test_application_name(self):
+        # only the statements of the budget can be canceled
+        budget = SqlBudget(application_name='mis_builder/test')
+        with budget.statement(self.env.cr):
+            self.env.cr.execute("SHOW application_name")
+            self.assertEqual(self.env.cr.fetchone()[0], 'mis_builder/test')
+        self.env.cr.execute("SHOW application_name")
+        self.assertNotEqual(self.env.cr.fetchone()[0], 'mis_builder/test')
+
+    def test_max_rows(self):
+        # the kpis using a query returning too many rows are #TIMEOUT,
+        # the others are computed
+        root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        create_move(self.env, root_account, 100.0)
+        aml_fields = self.env['ir.model.fields'].search(
+            [('model', '=', 'account.move.line'),
+             ('name', 'in', ('debit', 'date'))])
+        report = self.env['mis.report'].create({
+            'name': 'Budget',
+            'query_ids': [(0, 0, {
+                'name': 'lines',
+                'model_id': aml_fields[0].model_id.id,
+                'field_ids': [(6, 0, aml_fields.filtered(
+                    lambda f: f.name == 'debit').ids)],
+                'date_field': aml_fields.filtered(
+                    lambda f: f.name == 'date').id,
+            })],
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'}),
+                        (0, 0, {'name': 'line_count',
+                                'description': 'Lines',
+                                'expression': 'len(lines)'})],
+        })
+        instance = self.env['mis.report.instance'].create({
+            'name': 'Budget',
+            'report_id': report.id,
+            'root_account': root_account.id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'today',
+                                   'type': 'd',
+                                   'offset': 0,
+                                   'duration': 1})],
+        })
+
+        def values():
+            return dict((row['kpi_name'], row['cols'][0])
+                        for row in instance.compute()[0]['content'])
+
+        debit = values()['Debit']['val']
+        self.assertTrue(debit >= 100.0)
+        self.env['ir.config_parameter'].set_param(
+            'mis_builder.query_max_rows', '1')
+        vals = values()
+        self.assertEqual(vals['Lines']['val_r'], TIMEOUT)
+        self.assertAlmostEqual(vals['Debit']['val'], debit)
+        self.assertTrue(instance.cancel_compute())
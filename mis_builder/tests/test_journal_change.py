@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import time
+
+import openerp.tests.common as common
+
+from ..models.journal_change import PRUNE_PARAM
+from .accounting import create_move
+
+
+class TestJournalChange(common.TransactionCase):
+
+    def setUp(self):
+        super(TestJournalChange, self).setUp()
+        self.root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        report = self.env['mis.report'].create({
+            'name': 'Journal changes',
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'})],
+        })
+        # an open period, refreshed from the cached sums
+        self.instance = self.env['mis.report.instance'].create({
+            'name': 'Journal changes',
+            'report_id': report.id,
+            'root_account': self.root_account.id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'year',
+                                   'type': 'd',
+                                   'offset': -364,
+                                   'duration': 365})],
+        })
+        self.change_model = self.env['mis.report.journal.change']
+
+    def _get_debit(self):
+        return self.instance.compute()[0]['content'][0]['cols'][0]['val'] \
+            or 0.0
+
+    def test_delta_refresh(self):
+        total = self._get_debit()
+        self.assertAlmostEqual(self._get_debit(), total)
+        move = create_move(self.env, self.root_account, 100.0)
+        # the changes of the current transaction are computed in full,
+        # and not cached as they may be rolled back
+        self.assertAlmostEqual(self._get_debit(), total + 100.0)
+        move.line_id.filtered('debit').debit = 50.0
+        move.line_id.filtered('credit').credit = 50.0
+        self.assertAlmostEqual(self._get_debit(), total + 50.0)
+        move.unlink()
+        self.assertAlmostEqual(self._get_debit(), total)
+
+    def test_record(self):
+        count = self.change_model.search_count([])
+        move = create_move(self.env, self.root_account, 100.0)
+        self.assertTrue(self.change_model.search_count([]) > count)
+        # the journal items created with the move are recorded with it,
+        # not one by one
+        self.assertEqual(
+            set(self.change_model.search(
+                [('line_id', 'in', move.line_id.ids)]).mapped('line_id')),
+            set([min(move.line_id.ids)]))
+        count = self.change_model.search_count([])
+        move.line_id.write({'name': 'changed'})
+        self.assertTrue(self.change_model.search_count([]) > count)
+
+    def test_prune(self):
+        create_move(self.env, self.root_account, 100.0)
+        count = self.change_model.search_count([])
+        self.env.cr.execute("SELECT txid_current() + 1")
+        next_txid = self.env.cr.fetchone()[0]
+        param_model = self.env['ir.config_parameter']
+        # the previous run is too recent
+        param_model.set_param(PRUNE_PARAM, '%f %d:%d:' % (
+            time.time(), next_txid, next_txid))
+        self.change_model._prune()
+        self.assertEqual(self.change_model.search_count([]), count)
+        # the changes are not committed before the previous run
+        param_model.set_param(PRUNE_PARAM, '0 1:1:')
+        self.change_model._prune()
+        self.assertEqual(self.change_model.search_count([]), count)
+        # the changes are committed before the previous run
+        param_model.set_param(PRUNE_PARAM, '0 %d:%d:' % (
+            next_txid, next_txid))
+        self.change_model._prune()
+        self.assertEqual(self.change_model.search_count([]), 0)
@@ -2,9 +2,38 @@
 # © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import datetime
+import threading
+
 import openerp.tests.common as common
+from openerp import fields
+from openerp.tools import config
 
 from ..models import mis_builder
+from ..models.aep import AccountingExpressionProcessor as AEP, \
+    MODE_VARIATION
+from ..models.aggregate import _avg, _min, _max, _sum
+from ..models.profiler import Profiler
+from ..models.query_result import QueryRows, aggregate_in_db, \
+    aggregate_in_python
+from .accounting import create_move
+
+
+class SharedCursor(object):
+    """ The cursor of a test, lent to one thread at a time by
+    Registry.cursor() (closing it gives it back) """
+
+    def __init__(self, cr, lock, threads):
+        self._cr = cr
+        self._lock = lock
+        self._lock.acquire()
+        threads.append(threading.current_thread())
+
+    def __getattr__(self, name):
+        return getattr(self._cr, name)
+
+    def close(self):
+        self._lock.release()
 
 
 class TestMisBuilder(common.TransactionCase):
@@ -12,6 +41,28 @@ class TestMisBuilder(common.TransactionCase):
     def setUp(self):
         super(TestMisBuilder, self).setUp()
 
+    def _create_debit_instance(self):
+        """ Create a report of the debit of the journal items of the
+        first account chart, over one period of 20 years around today """
+        root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        report = self.env['mis.report'].create({
+            'name': 'Debit',
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'})],
+        })
+        return self.env['mis.report.instance'].create({
+            'name': 'Debit',
+            'report_id': report.id,
+            'root_account': root_account.id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'all',
+                                   'type': 'd',
+                                   'offset': -3650,
+                                   'duration': 7300})],
+        })
+
     def test_datetime_conversion(self):
         date_to_convert = '2014-07-05'
         date_time_convert = mis_builder._utc_midnight(
@@ -61,3 +112,404 @@ class TestMisBuilder(common.TransactionCase):
                              'name': u'today'}]
                    }],
              }, data)
+
+    def test_query_rows(self):
+        users = self.env['res.users'].search([])
+        rows = QueryRows(self.env['res.users'], [],
+                         ['login', 'company_id'], chunk_size=2)
+        self.assertEqual(len(rows), len(users))
+        row_list = list(rows)
+        self.assertEqual(row_list, list(rows))
+        self.assertEqual(rows[0], row_list[0])
+        self.assertEqual(rows[-1], row_list[-1])
+        self.assertEqual(rows[1:], row_list[1:])
+        with self.assertRaises(IndexError):
+            rows[len(users)]
+        rows = row_list
+        self.assertEqual(len(rows), len(users))
+        self.assertEqual(set(r.id for r in rows), set(users.ids))
+        admin = [r for r in rows if r.id == self.uid][0]
+        self.assertEqual(admin.login, 'admin')
+        # many2one fields are raw ids
+        self.assertEqual(admin.company_id, self.env.user.company_id.id)
+        self.assertFalse(hasattr(admin, '__dict__'))
+
+    def test_aggregate_in_db(self):
+        users = self.env['res.users'].search([])
+        for aggregate, agg in (('sum', _sum), ('avg', _avg),
+                               ('min', _min), ('max', _max)):
+            s = aggregate_in_db(self.env['res.users'], [],
+                                ['id'], aggregate)
+            self.assertEqual(s.count, len(users))
+            self.assertAlmostEqual(s.id, agg(users.ids))
+            # same None semantics as aggregate.py on empty sets
+            s = aggregate_in_db(self.env['res.users'], [('id', '<', 0)],
+                                ['id'], aggregate)
+            self.assertEqual(s.count, 0)
+            self.assertIsNone(s.id)
+
+    def test_fetch_queries_by_period(self):
+        rate_model = self.env['ir.model'].search(
+            [('model', '=', 'res.currency.rate')])
+        model_fields = self.env['ir.model.fields'].search(
+            [('model_id', '=', rate_model.id),
+             ('name', 'in', ('rate', 'name'))])
+        rate_field = model_fields.filtered(lambda f: f.name == 'rate')
+        date_field = model_fields.filtered(lambda f: f.name == 'name')
+        report = self.env['mis.report'].create({
+            'name': 'test rates',
+            'query_ids': [(0, 0, {
+                'name': 'rates',
+                'model_id': rate_model.id,
+                'field_ids': [(6, 0, rate_field.ids)],
+                'date_field': date_field.id,
+                'aggregate': 'max',
+            }), (0, 0, {
+                'name': 'all_rates',
+                'model_id': rate_model.id,
+                'field_ids': [(6, 0, rate_field.ids)],
+                'date_field': date_field.id,
+            })],
+        })
+        periods = [(1, '2010-01-01', '2010-12-31', None),
+                   (2, '2000-01-01', '2020-12-31', None),
+                   (3, '1900-01-01', '1900-12-31', None)]
+        res = report.with_context(tz='UTC')._fetch_queries_by_period(periods)
+        for key, date_from, date_to, _ in periods:
+            rates = self.env['res.currency.rate'].search(
+                [('name', '>=', date_from + ' 00:00:00'),
+                 ('name', '<=', date_to + ' 23:59:59')])
+            self.assertEqual(res[key]['rates'].count, len(rates))
+            self.assertEqual(res[key]['rates'].rate,
+                             _max(rates.mapped('rate')))
+            self.assertEqual(len(res[key]['all_rates']), len(rates))
+            self.assertEqual(set(r.id for r in res[key]['all_rates']),
+                             set(rates.ids))
+
+    def test_lazy_queries(self):
+        user_model = self.env['ir.model'].search([('model', '=', 'res.users')])
+        id_field = self.env['ir.model.fields'].search(
+            [('model_id', '=', user_model.id), ('name', '=', 'id')])
+        date_field = self.env['ir.model.fields'].search(
+            [('model_id', '=', user_model.id), ('name', '=', 'login_date')])
+        report = self.env['mis.report'].create({
+            'name': 'test lazy queries',
+            'query_ids': [(0, 0, {
+                'name': name,
+                'model_id': user_model.id,
+                'field_ids': [(6, 0, id_field.ids)],
+                'date_field': date_field.id,
+                'aggregate': 'sum',
+            }) for name in ('used', 'styled', 'unused')],
+            'kpi_ids': [(0, 0, {
+                'name': 'kpi',
+                'description': 'kpi',
+                'expression': 'used.count',
+                'css_style': "styled.count and 'font-weight: bold'",
+            })],
+        })
+        self.assertEqual(sorted(report._get_used_query_names()),
+                         ['styled', 'used'])
+        profiler = Profiler(self.env.cr)
+        results = report._lazy_queries_by_period(
+            [(1, '2000-01-01', '2000-12-31', None),
+             (2, '2001-01-01', '2001-12-31', None)], profiler=profiler)
+        self.assertFalse(profiler.entries)
+        self.assertNotIn('unused', results[1])
+        self.assertEqual(results[2]['used'].count, 0)
+        self.assertEqual(results[1]['used'].count, 0)
+        # each query is fetched once, for all periods
+        self.assertEqual([e['key'] for e in profiler.entries], ['used'])
+        # the errors of the queries are not rendered as kpi errors
+        report.query_ids.filtered(lambda q: q.name == 'used').domain = \
+            "[('login', '=', undefined)]"
+        instance = self.env['mis.report.instance'].create({
+            'name': 'test lazy queries',
+            'report_id': report.id,
+            'root_account': self.env['account.account'].search(
+                [('parent_id', '=', False)], limit=1).id,
+            'period_ids': [(0, 0, {'name': 'today',
+                                   'type': 'd',
+                                   'offset': 0,
+                                   'duration': 1})],
+        })
+        with self.assertRaises(ValueError):
+            instance.compute()
+
+    def test_aggregate_groupby(self):
+        rate_model = self.env['res.currency.rate']
+        rates = rate_model.search([])
+        for aggregate_func in (aggregate_in_db, aggregate_in_python):
+            res = aggregate_func(rate_model, [], ['rate'], 'max',
+                                 groupby=['currency_id'])
+            self.assertEqual(set(res.keys()),
+                             set(rates.mapped('currency_id').ids))
+            for currency in rates.mapped('currency_id'):
+                currency_rates = rates.filtered(
+                    lambda r: r.currency_id == currency)
+                self.assertEqual(res[currency.id].count,
+                                 len(currency_rates))
+                self.assertEqual(res[currency.id].rate,
+                                 _max(currency_rates.mapped('rate')))
+            # missing groups are empty
+            self.assertEqual(res[-1].count, 0)
+            self.assertIsNone(res[-1].rate)
+
+    def test_compute_profile(self):
+        instance = self.env.ref('mis_builder.mis_report_instance_test')
+        res = instance.compute_profile()
+        self.assertEqual(res['result'], instance.compute())
+        phases = dict((p['phase'], p) for p in res['profile']['phases'])
+        self.assertEqual(phases['compute']['count'], 1)
+        self.assertEqual(phases['query']['count'], 1)
+        self.assertEqual(phases['kpi']['count'], 1)
+        query_entry = [e for e in res['profile']['entries']
+                       if e['phase'] == 'query'][0]
+        self.assertEqual(query_entry['key'], 'test')
+        self.assertTrue(query_entry['sql_count'] >= 1)
+
+    def test_index_advisor(self):
+        advisor = self.env['mis.builder.index.advisor'].create({})
+        # account_id is indexed by the account module
+        self.assertTrue(advisor._find_index(
+            'account_move_line', ('account_id', ), None))
+        self.assertFalse(advisor._find_index(
+            'account_move', ('id', ), "state = 'posted'"))
+        # pg_get_indexdef adds casts and parentheses to the predicate
+        self.env.cr.execute("""
+            CREATE INDEX test_mis_builder_posted_index ON account_move
+            (id, journal_id) WHERE state='posted'
+        """)
+        self.assertEqual(advisor._find_index(
+            'account_move', ('id', ), "state = 'posted'"),
+            'test_mis_builder_posted_index')
+        self.assertFalse(advisor._find_index(
+            'account_move', ('id', ), "state = 'draft'"))
+        self.assertFalse(advisor._find_index(
+            'account_move', ('journal_id', ), "state = 'posted'"))
+        advisor.action_analyze()
+        self.assertEqual(advisor.state, 'analyzed')
+        for line in advisor.line_ids:
+            self.assertTrue(line.plan_before)
+
+    def test_compute_concurrently(self):
+        # computed sequentially on the test cursor
+        instances = self._create_debit_instance() | \
+            self.env.ref('mis_builder.mis_report_instance_test')
+        results = instances._compute_concurrently()
+        for instance in instances:
+            self.assertEqual(results[instance.id], instance.compute())
+
+    def test_compute_concurrently_threads(self):
+        # out of test mode, each instance is computed in a thread of
+        # the pool, on a cursor of its own, here the test cursor
+        instances = self._create_debit_instance() | \
+            self.env.ref('mis_builder.mis_report_instance_test')
+        self.env['ir.config_parameter'].set_param(
+            'mis_builder.compute_workers', '2')
+        lock = threading.Lock()
+        threads = []
+        self.registry.cursor = \
+            lambda: SharedCursor(self.env.cr, lock, threads)
+        self.addCleanup(delattr, self.registry, 'cursor')
+        self.addCleanup(config.__setitem__, 'test_enable',
+                        config['test_enable'])
+        config['test_enable'] = False
+        results = instances._compute_concurrently()
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        # the results of the threads are returned for their instance
+        self.assertEqual(sorted(results), sorted(instances.ids))
+        for instance in instances:
+            self.assertEqual(results[instance.id], instance.compute())
+
+    def test_compute_breakdown(self):
+        report = self.env['mis.report'].create({
+            'name': 'Breakdown',
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'})],
+        })
+        instance = self.env['mis.report.instance'].create({
+            'name': 'Breakdown',
+            'report_id': report.id,
+            'root_account': self.env['account.account'].search(
+                [('parent_id', '=', False)], limit=1).id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'all',
+                                   'type': 'd',
+                                   'offset': -3650,
+                                   'duration': 7300})],
+        })
+        total = instance.compute()[0]['content'][0]['cols'][0]['val']
+        breakdown = instance.compute_breakdown('journal_id')
+        self.assertTrue(breakdown)
+        self.assertAlmostEqual(
+            sum(b['result'][0]['content'][0]['cols'][0]['val'] or 0.0
+                for b in breakdown),
+            total or 0.0)
+
+    def test_compute_pivot(self):
+        instance = self._create_debit_instance()
+        total_row = instance.compute()[0]['content'][0]
+        journal_field = self.env['ir.model.fields'].search(
+            [('model', '=', 'account.move.line'),
+             ('name', '=', 'journal_id')])
+        self.assertIn(journal_field, self.env['ir.model.fields'].search(
+            instance._get_pivot_dimension_domain()))
+        instance.write({
+            'pivot_dimension_id': journal_field.id,
+            'pivot_layout': 'rows',
+            'pivot_top': 1,
+        })
+        content = instance.compute()[0]['content']
+        self.env['ir.config_parameter'].set_param(
+            'mis_builder.columnar_evaluation', '0')
+        self.assertEqual(instance.compute()[0]['content'], content)
+        self.env['ir.config_parameter'].set_param(
+            'mis_builder.columnar_evaluation', '1')
+        self.assertEqual(content[0]['cols'], total_row['cols'])
+        # the top journal, and the others if any
+        self.assertTrue(2 <= len(content) <= 3)
+        self.assertAlmostEqual(
+            sum(row['cols'][0]['val'] or 0.0 for row in content[1:]),
+            total_row['cols'][0]['val'] or 0.0)
+        instance.pivot_layout = 'cols'
+        data = instance.compute()[0]
+        self.assertEqual(len(data['header'][0]['cols']), len(content))
+        self.assertEqual(data['content'][0]['cols'][-1], total_row['cols'][0])
+
+    def test_consolidation(self):
+        instance = self._create_debit_instance()
+        periods = instance.period_ids
+        self.assertEqual(instance._get_company_rates_by_period(periods), {})
+        data = instance.compute()
+        # the account chart is not counted twice
+        instance.consolidation_root_account_ids = instance.root_account
+        self.assertEqual(instance.compute(), data)
+        # convert to another currency
+        currency = self.env['res.currency'].search(
+            [('id', '!=', instance.company_id.currency_id.id),
+             ('rate_ids', '!=', False)], limit=1)
+        instance.currency_id = currency
+        rates = instance._get_company_rates_by_period(periods)
+        self.assertEqual(rates[periods.id][instance.company_id.id],
+                         currency.with_context(date=periods.date_to).rate /
+                         instance.company_id.currency_id.with_context(
+                             date=periods.date_to).rate)
+
+    def test_drilldown_domain(self):
+        instance = self._create_debit_instance()
+        domain = instance.period_ids.drilldown('deb[]')['domain']
+        self.assertIn(('account_id', 'child_of', [instance.root_account.id]),
+                      domain)
+        # the drilldown shows the journal items summed in the report
+        aml_model = self.env['account.move.line']
+        self.assertAlmostEqual(
+            sum(aml_model.search(domain).mapped('debit')),
+            instance.compute()[0]['content'][0]['cols'][0]['val'] or 0.0)
+
+    def test_expand(self):
+        instance = self._create_debit_instance()
+        total = instance.compute()[0]['content'][0]['cols'][0]['val'] or 0.0
+        rows = instance.expand('debit')
+        self.assertAlmostEqual(
+            sum(row['cols'][0]['val'] or 0.0 for row in rows), total)
+        # the sums are queried again when journal items have changed
+        create_move(self.env, instance.root_account, 100.0)
+        rows = instance.expand('debit')
+        self.assertAlmostEqual(
+            sum(row['cols'][0]['val'] or 0.0 for row in rows),
+            total + 100.0)
+
+    def test_compute_pivot_dates(self):
+        instance = self._create_debit_instance()
+        instance.write({'period_ids': [
+            (0, 0, {'name': 'month',
+                    'type': 'fp',
+                    'offset': 0,
+                    'duration': 1}),
+            (0, 0, {'name': 'week',
+                    'type': 'w',
+                    'offset': -1,
+                    'duration': 1})]})
+        today = datetime.date.today()
+        pivot_dates = [fields.Date.to_string(today - datetime.timedelta(d))
+                       for d in (61, 30, 0)]
+        results = instance.compute_pivot_dates(pivot_dates)
+        series = instance.compute_pivot_dates(pivot_dates, series=True)
+        self.assertEqual(series['pivot_dates'], pivot_dates)
+        for i, (pivot_date, result) in enumerate(zip(pivot_dates, results)):
+            instance.date = pivot_date
+            self.assertEqual(result, instance.compute())
+            vals = [col.get('val') for col in result[0]['content'][0]['cols']]
+            self.assertEqual(
+                [period['vals'][i] for period in series['kpis'][0]['periods']
+                 if instance.period_ids.filtered(
+                     lambda p: p.name == period['name']).valid],
+                vals)
+
+    def test_plan(self):
+        instance = self._create_debit_instance()
+        plan = instance.report_id._get_plan()
+        self.assertEqual([kpi.name for kpi in plan.kpis], ['debit'])
+        kpi = plan.kpis_by_name['debit']
+        self.assertEqual(kpi.description, 'Debit')
+        self.assertTrue(kpi.has_account_var)
+        self.assertFalse(hasattr(kpi, '__dict__'))
+        formatter = instance.report_id._get_formatter(instance._get_lang_id())
+        self.assertEqual(kpi.render(formatter, None), '')
+        self.assertEqual(kpi.render(formatter, 1000.0),
+                         u'\u202f1,000\xa0')
+        self.assertEqual(kpi.render_comparison(formatter, 2.0, 1.0, 1, 1),
+                         u'\u202f+100\xa0%')
+
+    def test_aep_strategy(self):
+        # the results do not depend on how the accounting data is queried
+        instance = self._create_debit_instance()
+        instance.report_id.write({'kpi_ids': [(0, 0, {
+            'name': 'large_debit',
+            'description': 'Large debit',
+            'expression': "deb[][('debit', '>', 100)]",
+        })]})
+        create_move(self.env, instance.root_account, 1000.0)
+        results = {}
+        for strategy in ('read_group', 'merged', 'auto'):
+            self.env['ir.config_parameter'].set_param(
+                'mis_builder.aep_strategy', strategy)
+            results[strategy] = (instance.compute(),
+                                 instance.compute_breakdown('journal_id'))
+        self.assertEqual(results['merged'], results['read_group'])
+        self.assertEqual(results['auto'], results['read_group'])
+        content = results['auto'][0][0]['content']
+        self.assertTrue(content[1]['cols'][0]['val'] >= 1000.0)
+
+
+    def test_aep_merged_posted(self):
+        # the keys of posted moves join the moves, and are merged
+        # in one statement like the keys of all moves
+        root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        create_move(self.env, root_account, 100.0).post()
+        create_move(self.env, root_account, 50.0)
+        aep = AEP(self.env)
+        aml_model = self.env['account.move.line']
+        today = fields.Date.today()
+        for target_move in ('all', 'posted'):
+            domain = aep.get_aml_domain_for_dates(
+                today, today, None, None, MODE_VARIATION, target_move)
+            domains = {
+                ('', MODE_VARIATION): domain,
+                ("[('debit', '>', 60)]", MODE_VARIATION):
+                    domain + [('debit', '>', 60)],
+            }
+            statements = aep._get_merged_statements(domains)
+            self.assertEqual(len(statements), 1)
+            keys, sql, params = statements[0]
+            self.assertEqual(sorted(keys), sorted(domains))
+            self.env.cr.execute(sql, params)
+            rows = self.env.cr.fetchall()
+            for i, key in enumerate(keys):
+                self.assertAlmostEqual(
+                    sum(row[1 + 3 * i] or 0.0 for row in rows),
+                    sum(aml_model.search(domains[key]).mapped('debit')))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from psycopg2.extensions import TransactionRollbackError
+
+import openerp.tests.common as common
+from openerp.tools import config
+
+from ..models import replica
+from .accounting import create_move
+
+
+class TestReplica(common.TransactionCase):
+
+    def setUp(self):
+        super(TestReplica, self).setUp()
+        self.root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        report = self.env['mis.report'].create({
+            'name': 'Replica',
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'})],
+        })
+        self.instance = self.env['mis.report.instance'].create({
+            'name': 'Replica',
+            'report_id': report.id,
+            'root_account': self.root_account.id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'today',
+                                   'type': 'd',
+                                   'offset': 0,
+                                   'duration': 1})],
+        })
+        self.addCleanup(replica._unavailable_until.clear)
+        self.addCleanup(config.options.pop, 'mis_builder_replica_dsn', None)
+
+    def _get_debit(self):
+        return self.instance.compute()[0]['content'][0]['cols'][0]['val'] \
+            or 0.0
+
+    def _conflict(self, env):
+        """ Raise the error of a statement canceled by a conflict with
+        the recovery of a hot standby """
+        env.cr.execute("""
+            DO $$ BEGIN
+                RAISE EXCEPTION 'conflict with recovery'
+                USING ERRCODE = 'serialization_failure';
+            END $$
+        """)
+
+    def test_replica(self):
+        total = self._get_debit()
+        # not committed, so not visible on the replica
+        create_move(self.env, self.root_account, 100.0)
+        # a connection to the same database stands for the replica
+        config['mis_builder_replica_dsn'] = self.env.cr.dbname
+        with replica.replica_env(self.env) as read_env:
+            read_env.cr.execute('SHOW transaction_read_only')
+            self.assertEqual(read_env.cr.fetchone()[0], 'on')
+        self.assertAlmostEqual(self._get_debit(), total)
+        # fall back to the primary database
+        config['mis_builder_replica_dsn'] = 'postgresql://localhost:1/x'
+        with replica.replica_env(self.env) as read_env:
+            self.assertEqual(read_env, self.env)
+        self.assertAlmostEqual(self._get_debit(), total + 100.0)
+
+    def test_recovery_conflict(self):
+        # computed again on the primary database after a conflict on the
+        # replica, but not after an error on the primary
+        config['mis_builder_replica_dsn'] = self.env.cr.dbname
+        envs = []
+
+        def read(read_env):
+            envs.append(read_env)
+            if read_env is not self.env:
+                self._conflict(read_env)
+            return 'read'
+        self.assertEqual(replica.on_replica(self.env, read), 'read')
+        self.assertEqual(len(envs), 2)
+        self.assertNotEqual(envs[0].cr, self.env.cr)
+        self.assertEqual(envs[1], self.env)
+        with self.assertRaises(TransactionRollbackError):
+            with self.env.cr.savepoint():
+                replica.on_replica(
+                    self.env, lambda read_env: self._conflict(self.env))
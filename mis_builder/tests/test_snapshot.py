@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import openerp.tests.common as common
+
+from .accounting import create_move
+
+
+class TestSnapshot(common.TransactionCase):
+
+    def test_snapshot(self):
+        root_account = self.env['account.account'].search(
+            [('parent_id', '=', False)], limit=1)
+        report = self.env['mis.report'].create({
+            'name': 'Snapshot',
+            'kpi_ids': [(0, 0, {'name': 'debit',
+                                'description': 'Debit',
+                                'expression': 'deb[]'})],
+        })
+        instance = self.env['mis.report.instance'].create({
+            'name': 'Snapshot',
+            'report_id': report.id,
+            'root_account': root_account.id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'month',
+                                   'type': 'd',
+                                   'offset': -30,
+                                   'duration': 31})],
+        })
+
+        def debit():
+            return instance.compute()[0]['content'][0]['cols'][0]['val'] \
+                or 0.0
+
+        val = debit()
+        instance.freeze()
+        snapshot = instance.snapshot_id
+        self.assertTrue(snapshot)
+        self.assertFalse(snapshot.outdated)
+        # the frozen result is returned without computing the report
+        create_move(self.env, root_account, 100.0)
+        result = instance.compute()
+        self.assertEqual(result, snapshot.get_result())
+        self.assertAlmostEqual(debit(), val)
+        # the report is computed at another pivot date
+        instance.date = '2000-01-01'
+        self.assertNotEqual(instance.compute()[0]['header'],
+                            snapshot.get_result()[0]['header'])
+        instance.date = False
+        self.assertEqual(instance.compute(), snapshot.get_result())
+        instance.unfreeze()
+        self.assertFalse(instance.snapshot_id)
+        self.assertEqual(instance.snapshot_ids, snapshot)
+        self.assertAlmostEqual(debit(), val + 100.0)
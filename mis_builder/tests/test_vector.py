@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import openerp.tests.common as common
+
+from ..models.accounting_none import AccountingNone
+from ..models.vector import Vector
+
+
+class TestVector(common.TransactionCase):
+
+    def test_columnar_evaluation(self):
+        instance = self.env.ref('mis_builder.mis_report_instance_test')
+        param_model = self.env['ir.config_parameter']
+        param_model.set_param('mis_builder.columnar_evaluation', '0')
+        data = instance.compute()
+        param_model.set_param('mis_builder.columnar_evaluation', '1')
+        self.assertEqual(instance.compute(), data)
+
+    def test_columnar_evaluation_fallback(self):
+        # expressions whose result does not depend on the values of the
+        # vectors are evaluated for each period
+        report = self.env['mis.report'].create({
+            'name': 'Fallback',
+            'kpi_ids': [
+                (0, 0, {'name': 'debit',
+                        'description': 'Debit',
+                        'expression': 'deb[]'}),
+                (0, 0, {'name': 'conditional',
+                        'description': 'Conditional',
+                        'expression': '1 if debit is AccountingNone else 2'}),
+                (0, 0, {'name': 'identity',
+                        'description': 'Identity',
+                        'expression': '(debit is AccountingNone) + 3'}),
+                (0, 0, {'name': 'type_test',
+                        'description': 'Type test',
+                        'expression': 'isinstance(debit, float) and 5 or 6'}),
+            ],
+        })
+        instance = self.env['mis.report.instance'].create({
+            'name': 'Fallback',
+            'report_id': report.id,
+            'root_account': self.env['account.account'].search(
+                [('parent_id', '=', False)], limit=1).id,
+            'target_move': 'all',
+            'period_ids': [(0, 0, {'name': 'all',
+                                   'type': 'd',
+                                   'offset': -3650,
+                                   'duration': 7300}),
+                           (0, 0, {'name': 'empty',
+                                   'type': 'd',
+                                   'offset': -36500,
+                                   'duration': 1})],
+        })
+        self.env['ir.config_parameter'].set_param(
+            'mis_builder.columnar_evaluation', '1')
+        values = dict((row['kpi_name'], [col['val'] for col in row['cols']])
+                      for row in instance.compute()[0]['content'])
+        self.assertTrue(values['Debit'][0])
+        self.assertEqual(values['Conditional'], [2, 1])
+        self.assertEqual(values['Identity'], [3, 4])
+        self.assertEqual(values['Type test'], [5, 6])
+
+    def test_columnar_evaluation_errors(self):
+        # a kpi depending on a kpi in error in three periods
+        # ends in error
+        report = self.env['mis.report'].create({
+            'name': 'Errors',
+            'kpi_ids': [
+                (0, 0, {'name': 'zero',
+                        'description': 'Zero',
+                        'expression': '1 / 0'}),
+                (0, 0, {'name': 'next',
+                        'description': 'Next',
+                        'expression': 'zero + 1'}),
+            ],
+        })
+        instance = self.env['mis.report.instance'].create({
+            'name': 'Errors',
+            'report_id': report.id,
+            'root_account': self.env['account.account'].search(
+                [('parent_id', '=', False)], limit=1).id,
+            'period_ids': [(0, 0, {'name': 'month %d' % i,
+                                   'type': 'd',
+                                   'offset': -36500 - 31 * i,
+                                   'duration': 30}) for i in range(3)],
+        })
+        for columnar in ('0', '1'):
+            self.env['ir.config_parameter'].set_param(
+                'mis_builder.columnar_evaluation', columnar)
+            rows = dict((row['kpi_name'], row['cols'])
+                        for row in instance.compute()[0]['content'])
+            self.assertEqual([col['val_r'] for col in rows['Zero']],
+                             ['#DIV/0'] * 3)
+            self.assertEqual([col['val_r'] for col in rows['Next']],
+                             ['#ERR'] * 3)
+
+    def test_vector_accounting_none(self):
+        a = Vector([1.0, AccountingNone, AccountingNone])
+        b = Vector([2.0, 2.0, AccountingNone])
+        res = (a / b).values
+        self.assertEqual(res[0], 0.5)
+        self.assertEqual(res[1], 0.0)
+        self.assertTrue(res[2] is AccountingNone)
+        res = (b / a).values
+        self.assertEqual(res[0], 2.0)
+        self.assertEqual(res[1].code, '#DIV/0')
+        # AccountingNone as left operand gives a vector too
+        res = AccountingNone * b
+        self.assertTrue(isinstance(res, Vector))
+        self.assertEqual(res.values[0], 0.0)
+        self.assertTrue(res.values[2] is AccountingNone)
+        self.assertEqual((AccountingNone - b).values[0], -2.0)
@@ -3,3 +3,4 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from . import mis_builder_dashboard
+from . import mis_builder_index_advisor
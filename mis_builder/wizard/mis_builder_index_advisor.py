@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# © 2014-2015 ACSONE SA/NV (<http://acsone.eu>)
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+import re
+
+import openerp
+from openerp import api, fields, models, _
+from openerp.exceptions import AccessError
+
+from ..models.aep import MODE_VARIATION
+from ..models.query_result import get_query, get_sql
+
+_logger = logging.getLogger(__name__)
+
+# access paths of the accounting queries of the AEP:
+# (name, table, columns, predicate, description)
+INDEXES = [
+    ('mis_builder_aml_account_period_index', 'account_move_line',
+     ('account_id', 'period_id'), None,
+     "Move lines of accounts in fiscal periods"),
+    ('mis_builder_aml_account_date_index', 'account_move_line',
+     ('account_id', 'date'), None,
+     "Move lines of accounts between dates"),
+    ('mis_builder_am_posted_index', 'account_move',
+     ('id', ), "state = 'posted'",
+     "Posted journal entries"),
+]
+
+# the indexed columns and predicate of the output of pg_get_indexdef
+_INDEXDEF_RE = re.compile(r'^CREATE (?:UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ '
+                          r'USING \w+ \((.*?)\)(?: WHERE (.*))?$')
+# the type casts, parentheses, quotes and spaces added by pg_get_indexdef
+_CAST_RE = re.compile(r'::(?:"[^"]*"|character varying|double precision|'
+                      r'time(?:stamp)? with(?:out)? time zone|[a-z_]+)'
+                      r'(?:\[\])?')
+_NOISE_RE = re.compile(r'[\s()"]')
+
+
+def _normalize_expr(expr):
+    """ Normalize an indexed column or predicate, so the definitions of
+    the indexes can be compared with the output of pg_get_indexdef:
+    "((state)::text = 'posted'::text)" is "state='posted'" """
+    if not expr:
+        return None
+    return _NOISE_RE.sub('', _CAST_RE.sub('', expr))
+
+
+class MisBuilderIndexAdvisor(models.TransientModel):
+    """ Analyze the accounting queries of the report instances and
+    propose indexes on account_move_line for their access paths """
+
+    _name = 'mis.builder.index.advisor'
+
+    analyze = fields.Boolean(
+        string='Execute queries',
+        help="Use EXPLAIN ANALYZE to compare the plans, which executes "
+             "the sample queries. Otherwise, only the estimated costs "
+             "are compared.")
+    line_ids = fields.One2many(comodel_name='mis.builder.index.advisor.line',
+                               inverse_name='advisor_id',
+                               string='Indexes')
+    state = fields.Selection([('draft', 'Draft'),
+                              ('analyzed', 'Analyzed'),
+                              ('done', 'Done')],
+                             default='draft')
+
+    @api.model
+    def _get_sample_domain(self, instance, period, mode):
+        """ Return the domain of the largest accounting query of a
+        period of a report instance, or None if the report has no
+        accounting expression """
+        aep = instance.report_id._prepare_aep(
+            instance._get_root_accounts())
+        keys = [key for key in aep._map_account_ids if key[1] == mode]
+        if not keys:
+            return None
+        key = max(keys, key=lambda k: len(aep._map_account_ids[k]))
+        domain = list(key[0])
+        domain.extend(aep.get_aml_domain_for_dates(
+            period.date_from, period.date_to,
+            period.period_from, period.period_to,
+            mode, instance.target_move))
+        domain.append(('account_id', 'in', list(aep._map_account_ids[key])))
+        return domain
+
+    @api.model
+    def _get_access_paths(self):
+        """ Return the sample queries of the access paths of the report
+        instances, as a dictionary {index name: sql} """
+        res = {}
+        aml_model = self.env['account.move.line']
+        for instance in self.env['mis.report.instance'].search([]):
+            for period in instance.period_ids.filtered('valid'):
+                if period.period_from and period.period_to:
+                    index_name = 'mis_builder_aml_account_period_index'
+                else:
+                    index_name = 'mis_builder_aml_account_date_index'
+                names = [index_name]
+                if instance.target_move == 'posted':
+                    names.append('mis_builder_am_posted_index')
+                if all(name in res for name in names):
+                    continue
+                domain = self._get_sample_domain(
+                    instance, period, MODE_VARIATION)
+                if domain is None:
+                    continue
+                query = get_query(aml_model, domain)
+                sql, params = get_sql(
+                    query,
+                    ['account_move_line.account_id',
+                     'SUM(account_move_line.debit)',
+                     'SUM(account_move_line.credit)'],
+                    [])
+                sql += ' GROUP BY account_move_line.account_id'
+                sql = self.env.cr.mogrify(sql, params)
+                for name in names:
+                    res.setdefault(name, sql)
+        return res
+
+    @api.model
+    def _find_index(self, table, columns, predicate):
+        """ Return the name of an existing valid index on table starting
+        with columns, with the same predicate if it is partial """
+        self.env.cr.execute("""
+            SELECT i.relname, pg_get_indexdef(x.indexrelid)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass AND x.indisvalid
+        """, (table, ))
+        columns = [_normalize_expr(c) for c in columns]
+        predicate = _normalize_expr(predicate)
+        for name, indexdef in self.env.cr.fetchall():
+            match = _INDEXDEF_RE.match(indexdef)
+            if not match:
+                continue
+            indexed = [_normalize_expr(c) for c in match.group(1).split(',')]
+            if indexed[:len(columns)] == columns and \
+                    _normalize_expr(match.group(2)) == predicate:
+                return name
+        return None
+
+    @api.model
+    def _explain(self, sql, analyze=False, cr=None):
+        cr = cr or self.env.cr
+        cr.execute('EXPLAIN %s%s' % (analyze and 'ANALYZE ' or '', sql))
+        return '\n'.join(row[0] for row in cr.fetchall())
+
+    @api.multi
+    def _reopen(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'view_type': 'form',
+            'target': 'new',
+        }
+
+    @api.multi
+    def action_analyze(self):
+        self.ensure_one()
+        self.line_ids.unlink()
+        sql_by_name = self._get_access_paths()
+        line_model = self.env['mis.builder.index.advisor.line']
+        for name, table, columns, predicate, description in INDEXES:
+            if name not in sql_by_name:
+                continue
+            sql = sql_by_name[name]
+            existing = self._find_index(table, columns, predicate)
+            line_model.create({
+                'advisor_id': self.id,
+                'name': name,
+                'description': description,
+                'definition': line_model._get_definition(
+                    name, table, columns, predicate),
+                'existing_index': existing,
+                'selected': not existing,
+                'sample_query': sql,
+                'plan_before': self._explain(sql, self.analyze),
+            })
+        self.state = 'analyzed'
+        return self._reopen()
+
+    @api.multi
+    def action_create_indexes(self):
+        """ Create the selected indexes concurrently, so the journal
+        entries can still be written meanwhile.
+
+        CREATE INDEX CONCURRENTLY can not run in a transaction, and waits
+        for the end of the transactions started before it: the current
+        transaction is committed, and the indexes are created on a cursor
+        in autocommit mode. In test mode, where the transaction can not be
+        committed, the indexes are created in the current transaction,
+        blocking the writes on their table until its end.
+        """
+        self.ensure_one()
+        if not self.env.user.has_group('base.group_system'):
+            raise AccessError(_("Only administrators can create indexes."))
+        lines = self.line_ids.filtered(
+            lambda l: l.selected and not l.existing_index)
+        definitions = [(line.name, line.definition) for line in lines]
+        sample_queries = [(line, line.sample_query) for line in self.line_ids]
+        analyze = self.analyze
+        if openerp.tools.config['test_enable'] or \
+                getattr(self.pool, 'test_cr', None) is not None:
+            cr = self.env.cr
+            definitions = [(name, definition.replace(' CONCURRENTLY', ''))
+                           for name, definition in definitions]
+        else:
+            self.env.cr.commit()
+            cr = openerp.registry(self.env.cr.dbname).cursor()
+            cr.autocommit(True)
+        try:
+            for name, definition in definitions:
+                _logger.info("creating index %s", name)
+                try:
+                    cr.execute(definition)
+                except Exception:
+                    # a failed concurrent build leaves an invalid index
+                    if cr is not self.env.cr:
+                        cr.execute('DROP INDEX IF EXISTS %s' % name)
+                    raise
+            for table in set(index[1] for index in INDEXES):
+                cr.execute('ANALYZE %s' % table)
+            plans = [(line, self._explain(sql, analyze, cr=cr))
+                     for line, sql in sample_queries]
+        finally:
+            if cr is not self.env.cr:
+                cr.close()
+        for line in lines:
+            line.existing_index = line.name
+        for line, plan in plans:
+            line.plan_after = plan
+        self.state = 'done'
+        return self._reopen()
+
+
+class MisBuilderIndexAdvisorLine(models.TransientModel):
+
+    _name = 'mis.builder.index.advisor.line'
+
+    advisor_id = fields.Many2one(comodel_name='mis.builder.index.advisor',
+                                 required=True, ondelete='cascade')
+    name = fields.Char(string='Index', required=True, readonly=True)
+    description = fields.Char(string='Access path', readonly=True)
+    definition = fields.Text(string='Definition', readonly=True)
+    existing_index = fields.Char(
+        string='Existing index', readonly=True,
+        help="An existing index covering this access path")
+    selected = fields.Boolean(string='Create')
+    sample_query = fields.Text(string='Sample query', readonly=True)
+    plan_before = fields.Text(string='Plan before', readonly=True)
+    plan_after = fields.Text(string='Plan after', readonly=True)
+
+    @api.model
+    def _get_definition(self, name, table, columns, predicate):
+        definition = 'CREATE INDEX CONCURRENTLY %s ON %s (%s)' % \
+            (name, table, ', '.join(columns))
+        if predicate:
+            definition += ' WHERE %s' % predicate
+        return definition
@@ -20,25 +20,72 @@ class MisReportInstance(models.Model):
         }
         return res
 
+    def _compute(self, report_id, *args, **kwargs):
+        # resolve the analytic account and its children once for
+        # all the periods and accounting queries of the computation
+        val = self.env.context.get('account_analytic_id')
+        if val and 'mis_analytic_account_ids' not in self.env.context:
+            analytic_account_ids = self.env['account.analytic.account'].\
+                search([('id', 'child_of', val)]).ids
+            self = self.with_context(
+                mis_analytic_account_ids=analytic_account_ids)
+        return super(MisReportInstance, self)._compute(
+            report_id, *args, **kwargs)
+
 
 class MisReportInstancePeriod(models.Model):
     _inherit = 'mis.report.instance.period'
 
+    @api.multi
+    def _get_analytic_domain(self, field_name):
+        """ Return the domain filtering field_name on the analytic
+        account to filter on and its children, or an empty domain if
+        there is no analytic filter.
+
+        During computations, the children are resolved once (see
+        MisReportInstance._compute). Otherwise, eg in the domain of the
+        drilldown, the domain keeps the child_of condition on the
+        analytic account. """
+        self.ensure_one()
+        val = self.env.context.get('account_analytic_id')
+        if not val:
+            return []
+        analytic_account_ids = self.env.context.get(
+            'mis_analytic_account_ids')
+        if analytic_account_ids is None:
+            return [(field_name, 'child_of', val)]
+        return [(field_name, 'in', analytic_account_ids)]
+
     @api.multi
     def _get_additional_move_line_filter(self):
         self.ensure_one()
         res = super(MisReportInstancePeriod, self).\
             _get_additional_move_line_filter()
-        val = self.env.context.get('account_analytic_id')
-        if val:
-            res.append(('analytic_account_id', 'child_of', val))
+        res.extend(self._get_analytic_domain('analytic_account_id'))
         return res
 
+    @api.model
+    def _get_query_analytic_field(self, query):
+        """ Return the name of the stored field of the query model
+        referencing analytic accounts, or None """
+        model = self.env[query.model_id.model]
+        names = []
+        for name, field in model._fields.items():
+            if field.type == 'many2one' and field.store and \
+                    field.comodel_name == 'account.analytic.account':
+                names.append(name)
+        for name in ('analytic_account_id', 'account_analytic_id'):
+            if name in names:
+                return name
+        return names and sorted(names)[0] or None
+
     @api.multi
     def _get_additional_query_filter(self, query):
         self.ensure_one()
         res = super(MisReportInstancePeriod, self).\
-            _get_additional_move_line_filter()
-        # TODO filter on analytic account if query.model_id has
-        #      a field of type account.analytic.account
+            _get_additional_query_filter(query)
+        if self.env.context.get('account_analytic_id'):
+            field_name = self._get_query_analytic_field(query)
+            if field_name:
+                res.extend(self._get_analytic_domain(field_name))
         return res